@@ -2,9 +2,14 @@ import os
 import sys
 import json
 import glob
+import ast
 import time
+import fnmatch
+import hashlib
 from pathlib import Path
 import shutil
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
@@ -13,12 +18,128 @@ import uproot
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
-from GatorUtils import setup_logger
-from processor import GatorFileProcessor
+from GatorUtils import setup_logger, JournaledStateStore, PromTextfileExporter
+from GatorTrigRateStore import GatorTrigRateStore
+from processor import GatorFileProcessor, GatorProcMetrics, GatorProcGraph
+
+class TrigRateSelection:
+    '''
+    Event selection of the trigger rate, compiled once from the "TrigRate" configuration.
+
+    The queries are validated when the configuration is loaded (syntax, allowed operations, boolean result and, with
+    "checkColumns", the columns they use) and joined in a single boolean expression, which is evaluated on the dataframe in one pass (by numexpr, when installed) without copying it.
+    Calling the object on a dataframe returns the number of events in the energy window and the number of those
+    also passing the queries.
+    '''
+    # Functions supported by the pandas/numexpr expression evaluation
+    EVAL_FUNCS = {'abs', 'sqrt', 'exp', 'expm1', 'log', 'log1p', 'log10', 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'sinh', 'cosh', 'tanh'}
+    ALLOWED_NODES = (
+        ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Constant, ast.List, ast.Tuple, ast.Load,
+        ast.And, ast.Or, ast.Not, ast.Invert, ast.USub, ast.UAdd,
+        ast.BitAnd, ast.BitOr, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+        ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+    )
+
+    def __init__(self, trigrate_conf, energy_col:str):
+        self.energy_col = energy_col
+        self.min_energy = float(trigrate_conf['MinTrapEnergy'])
+        self.max_energy = float(trigrate_conf['MaxTrapEnergy'])
+
+        if self.min_energy > self.max_energy:
+            raise ValueError(f'TrigRateSelection: "MinTrapEnergy" ({self.min_energy}) is larger than "MaxTrapEnergy" ({self.max_energy}).')
+        #
+
+        self.queries = list(trigrate_conf['Queries'])
+
+        columns = {self.energy_col}
+        for query in self.queries:
+            columns.update(self._validate(query))
+        #
+        self.columns = sorted(columns) #The only columns needed to apply the selection
+
+        # The queries are applied in sequence in the original definition, which is the same as their logical and
+        self.query_expr = ' & '.join(f'({query})' for query in self.queries) if len(self.queries)>0 else None
+    #
+
+    def __call__(self, df):
+        missing_cols = [col for col in self.columns if not col in df.columns]
+        if len(missing_cols)>0:
+            raise KeyError(f'TrigRateSelection: the columns {missing_cols} used by the selection are missing in the dataframe.')
+        #
+
+        energy = df[self.energy_col].to_numpy()
+        mask = (energy >= self.min_energy) & (energy <= self.max_energy)
+        n_evs_before_cuts = int(np.count_nonzero(mask))
+
+        if self.query_expr is None:
+            return n_evs_before_cuts, n_evs_before_cuts
+        #
+
+        sel = np.asarray(df.eval(self.query_expr))
+        if sel.dtype!=bool:
+            raise TypeError(f'TrigRateSelection: the queries {self.queries} give "{sel.dtype}" values instead of booleans.')
+        #
+        mask &= sel
+        return n_evs_before_cuts, int(np.count_nonzero(mask))
+    #
+
+    def checkColumns(self, available_cols):
+        # Raises if the selection uses columns that are not among the given ones (e.g. the ones produced by the processors)
+        missing_cols = [col for col in self.columns if not col in available_cols]
+        if len(missing_cols)>0:
+            raise ValueError(f'TrigRateSelection: the columns {missing_cols} used by the selection are not produced by the configured processors.')
+        #
+        return self
+    #
+
+    def _validate(self, query):
+        # Returns the names of the columns used by the query, or raises if the query is not a valid selection expression
+        try:
+            tree = ast.parse(query.strip(), mode='eval')
+        except SyntaxError as err:
+            raise ValueError(f'TrigRateSelection: invalid query "{query}": {err.msg}.') from None
+        #
+
+        names = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, TrigRateSelection.ALLOWED_NODES):
+                raise ValueError(f'TrigRateSelection: invalid query "{query}": "{type(node).__name__}" expressions are not allowed.')
+            #
+            if isinstance(node, ast.Call):
+                if (not isinstance(node.func, ast.Name)) or (not node.func.id in TrigRateSelection.EVAL_FUNCS) or (len(node.keywords)>0):
+                    raise ValueError(f'TrigRateSelection: invalid query "{query}": only calls to the functions {sorted(TrigRateSelection.EVAL_FUNCS)} are allowed.')
+                #
+            elif isinstance(node, ast.Name):
+                names.add(node.id)
+            #
+        #
+        if not self._isBoolean(tree.body):
+            raise ValueError(f'TrigRateSelection: invalid query "{query}": it is not a boolean expression (use a comparison).')
+        #
+        return names - TrigRateSelection.EVAL_FUNCS
+    #
+
+    def _isBoolean(self, node):
+        # Whether the expression can give booleans: comparisons and their logical combinations, or a (boolean) column, whose
+        # data type is only known when it is evaluated (see __call__)
+        if isinstance(node, (ast.Compare, ast.BoolOp)):
+            return True
+        #
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)):
+            return self._isBoolean(node.operand)
+        #
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+            return self._isBoolean(node.left) and self._isBoolean(node.right)
+        #
+        return isinstance(node, ast.Name) and (not node.id in TrigRateSelection.EVAL_FUNCS)
+    #
+#
 
 class GatorDaqProc:
     FILES_EXT = {".root"}
     PROC_STATE_FNAME = '.proc_state' #This is only the name prefix
+    PROC_STATE_COMPACT_EVERY = 256 #Number of journal records after which the proc state snapshot is rewritten
+    TRIG_RATE_ENERGY_COL = 'wf1_energy_trap' #Column used for the energy window of the trigger rate selection
     
     def __init__(self, config_fpath:str=""):
         if config_fpath=="":
@@ -47,26 +168,83 @@ class GatorDaqProc:
 
         self.chsmap = self.config_dict['chs_map']
 
+        self.proc_state_compact_every = GatorDaqProc.PROC_STATE_COMPACT_EVERY
+        if 'ProcStateCompactEvery' in self.config_dict:
+            self.proc_state_compact_every = int(self.config_dict['ProcStateCompactEvery'])
+        #
+
+        # The daemon only needs the dataframes: by default the waveforms are released as soon as they are not needed any more
+        self.low_memory = bool(self.config_dict.get('LowMemory', True))
+
+        # With ProcThreads>1 the channels of a file are processed in parallel by a pool of threads (shared by all the files)
+        self.proc_executor = None
+        if int(self.config_dict.get('ProcThreads', 1)) > 1:
+            self.proc_executor = ThreadPoolExecutor(max_workers=int(self.config_dict['ProcThreads']), thread_name_prefix='GatorDaqProc')
+        #
+
         self.loop_sleep_sec = 600 #Default sleep is 10 mins
         if('loop_sleep_sec' in self.config_dict):
             self.loop_sleep_sec = int(self.config_dict['loop_sleep_sec'])
 
+        # Optional spool directory of the completion markers written by GatorDaqSync: between two full passes it is
+        # polled every NotifyPollSec and the notified files are processed right away
+        self.notify_spool_dir = self.config_dict.get('NotifySpoolDir')
+        self.notify_poll_sec = float(self.config_dict.get('NotifyPollSec', 2))
+
         if 'logging' in self.config_dict:
             self.logger = setup_logger(self.config_dict['logging'])
         else:
             self.logger = setup_logger()
+
+        # The waveforms processors are stateless: they are built (and their configuration validated) once and used for every file
+        try:
+            self.proc_graph = GatorProcGraph.fromChsMap(self.chsmap, executor=self.proc_executor)
+        except Exception as err:
+            self.logger.critical(f'GatorDaqProc.__init__: invalid "chs_map" configuration in "{self.config_fpath}": {err!r}')
+            raise
+        #
+        # Saved with every processed file (and in the proc state) to know which processors must run again when the config changes
+        self.proc_hashes = self.proc_graph.configHashes()
+
+        # Compile (and validate) the trigger rate selection once, also against the columns of the processors: an invalid query
+        # stops here, not at every file
+        self.trigrate_sel = None
+        if 'TrigRate' in self.config_dict:
+            try:
+                self.trigrate_sel = TrigRateSelection(self.config_dict['TrigRate'], energy_col=GatorDaqProc.TRIG_RATE_ENERGY_COL)
+                self.trigrate_sel.checkColumns(self.proc_graph.outputCols())
+            except Exception as err:
+                self.logger.critical(f'GatorDaqProc.__init__: invalid "TrigRate" configuration in "{self.config_fpath}": {err}')
+                raise
+            #
+        #
+
+        # Instrumentation of the processing: the metrics of each file go in the proc state and (optionally) in a Prometheus textfile
+        self.metrics_trace_memory = False
+        self.metrics_exporter = None
+        if 'Metrics' in self.config_dict:
+            self.metrics_trace_memory = bool(self.config_dict['Metrics'].get('TraceMemory', False))
+            if 'PromTextFile' in self.config_dict['Metrics']:
+                self.metrics_exporter = PromTextfileExporter(self.config_dict['Metrics']['PromTextFile'])
+            #
+        #
+
+        # Optional binary store of the trigger rates (can be used together with the text "TrigRateFile" or in place of it)
+        self.trigrate_store = None
+        if ('TrigRate' in self.config_dict) and ('TrigRateStore' in self.config_dict['TrigRate']):
+            self.trigrate_store = GatorTrigRateStore(self.config_dict['TrigRate']['TrigRateStore'], logger=self.logger)
+        #
     #
 
-    def _load_proc_state_file(self, _path):
-        if not os.path.exists(_path):
-            return {}
+    def _load_proc_state_file(self, _path, read_only:bool=False):
+        # The state is kept in a journaled store: every file result is committed as soon as it is available
+        # and a crash in the middle of a directory loses at most the file that was being processed.
+        # With "read_only" the files are not touched (no lock file, no truncation): the store is only read
         try:
-            with open(_path, "r") as f:
-                return json.load(f)
-        
+            return JournaledStateStore(_path, compact_every=self.proc_state_compact_every, logger=self.logger).load(read_only=read_only)
         except Exception as err:
-            self.logger.error(f'GatorDaqProc._load_sync_state_file: failed to read the proc state file "{_path}": {err}', exc_info=True)
-            return {}
+            self.logger.error(f'GatorDaqProc._load_proc_state_file: failed to read the proc state file "{_path}": {err}', exc_info=True)
+            return JournaledStateStore(_path, compact_every=self.proc_state_compact_every, logger=self.logger)
     #
 
     def _load_DAQ_config_file(self, _fpath):
@@ -79,10 +257,9 @@ class GatorDaqProc:
         #
     #
 
-    def _save_proc_state_file(self, proc_state_fpath, proc_state_dict):
-        with open(proc_state_fpath, "w") as f:
-            json.dump(proc_state_dict, f, indent=2)
-        #
+    def _close_proc_state_file(self, proc_state_dict):
+        # Fold the journal into the snapshot file in background: the next directory can be processed in the meanwhile
+        proc_state_dict.close(background=True)
     #
 
     def _search_config_file(self):
@@ -144,7 +321,7 @@ class GatorDaqProc:
                     self.logger.info(f'GatorDaqProc.run: start of processing of the "{self.staging_base_dir}" directory tree into the "{self.proc_base_dir}" directory tree of processed files.')
                     self.ProcTree()
                 finally:
-                    time.sleep(self.loop_sleep_sec)
+                    self._wait_next_loop()
                 #
             #
         except KeyboardInterrupt:
@@ -152,6 +329,84 @@ class GatorDaqProc:
             return
     #
 
+    def _wait_next_loop(self):
+        if self.notify_spool_dir is None:
+            time.sleep(self.loop_sleep_sec)
+            return
+        #
+        t_next_loop = time.time() + self.loop_sleep_sec
+        while True:
+            try:
+                self.ProcNotified()
+            except Exception:
+                self.logger.exception(f'GatorDaqProc._wait_next_loop: failed to process the files notified in "{self.notify_spool_dir}".')
+            #
+            remaining_sec = t_next_loop - time.time()
+            if remaining_sec <= 0:
+                return
+            #
+            time.sleep(min(self.notify_poll_sec, remaining_sec))
+        #
+    #
+
+    def ProcNotified(self):
+        '''
+        Process the files notified by the completion markers in the spool directory, grouped by run directory, then remove the markers.
+        Returns the number of notified files that were found in the staging directory.
+        '''
+        spool_dir = Path(self.notify_spool_dir)
+        if not spool_dir.is_dir():
+            return 0
+        #
+        marker_fpaths = sorted(fpath for fpath in spool_dir.iterdir() if (fpath.suffix=='.json') and (not fpath.name.startswith('.')))
+        if len(marker_fpaths)==0:
+            return 0
+        #
+
+        files_by_dir = dict()
+        for marker_fpath in marker_fpaths:
+            try:
+                with open(marker_fpath, 'r') as f:
+                    relpath = Path(os.path.normpath(json.load(f)['relpath']))
+                #
+            except Exception as err:
+                self.logger.warning(f'GatorDaqProc.ProcNotified: skipping the unreadable marker "{marker_fpath}": {err}')
+                continue
+            #
+            # Same files as ProcTree: dataset/run/file at most, with the processed extensions
+            if relpath.is_absolute() or ('..' in relpath.parts) or (len(relpath.parts) > 3) or (not relpath.suffix in GatorDaqProc.FILES_EXT):
+                self.logger.warning(f'GatorDaqProc.ProcNotified: ignoring the marker "{marker_fpath}" of the file "{relpath}".')
+                continue
+            #
+            if not (Path(self.staging_base_dir) / relpath).exists():
+                continue
+            #
+            f_list = files_by_dir.setdefault(str(relpath.parent), list())
+            if not relpath.name in f_list:
+                f_list.append(relpath.name)
+            #
+        #
+
+        for reldir, f_list in files_by_dir.items():
+            self.logger.info(f'GatorDaqProc.ProcNotified: processing {len(f_list)} notified files of "{reldir}".')
+            try:
+                self.ProcDirectory(reldir, f_list)
+            except Exception:
+                self.logger.exception(f'GatorDaqProc.ProcNotified: failed to process the notified files of "{reldir}".')
+            #
+        #
+
+        # The files that failed are retried by the next full pass
+        for marker_fpath in marker_fpaths:
+            try:
+                marker_fpath.unlink()
+            except FileNotFoundError:
+                pass
+            #
+        #
+        return sum(len(f_list) for f_list in files_by_dir.values())
+    #
+
     def ProcTree(self):
         # First change directory
         os.chdir(self.staging_base_dir)
@@ -263,7 +518,9 @@ class GatorDaqProc:
             #
 
             if process_this_file:
-                proc_state_dict[fname] = dict(proc_timestamp = proc_res['timestamp'])
+                proc_state_entry = dict(proc_timestamp = proc_res['timestamp'], ProcHashes = proc_res['ProcHashes'])
+            else:
+                proc_state_entry = dict(proc_state_dict[fname])
             #
 
             trigrate_dict = None # This means that the trigger rate was not processed for this file (or it has failed)
@@ -280,7 +537,25 @@ class GatorDaqProc:
             #
 
             if trigrate_dict is not None:
-                proc_state_dict[fname]['TrigRate'] = trigrate_dict
+                proc_state_entry['TrigRate'] = trigrate_dict
+            #
+
+            # Only the files actually processed count in the exported metrics (not the trigger rate only passes)
+            metrics_dict = self._record_metrics(relpath, fname, proc_res['metrics'], export=process_this_file)
+            if process_this_file:
+                proc_state_entry['Metrics'] = metrics_dict
+            elif trigrate_dict is not None:
+                proc_state_entry['TrigRateMetrics'] = metrics_dict
+            #
+
+            # Commit the result of this file right away (and before archiving it)
+            if process_this_file or (trigrate_dict is not None):
+                try:
+                    proc_state_dict.commit(fname, proc_state_entry)
+                except Exception:
+                    self.logger.exception(f'GatorDaqProc.ProcDirectory: failed to update the proc state file "{proc_state_fpath}" for the file "{fname}".')
+                    continue
+                #
             #
             
             if self.config_dict['ArchiveFiles']['TrigRateRequired'] and (trigrate_dict is None):
@@ -296,8 +571,30 @@ class GatorDaqProc:
             #
         #
 
-        # Update the status (json) file about the processing state of the directory with the proc_state_dict object
-        self._save_proc_state_file(proc_state_fpath, proc_state_dict)
+        # Every file result is already committed in the journal of the proc state: compact it into the json file
+        self._close_proc_state_file(proc_state_dict)
+    #
+
+    def _record_metrics(self, relpath, fname, metrics, export:bool=True):
+        metrics_dict = metrics.end().toDict()
+
+        slowest_stage = metrics.slowestStage()
+        msg = f'GatorDaqProc._record_metrics: file "{fname}": {metrics_dict.get("n_events", 0)} events in {metrics_dict["wall_sec"]:.2f} s (cpu {metrics_dict["cpu_sec"]:.2f} s'
+        if 'events_per_sec' in metrics_dict:
+            msg += f', {metrics_dict["events_per_sec"]:.1f} events/s'
+        msg += f', peak rss {metrics_dict["peak_rss_mb"]:.0f} MB)'
+        if slowest_stage is not None:
+            msg += f'; slowest stage: "{slowest_stage}" ({metrics_dict["stages"][slowest_stage]["wall_sec"]:.2f} s)'
+        self.logger.info(msg)
+
+        if export and (self.metrics_exporter is not None):
+            try:
+                self.metrics_exporter.update(metrics_dict, labels={'run': str(relpath)})
+            except Exception:
+                self.logger.exception(f'GatorDaqProc._record_metrics: failed to write the metrics file "{self.metrics_exporter.fpath}".')
+            #
+        #
+        return metrics_dict
     #
 
     def ProcFile(self, fpath, proc_dir:Path, daq_conf_dict, trig_rate_only:bool=False):
@@ -309,9 +606,13 @@ class GatorDaqProc:
         '''
         proc_dict = dict()
 
+        # Collected along the processing of the file and finalized by the caller
+        metrics = GatorProcMetrics(trace_memory=self.metrics_trace_memory).begin()
+        proc_dict['metrics'] = metrics
+
         try:
             if not trig_rate_only:
-                fileProcessor = GatorFileProcessor(fpath=fpath, chs_map=self.chsmap)
+                fileProcessor = GatorFileProcessor(fpath=fpath, chs_map=self.chsmap, metrics=metrics, low_memory=self.low_memory, proc_graph=self.proc_graph)
         except Exception as err:
             self.logger.exception(f'GatorDaqProc.ProcFile: failed to instance the file processor for file "{fpath}".')
             return None
@@ -328,6 +629,7 @@ class GatorDaqProc:
         #Get the unix timestamp
         if not trig_rate_only:
             proc_dict['timestamp'] = int(time.time()+0.5) #This tells when the processing has actually finished
+            proc_dict['ProcHashes'] = self.proc_hashes
 
         # Here I should have a dataframe to be used and dumped in the processed file
         proc_df = None
@@ -342,36 +644,39 @@ class GatorDaqProc:
         fname = Path(fpath).with_suffix(".npy").name
         proc_fpath = Path(proc_dir) / fname
 
-        data_export = None
-
-        if not trig_rate_only:
-            data_export = {
-                "DaqSettings": daq_conf_dict,
-                "ProcSettings": self.config_dict,
-                "WfsLength": int(daq_conf_dict['boards'][0]["WfsLen"]),
-                "Data":{
-                    "Cols": list(proc_df.columns),
-                    "Types": {col: str(proc_df[col].dtype) for col in proc_df.columns},
-                    "Arr": proc_df.to_numpy(copy=True),
-                }    
-            }
-        #
-
-        #Add the metadata found in the rootfile
+        #Read the metadata found in the rootfile
         try:
-            metadata_dict = self.ReadMetadataFromRootFile(fpath)
+            with metrics.stage('metadata'):
+                metadata_dict = self.ReadMetadataFromRootFile(fpath)
+            #
         except Exception as err:
             self.logger.exception(f'GatorDaqProc.ProcFile: failed to read the DAQ metadata from file "{fpath}".')
             metadata_dict = None
         #
 
-        if (not trig_rate_only) and (metadata_dict is not None):
-            data_export.update(metadata_dict)
-            proc_dict['daq_metadata'] = metadata_dict
-        #
+        if not trig_rate_only:
+            with metrics.stage('save'):
+                data_export = {
+                    "DaqSettings": daq_conf_dict,
+                    "ProcSettings": self.config_dict,
+                    "WfsLength": int(daq_conf_dict['boards'][0]["WfsLen"]),
+                    "ProcHashes": self.proc_hashes,
+                    "ProcCols": self.proc_graph.procCols(list(proc_df.columns)),
+                    "Data":{
+                        "Cols": list(proc_df.columns),
+                        "Types": {col: str(proc_df[col].dtype) for col in proc_df.columns},
+                        "Arr": proc_df.to_numpy(copy=True),
+                    }    
+                }
+
+                #Add the metadata found in the rootfile
+                if metadata_dict is not None:
+                    data_export.update(metadata_dict)
+                    proc_dict['daq_metadata'] = metadata_dict
+                #
 
-        if (not trig_rate_only):
-            np.save(proc_fpath, data_export) #This implicitly uses pickles
+                np.save(proc_fpath, data_export) #This implicitly uses pickles
+            #
             self.logger.info(f'GatorDaqProc.ProcFile: File "{Path(fpath).name}" successfully processed into "{proc_fpath}" numpy file.')
         #
 
@@ -383,7 +688,10 @@ class GatorDaqProc:
         if trig_rate_only:
             self.logger.debug(f'GatorDaqProc.ProcFile: only trigger rate processing requested for file "{Path(fpath).name}". Loading processed data from "{proc_fpath}".')
             try:
-                proc_dict['df'] = self.LoadDfFromProcessedFile(proc_fpath=proc_fpath) #This is the only thing that is needed from this dictionary
+                with metrics.stage('load_processed'):
+                    proc_dict['df'] = self.LoadDfFromProcessedFile(proc_fpath=proc_fpath) #This is the only thing that is needed from this dictionary
+                #
+                metrics.n_events = len(proc_dict['df'])
             except Exception:
                 self.logger.exception(f'GatorDaqProc.ProcFile: failed to load the dataframe from the the processed file "{proc_fpath}".')
                 return proc_dict
@@ -391,13 +699,15 @@ class GatorDaqProc:
         #
 
         if metadata_dict is not None:
-            self.ProcTrigRate(proc_dict = proc_dict,
-                          fname = Path(proc_fpath).name,
-                          daq_metadata = {
-                                            **metadata_dict,
-                                            'WfsLength': int(daq_conf_dict['boards'][0]["WfsLen"])
-                                          }
-                          )
+            with metrics.stage('trigrate'):
+                self.ProcTrigRate(proc_dict = proc_dict,
+                              fname = Path(proc_fpath).name,
+                              daq_metadata = {
+                                                **metadata_dict,
+                                                'WfsLength': int(daq_conf_dict['boards'][0]["WfsLen"])
+                                              }
+                              )
+            #
         
 
         return proc_dict
@@ -415,41 +725,23 @@ class GatorDaqProc:
             return
         #
 
-        #Get the number of events
-        _df = proc_dict['df'].copy()
-        _df = _df[ (_df['wf1_energy_trap']>=float(trigrate_conf['MinTrapEnergy'])) & (_df['wf1_energy_trap']<=float(trigrate_conf['MaxTrapEnergy'])) ]
-
-        n_evs_before_cuts = _df.shape[0]
-
-        for query in trigrate_conf['Queries']:
-            try:
-                _df = _df.query(query)
-            except Exception:
-                self.logger.exception(f'GatorDaqProc.ProcTrigRate: Invalid query "{query}" in TrigRate configuration. Cannot proceed to the trigger rate calculation for "{fname}" file')
-                return
-            #
+        try:
+            trigrate_dict = ComputeTrigRate(df=proc_dict['df'], trigrate_sel=self.trigrate_sel, daq_metadata=daq_metadata)
+        except Exception:
+            self.logger.exception(f'GatorDaqProc.ProcTrigRate: failed to apply the event selection of the TrigRate configuration. Cannot proceed to the trigger rate calculation for "{fname}" file')
+            return
         #
 
-        n_evs = _df.shape[0]
-        n_evs_err = np.sqrt(n_evs)
-
-        #Now calculate the effective run time
-        runtime_eff = daq_metadata['FileRunTime'] - (n_evs_before_cuts-n_evs)/daq_metadata['SampFreq']*daq_metadata['WfsLength']
-
-        trigrate_dict = dict(proc_timestamp=int(time.time()+0.5)) #This is useful only if the trigger rate is actually processed at a different time wrt the main processing time
-        
-        tstart = daq_metadata['StartUnixTime']
-        tstop = daq_metadata['StopUnixTime']
-        trigrate_dict['trig_timestamp'] = int((tstart+tstop)/2. + 0.5)
-        trigrate_dict['trig_rate'] = n_evs/runtime_eff
-        trigrate_dict['trig_rate_err'] = n_evs_err/runtime_eff
-
         proc_dict['TrigRate'] = trigrate_dict
 
         if 'TrigRateFile' in trigrate_conf:
             #Append one line to the trigrate archive file
             self.WriteTrigRate(trigrate_conf['TrigRateFile'], proc_dict)  
         #
+
+        if self.trigrate_store is not None:
+            self.WriteTrigRateStore(self.trigrate_store, proc_dict)
+        #
     #
 
     def ReadMetadataFromRootFile(self, fpath):
@@ -465,21 +757,361 @@ class GatorDaqProc:
         return metadata_dict
     #
 
-    def LoadDfFromProcessedFile(self, proc_fpath):
+    def LoadDfFromProcessedFile(self, proc_fpath, columns:list=None):
+        df, _ = LoadProcessedFile(proc_fpath, columns=columns)
+        return df
+    #
+
+    def RecomputeTrigRates(self, runs:list=None, tstart:int=None, tstop:int=None, version:str=None, out_fpath=None, n_workers:int=None, overwrite:bool=False):
+        '''
+        Recompute the trigger rate of the already processed files with the current "TrigRate" settings, without touching
+        the proc state files nor the original trigger rate file. The files are selected by run (fnmatch patterns on the
+        "dataset/run" relative paths of the processed tree) and/or by the trigger time range [tstart, tstop] (unix time).
+        The files are processed by a pool of processes. Each processed file is still read and unpickled as a whole (the .npy
+        holds a single pickled dictionary, so its columns cannot be read one at a time); only the columns needed by the
+        selection are then converted into the dataframe.
+        The result is a new trigger rate series written in the same text format of the "TrigRateFile", named after
+        the version tag (by default a short hash of the selection settings), plus a json sidecar describing it.
+        Returns the path of the written series.
+        '''
+        if not 'TrigRate' in self.config_dict:
+            raise KeyError('GatorDaqProc.RecomputeTrigRates: the "TrigRate" section is missing in the configuration.')
+        #
+        trigrate_conf = self.config_dict['TrigRate']
+
+        if version is None:
+            version = TrigRateConfigHash(trigrate_conf)
+        #
+
+        if out_fpath is None:
+            if not 'TrigRateFile' in trigrate_conf:
+                raise ValueError('GatorDaqProc.RecomputeTrigRates: no output path given and no "TrigRateFile" in the "TrigRate" configuration.')
+            #
+            orig_fpath = Path(trigrate_conf['TrigRateFile'])
+            out_fpath = orig_fpath.with_name(f'{orig_fpath.stem}.{version}{orig_fpath.suffix}')
+        #
+        out_fpath = Path(out_fpath)
+
+        if out_fpath.exists() and (not overwrite):
+            raise FileExistsError(f'GatorDaqProc.RecomputeTrigRates: the trigger rate series "{out_fpath}" already exists.')
+        #
+
+        # The binary series is named after the version only (not after out_fpath): it is checked on its own
+        out_store_dir = None
+        if self.trigrate_store is not None:
+            store_dir = self.trigrate_store.store_dir
+            out_store_dir = store_dir.with_name(f'{store_dir.name}.{version}')
+            if out_store_dir.exists() and (not overwrite):
+                raise FileExistsError(f'GatorDaqProc.RecomputeTrigRates: the trigger rate store "{out_store_dir}" already exists.')
+            #
+        #
+
+        proc_flist = self._select_processed_files(runs=runs, tstart=tstart, tstop=tstop)
+        self.logger.info(f'GatorDaqProc.RecomputeTrigRates: recomputing the trigger rate of {len(proc_flist)} processed files into "{out_fpath}" (version "{version}").')
+
+        worker = partial(_recompute_file_trig_rate, trigrate_sel=self.trigrate_sel, tstart=tstart, tstop=tstop)
+
+        trigrates_lst = list()
+        n_failed = 0
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for proc_fpath, trigrate_dict, err in executor.map(worker, proc_flist, chunksize=8):
+                if err is not None:
+                    n_failed += 1
+                    self.logger.error(f'GatorDaqProc.RecomputeTrigRates: failed to recompute the trigger rate for "{proc_fpath}": {err}')
+                    continue
+                #
+                if trigrate_dict is not None:
+                    trigrates_lst.append(trigrate_dict)
+                #
+            #
+        #
+        trigrates_lst.sort(key=lambda el: el['trig_timestamp'])
+
+        out_fpath.parent.mkdir(parents=True, exist_ok=True)
+        tmp_fpath = out_fpath.with_name(out_fpath.name + '.tmp')
+        with open(tmp_fpath, 'w') as f:
+            for trigrate_dict in trigrates_lst:
+                f.write(f'{int(trigrate_dict["trig_timestamp"])}  {trigrate_dict["trig_rate"]}  {trigrate_dict["trig_rate_err"]}\n')
+            #
+        #
+        os.replace(tmp_fpath, out_fpath)
+
+        with open(out_fpath.with_name(out_fpath.name + '.json'), 'w') as f:
+            json.dump({
+                        'version': version,
+                        'created': int(time.time()+0.5),
+                        'TrigRate': {key: trigrate_conf[key] for key in ('MinTrapEnergy', 'MaxTrapEnergy', 'Queries')},
+                        'runs': runs,
+                        'tstart': tstart,
+                        'tstop': tstop,
+                        'n_files': len(proc_flist),
+                        'n_points': len(trigrates_lst),
+                        'n_failed': n_failed,
+                      },
+                      f,
+                      indent=2
+                     )
+        #
+
+        if out_store_dir is not None:
+            # The same versioned series also as a binary store, next to the configured one. It is written in a temporary
+            # directory, which replaces the existing store (if overwritten) only once it is complete
+            tmp_store_dir = out_store_dir.with_name(f'{out_store_dir.name}.tmp{os.getpid()}')
+            if tmp_store_dir.exists():
+                shutil.rmtree(tmp_store_dir)
+            #
+            try:
+                out_store = GatorTrigRateStore(tmp_store_dir, levels=self.trigrate_store.levels, logger=self.logger)
+                records = np.zeros(len(trigrates_lst), dtype=GatorTrigRateStore.RECORD_DTYPE)
+                records['timestamp'] = [trigrate_dict['trig_timestamp'] for trigrate_dict in trigrates_lst]
+                records['rate'] = [trigrate_dict['trig_rate'] for trigrate_dict in trigrates_lst]
+                records['rate_err'] = [trigrate_dict['trig_rate_err'] for trigrate_dict in trigrates_lst]
+                out_store.append_many(records)
+            except Exception:
+                shutil.rmtree(tmp_store_dir, ignore_errors=True)
+                raise
+            #
+            old_store_dir = None
+            if out_store_dir.exists():
+                # A directory cannot be replaced by a rename while it is not empty: the old one is moved aside first
+                old_store_dir = out_store_dir.with_name(f'{out_store_dir.name}.old{os.getpid()}')
+                os.replace(out_store_dir, old_store_dir)
+            #
+            os.replace(tmp_store_dir, out_store_dir)
+            if old_store_dir is not None:
+                shutil.rmtree(old_store_dir)
+            #
+            self.logger.info(f'GatorDaqProc.RecomputeTrigRates: trigger rate series also written into the store "{out_store_dir}".')
+        #
+
+        self.logger.info(f'GatorDaqProc.RecomputeTrigRates: written {len(trigrates_lst)} trigger rate points into "{out_fpath}" ({n_failed} files failed).')
+        return out_fpath
+    #
+
+    def ReprocessChanged(self, runs:list=None, dry_run:bool=False):
+        '''
+        Incremental reprocessing of the already processed files after a change of the "chs_map" settings. Every processed file
+        keeps the hashes of the settings of its processors ("ProcHashes", see GatorProcGraph.configHashes). Only the processors
+        whose hash changed run again, on the raw file found in the staging or in the archive tree. The processors that produce
+        their inputs run too. Only the columns of the changed processors are replaced; the other columns of the processed file
+        are kept. The columns of processors that are no longer configured are dropped.
+        The files processed before the hashes were saved get them from the settings saved inside the file ("ProcSettings").
+        When the replaced columns are used by the trigger rate selection, the trigger rate of the file in the proc state is
+        recomputed (the old one is kept as "StaleTrigRate" when this fails), while the "TrigRateFile" and "TrigRateStore"
+        series are not touched: regenerate them with RecomputeTrigRates. Returns the number of reprocessed files.
+        '''
+        proc_flist = self._select_processed_files(runs=runs)
+        self.logger.info(f'GatorDaqProc.ReprocessChanged: checking {len(proc_flist)} processed files against the current processors settings.')
+
+        n_reprocessed = 0
+        n_trigrate_changed = 0
+        for proc_fpath in proc_flist:
+            try:
+                reproc_res = self._reprocess_file(Path(proc_fpath), dry_run=dry_run)
+            except Exception:
+                self.logger.exception(f'GatorDaqProc.ReprocessChanged: failed to reprocess "{proc_fpath}".')
+                continue
+            #
+            if reproc_res:
+                n_reprocessed += 1
+            #
+            if reproc_res=='trigrate':
+                n_trigrate_changed += 1
+            #
+        #
+        self.logger.info(f'GatorDaqProc.ReprocessChanged: {"would reprocess" if dry_run else "reprocessed"} {n_reprocessed} of {len(proc_flist)} processed files.')
+        if n_trigrate_changed>0:
+            self.logger.warning(f'GatorDaqProc.ReprocessChanged: the columns used by the trigger rate selection changed in {n_trigrate_changed} files: their trigger rate series is out of date, regenerate it with RecomputeTrigRates.')
+        #
+        return n_reprocessed
+    #
+
+    def _processed_proc_info(self, data):
+        # Hashes and columns of the processors of a processed file (None when they cannot be known)
+        if 'ProcHashes' in data:
+            return data['ProcHashes'], data['ProcCols']
+        #
+        try:
+            old_graph = GatorProcGraph.fromChsMap(data['ProcSettings']['chs_map'])
+            return old_graph.configHashes(), old_graph.procCols(data['Data']['Cols'])
+        except Exception as err:
+            self.logger.warning(f'GatorDaqProc._processed_proc_info: cannot rebuild the processors from the settings saved in the processed file ({err!r}): all of them will run again.')
+            return None, None
+        #
+    #
+
+    def _reprocess_file(self, proc_fpath:Path, dry_run:bool=False):
+        # Returns False when the file is up to date, "trigrate" when the columns of the trigger rate selection change, True otherwise
+        relpath = proc_fpath.parent.relative_to(self.proc_base_dir)
         data = np.load(proc_fpath, allow_pickle=True).item()
 
-        df_payload = data["Data"]
+        old_hashes, old_proc_cols = self._processed_proc_info(data)
+        if old_hashes is None:
+            changed_procs = list(self.proc_hashes)
+        else:
+            changed_procs = [proc_name for proc_name, proc_hash in self.proc_hashes.items() if old_hashes.get(proc_name)!=proc_hash]
+        #
+        removed_procs = [proc_name for proc_name in (old_hashes or dict()) if not proc_name in self.proc_hashes]
 
-        cols  = df_payload["Cols"]
-        types = df_payload["Types"]
-        arr   = df_payload["Arr"]
+        if (len(changed_procs)==0) and (len(removed_procs)==0):
+            return False
+        #
+
+        raw_fname = proc_fpath.with_suffix('.root').name
+        raw_fpath = Path(self.staging_base_dir) / relpath / raw_fname
+        if (not raw_fpath.exists()) and (self.archive_base_dir is not None):
+            raw_fpath = Path(self.archive_base_dir) / relpath / raw_fname
+        #
+        if (len(changed_procs)>0) and (not raw_fpath.exists()):
+            self.logger.error(f'GatorDaqProc._reprocess_file: the raw file "{raw_fname}" of "{proc_fpath}" is neither in the staging nor in the archive tree: cannot reprocess it.')
+            return False
+        #
 
-        df = pd.DataFrame(arr, columns=cols)
+        # The columns of the trigger rate selection are among the ones of the changed or removed processors
+        trigrate_changed = False
+        if self.trigrate_sel is not None:
+            trigrate_procs = [proc_name for proc_name, proc_cols in self.proc_graph.procCols(self.trigrate_sel.columns).items() if len(proc_cols)>0]
+            if old_proc_cols is not None:
+                trigrate_procs += [proc_name for proc_name, proc_cols in old_proc_cols.items() if any(col in self.trigrate_sel.columns for col in proc_cols)]
+            #
+            trigrate_changed = (old_proc_cols is None) or any(proc_name in trigrate_procs for proc_name in changed_procs+removed_procs)
+        #
+        reproc_res = 'trigrate' if trigrate_changed else True
 
-        for col, dtype_str in types.items():
-            df[col] = df[col].astype(dtype_str)
+        self.logger.info(f'GatorDaqProc._reprocess_file: "{proc_fpath}": processors to run again {changed_procs}, removed {removed_procs}{" (the trigger rate changes)" if trigrate_changed else ""}.')
+        if dry_run:
+            return reproc_res
         #
-        return df
+
+        old_df = ProcessedPayloadToDf(data['Data'])
+
+        metrics = GatorProcMetrics(trace_memory=self.metrics_trace_memory).begin()
+        if len(changed_procs)>0:
+            fileProcessor = GatorFileProcessor(fpath=raw_fpath, chs_map=self.chsmap, metrics=metrics, low_memory=self.low_memory,
+                                               proc_graph=self.proc_graph.subGraph(changed_procs))
+            new_df = fileProcessor().getDf()
+            del fileProcessor
+
+            if len(new_df)!=len(old_df):
+                self.logger.error(f'GatorDaqProc._reprocess_file: "{raw_fpath}" has {len(new_df)} events, while its processed file "{proc_fpath}" has {len(old_df)}: cannot merge them.')
+                return False
+            #
+        else:
+            new_df = pd.DataFrame(index=old_df.index)
+        #
+
+        # The columns of the changed (and removed) processors are replaced, all the others are reused
+        if old_proc_cols is None:
+            drop_cols = [col for col in old_df.columns if col in new_df.columns]
+        else:
+            drop_cols = [col for proc_name in changed_procs+removed_procs for col in old_proc_cols.get(proc_name, list())]
+        #
+        new_proc_cols = self.proc_graph.procCols(list(new_df.columns))
+        add_cols = [col for proc_name in changed_procs for col in new_proc_cols.get(proc_name, list())]
+        if old_proc_cols is None:
+            add_cols = list(new_df.columns)
+        #
+        proc_df = pd.concat([old_df.drop(columns=[col for col in drop_cols if col in old_df.columns]), new_df[add_cols]], axis=1)
+
+        with metrics.stage('save'):
+            data['ProcSettings'] = self.config_dict
+            data['ProcHashes'] = self.proc_hashes
+            data['ProcCols'] = self.proc_graph.procCols(list(proc_df.columns))
+            data['Data'] = {
+                "Cols": list(proc_df.columns),
+                "Types": {col: str(proc_df[col].dtype) for col in proc_df.columns},
+                "Arr": proc_df.to_numpy(copy=True),
+            }
+            tmp_fpath = proc_fpath.with_name(proc_fpath.name + '.tmp')
+            with open(tmp_fpath, 'wb') as f:
+                np.save(f, data) #This implicitly uses pickles
+            #
+            os.replace(tmp_fpath, proc_fpath)
+        #
+        self._record_metrics(relpath, raw_fname, metrics)
+
+        # The proc state (if still there) gets the new hashes of the file and, if its columns changed, the new trigger rate
+        proc_state_fpath = Path(self.staging_base_dir) / relpath / f"{GatorDaqProc.PROC_STATE_FNAME}_{Path(relpath).name}.json"
+        if proc_state_fpath.exists():
+            proc_state_dict = self._load_proc_state_file(proc_state_fpath)
+            try:
+                if raw_fname in proc_state_dict:
+                    proc_state_entry = {**proc_state_dict[raw_fname], 'ProcHashes': self.proc_hashes, 'reproc_timestamp': int(time.time()+0.5)}
+                    if trigrate_changed and ('TrigRate' in proc_state_entry):
+                        self._update_state_trig_rate(proc_state_entry, proc_df, data, proc_fpath)
+                    #
+                    proc_state_dict.commit(raw_fname, proc_state_entry)
+                #
+            finally:
+                proc_state_dict.close(background=False)
+            #
+        #
+        return reproc_res
+    #
+
+    def _update_state_trig_rate(self, proc_state_entry, proc_df, data, proc_fpath):
+        # Recompute the trigger rate of a proc state entry from the reprocessed columns; when it fails the old value is kept
+        # as "StaleTrigRate" (not as "TrigRate"), so it is not mistaken for a valid one
+        try:
+            daq_metadata = {key: data[key] for key in ('StartUnixTime', 'StopUnixTime', 'FileRunTime', 'SampFreq')}
+            daq_metadata['WfsLength'] = int(data['WfsLength'])
+            trigrate_dict = ComputeTrigRate(df=proc_df, trigrate_sel=self.trigrate_sel, daq_metadata=daq_metadata)
+        except Exception as err:
+            self.logger.error(f'GatorDaqProc._update_state_trig_rate: failed to recompute the trigger rate of "{proc_fpath}" ({err!r}): the one in the proc state is marked as stale.')
+            proc_state_entry['StaleTrigRate'] = proc_state_entry.pop('TrigRate')
+            return
+        #
+        proc_state_entry['TrigRate'] = dict(proc_timestamp = trigrate_dict['proc_timestamp'],
+                                            trig_timestamp = trigrate_dict['trig_timestamp'],
+                                            trig_rate = trigrate_dict['trig_rate'],
+                                            rate_err = trigrate_dict['trig_rate_err']
+                                            )
+        proc_state_entry.pop('StaleTrigRate', None)
+    #
+
+    def _select_processed_files(self, runs:list=None, tstart:int=None, tstop:int=None):
+        proc_flist = list()
+        for dirpath, dirnames, filenames in os.walk(self.proc_base_dir):
+            relpath = os.path.relpath(dirpath, self.proc_base_dir)
+            depth = 0 if relpath == "." else relpath.count(os.sep) + 1
+            if depth >=2:
+                dirnames[:] = []
+            #
+
+            if (runs is not None) and (not any(fnmatch.fnmatch(relpath, pattern) for pattern in runs)):
+                continue
+            #
+
+            npy_flist = sorted(fname for fname in filenames if fname.endswith('.npy'))
+            if len(npy_flist)==0:
+                continue
+            #
+
+            # Use the trigger timestamps already known by the proc state (if any) to skip the files out of the time range without loading them
+            trig_timestamps = dict()
+            if (tstart is not None) or (tstop is not None):
+                staging_dir = Path(self.staging_base_dir) / relpath
+                proc_state_fpath = staging_dir / f"{GatorDaqProc.PROC_STATE_FNAME}_{staging_dir.name}.json"
+                if proc_state_fpath.exists():
+                    # Only a hint to skip files: read without touching the proc state of the staging tree
+                    proc_state_dict = self._load_proc_state_file(proc_state_fpath, read_only=True)
+                    for root_fname, proc_state_entry in proc_state_dict.items():
+                        if 'TrigRate' in proc_state_entry:
+                            trig_timestamps[Path(root_fname).with_suffix('.npy').name] = proc_state_entry['TrigRate']['trig_timestamp']
+                        #
+                    #
+                #
+            #
+
+            for fname in npy_flist:
+                trig_timestamp = trig_timestamps.get(fname)
+                if (trig_timestamp is not None) and (not _in_time_range(trig_timestamp, tstart, tstop)):
+                    continue
+                #
+                proc_flist.append(str(Path(dirpath) / fname))
+            #
+        #
+        return proc_flist
     #
 
     def WriteTrigRate(self, fpath, proc_dict):
@@ -497,6 +1129,18 @@ class GatorDaqProc:
         #
     #
 
+    def WriteTrigRateStore(self, trigrate_store, proc_dict):
+        try:
+            trigrate_store.append(timestamp=int(proc_dict['TrigRate']['trig_timestamp']),
+                                  rate=proc_dict['TrigRate']['trig_rate'],
+                                  rate_err=proc_dict['TrigRate']['trig_rate_err']
+                                  )
+        except Exception as err:
+            self.logger.exception(f'GatorDaqProc.WriteTrigRateStore: failed to write the triger rate value in the store "{trigrate_store.store_dir}".')
+            return
+        #
+    #
+
     def ArchiveFile(self, local_f_path, archive_f_path, move:bool=False):
         src = Path(local_f_path)
         dst = Path(archive_f_path)
@@ -523,6 +1167,91 @@ class GatorDaqProc:
         #
     #
 
+def TrigRateConfigHash(trigrate_conf):
+    # Short hash of the settings that define the event selection of the trigger rate
+    selection = {key: trigrate_conf[key] for key in ('MinTrapEnergy', 'MaxTrapEnergy', 'Queries')}
+    return hashlib.sha1(json.dumps(selection, sort_keys=True).encode()).hexdigest()[:10]
+#
+
+def ComputeTrigRate(df, trigrate_sel, daq_metadata):
+    #Get the number of events before and after the queries (within the energy window)
+    n_evs_before_cuts, n_evs = trigrate_sel(df)
+    n_evs_err = np.sqrt(n_evs)
+
+    #Now calculate the effective run time
+    runtime_eff = daq_metadata['FileRunTime'] - (n_evs_before_cuts-n_evs)/daq_metadata['SampFreq']*daq_metadata['WfsLength']
+
+    trigrate_dict = dict(proc_timestamp=int(time.time()+0.5)) #This is useful only if the trigger rate is actually processed at a different time wrt the main processing time
+    
+    tstart = daq_metadata['StartUnixTime']
+    tstop = daq_metadata['StopUnixTime']
+    trigrate_dict['trig_timestamp'] = int((tstart+tstop)/2. + 0.5)
+    trigrate_dict['trig_rate'] = n_evs/runtime_eff
+    trigrate_dict['trig_rate_err'] = n_evs_err/runtime_eff
+
+    return trigrate_dict
+#
+
+def LoadProcessedFile(proc_fpath, columns:list=None):
+    '''
+    Load a processed (.npy) file. Returns the dataframe and the dictionary with the rest of the saved content.
+    If "columns" is given only those columns are converted into the dataframe: the file is read and unpickled as a whole
+    in any case.
+    '''
+    data = np.load(proc_fpath, allow_pickle=True).item()
+
+    df = ProcessedPayloadToDf(data.pop("Data"), columns=columns)
+    return df, data
+#
+
+def ProcessedPayloadToDf(df_payload, columns:list=None):
+    cols  = df_payload["Cols"]
+    types = df_payload["Types"]
+    arr   = df_payload["Arr"]
+
+    if columns is not None:
+        idxs = [cols.index(col) for col in columns]
+        cols = [cols[idx] for idx in idxs]
+        arr = arr[:, idxs]
+    #
+
+    df = pd.DataFrame(arr, columns=cols)
+
+    for col in cols:
+        df[col] = df[col].astype(types[col])
+    #
+    return df
+#
+
+def _in_time_range(timestamp, tstart, tstop):
+    if (tstart is not None) and (timestamp < tstart):
+        return False
+    if (tstop is not None) and (timestamp > tstop):
+        return False
+    return True
+#
+
+def _recompute_file_trig_rate(proc_fpath, trigrate_sel, tstart, tstop):
+    # Worker of GatorDaqProc.RecomputeTrigRates: it runs in a separate process, so it must not raise.
+    # The whole processed file is unpickled (single pickled dict), only the conversion into the dataframe is limited to the selection columns
+    try:
+        data = np.load(proc_fpath, allow_pickle=True).item()
+        daq_metadata = {key: data[key] for key in ('StartUnixTime', 'StopUnixTime', 'FileRunTime', 'SampFreq')}
+        daq_metadata['WfsLength'] = int(data['WfsLength'])
+
+        trig_timestamp = int((daq_metadata['StartUnixTime']+daq_metadata['StopUnixTime'])/2. + 0.5)
+        if not _in_time_range(trig_timestamp, tstart, tstop):
+            return proc_fpath, None, None
+        #
+
+        df = ProcessedPayloadToDf(data['Data'], columns=[col for col in data['Data']['Cols'] if col in trigrate_sel.columns])
+
+        return proc_fpath, ComputeTrigRate(df=df, trigrate_sel=trigrate_sel, daq_metadata=daq_metadata), None
+    except Exception as err:
+        return proc_fpath, None, f'{type(err).__name__}: {err}'
+    #
+#
+
 def main():
     if len(sys.argv)>1:
         config_fname = sys.argv[1]
@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import fcntl
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+
+class GatorTrigRateStore:
+    '''
+    Binary time-series store of the trigger rates.
+
+    The points are kept in fixed size binary records, partitioned in one file per (UTC) day, so that a time range
+    query only reads the partitions it overlaps. For every day partition, downsampled levels (mean rate in bins of
+    fixed width) are recomputed at each append, so that long range plots never read the raw points.
+    Appends from several processes are serialized with an exclusive lock on the day partition file. A partial record
+    left at the end of a raw partition (crash in the middle of a write) is dropped by the next append, so that the
+    following records stay aligned.
+
+    Layout of the store directory:
+        store.json                  settings of the store (the widths of the downsampled levels)
+        raw/<YYYYMMDD>.bin          raw points: (timestamp, rate, rate_err)
+        L<width>/<YYYYMMDD>.bin     downsampled points: (bin start timestamp, mean rate, error of the mean, number of points)
+    '''
+    RECORD_DTYPE = np.dtype([('timestamp', '<i8'), ('rate', '<f8'), ('rate_err', '<f8')])
+    LEVEL_DTYPE = np.dtype([('timestamp', '<i8'), ('rate', '<f8'), ('rate_err', '<f8'), ('n_points', '<i8')])
+    PARTITION_SEC = 86400
+    DEFAULT_LEVELS = (600, 3600, 86400) #Widths (in seconds) of the downsampled levels
+    SETTINGS_FNAME = 'store.json'
+    RAW_DIRNAME = 'raw'
+
+    def __init__(self, store_dir, levels:list=None, logger=None):
+        self.store_dir = Path(store_dir)
+        self.logger = logger
+        settings_fpath = self.store_dir / GatorTrigRateStore.SETTINGS_FNAME
+
+        if settings_fpath.exists():
+            with open(settings_fpath, 'r') as f:
+                self.levels = sorted(int(width) for width in json.load(f)['levels'])
+            #
+            if (levels is not None) and (sorted(int(width) for width in levels) != self.levels):
+                raise ValueError(f'GatorTrigRateStore.__init__: the store "{self.store_dir}" was created with the levels {self.levels}, while {list(levels)} were requested.')
+            #
+        else:
+            self.levels = sorted(int(width) for width in (levels if levels is not None else GatorTrigRateStore.DEFAULT_LEVELS))
+            for width in self.levels:
+                if (width <= 0) or (GatorTrigRateStore.PARTITION_SEC % width != 0):
+                    raise ValueError(f'GatorTrigRateStore.__init__: the width of a downsampled level must divide the partition length ({GatorTrigRateStore.PARTITION_SEC} s), while it is {width}.')
+                #
+            #
+            (self.store_dir / GatorTrigRateStore.RAW_DIRNAME).mkdir(parents=True, exist_ok=True)
+            tmp_fpath = settings_fpath.with_name(settings_fpath.name + f'.tmp{os.getpid()}')
+            with open(tmp_fpath, 'w') as f:
+                json.dump({'levels': self.levels}, f, indent=2)
+            #
+            os.replace(tmp_fpath, settings_fpath)
+        #
+
+        for width in self.levels:
+            (self.store_dir / f'L{width}').mkdir(parents=True, exist_ok=True)
+        #
+    #
+
+    def append(self, timestamp, rate, rate_err):
+        self.append_many(np.array([(timestamp, rate, rate_err)], dtype=GatorTrigRateStore.RECORD_DTYPE))
+    #
+
+    def append_many(self, records):
+        records = np.asarray(records, dtype=GatorTrigRateStore.RECORD_DTYPE)
+        if records.size==0:
+            return
+        #
+
+        partitions = records['timestamp'] // GatorTrigRateStore.PARTITION_SEC
+        for partition in np.unique(partitions):
+            self._append_partition(int(partition), records[partitions==partition])
+        #
+    #
+
+    def query(self, tstart:int=None, tstop:int=None, level:int=None):
+        '''
+        Returns the points with tstart <= timestamp <= tstop (either limit can be None), sorted by timestamp.
+        With "level" the points of the downsampled level of that width (in seconds) are returned instead of the raw ones.
+        '''
+        if (level is not None) and (not level in self.levels):
+            raise ValueError(f'GatorTrigRateStore.query: no downsampled level of width {level} s in this store (available levels: {self.levels}).')
+        #
+        dtype = GatorTrigRateStore.RECORD_DTYPE if level is None else GatorTrigRateStore.LEVEL_DTYPE
+        level_dir = self._level_dir(level)
+
+        arrs_lst = list()
+        for partition in self._partitions(tstart, tstop):
+            arr = self._read(level_dir / self._partition_fname(partition), dtype)
+            if arr.size>0:
+                arrs_lst.append(arr)
+            #
+        #
+        if len(arrs_lst)==0:
+            return np.zeros(0, dtype=dtype)
+        #
+
+        arr = np.concatenate(arrs_lst)
+        arr = arr[np.argsort(arr['timestamp'], kind='stable')]
+
+        mask = np.ones(arr.size, dtype=bool)
+        if tstart is not None:
+            mask &= arr['timestamp'] >= tstart
+        if tstop is not None:
+            mask &= arr['timestamp'] <= tstop
+        #
+        return arr[mask]
+    #
+
+    def auto_level(self, tstart:int, tstop:int, max_points:int=2000):
+        # The finest level (None: raw points) giving at most "max_points" bins in the range
+        span = tstop - tstart
+        if span <= 0:
+            return None
+        #
+        n_raw = sum(self._n_records(self._level_dir(None) / self._partition_fname(partition)) for partition in self._partitions(tstart, tstop))
+        if n_raw <= max_points:
+            return None
+        #
+        for width in self.levels:
+            if span/width <= max_points:
+                return width
+            #
+        #
+        return self.levels[-1]
+    #
+
+    def import_text(self, fpath):
+        # Import a text file in the "timestamp  rate  err" format written by GatorDaqProc.WriteTrigRate
+        arr = np.loadtxt(fpath, ndmin=2)
+        if arr.size==0:
+            return 0
+        #
+        records = np.zeros(arr.shape[0], dtype=GatorTrigRateStore.RECORD_DTYPE)
+        records['timestamp'] = arr[:, 0].astype(np.int64)
+        records['rate'] = arr[:, 1]
+        records['rate_err'] = arr[:, 2]
+        self.append_many(records)
+        return records.size
+    #
+
+    def export_text(self, fpath, tstart:int=None, tstop:int=None, level:int=None):
+        arr = self.query(tstart=tstart, tstop=tstop, level=level)
+        with open(fpath, 'w') as f:
+            for rec in arr:
+                f.write(f'{int(rec["timestamp"])}  {float(rec["rate"])}  {float(rec["rate_err"])}\n')
+            #
+        #
+        return arr.size
+    #
+
+    def _append_partition(self, partition, records):
+        raw_fpath = self._level_dir(None) / self._partition_fname(partition)
+        with open(raw_fpath, 'ab') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                # Drop a torn record at the end (crash in the middle of an append), otherwise all the next ones would be misaligned
+                size = os.fstat(f.fileno()).st_size
+                n_torn = size % GatorTrigRateStore.RECORD_DTYPE.itemsize
+                if n_torn > 0:
+                    self._log_error(f'GatorTrigRateStore._append_partition: dropping a torn record ({n_torn} bytes) at the end of "{raw_fpath}".')
+                    f.truncate(size - n_torn)
+                #
+                f.write(records.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+                # Still under the lock: the downsampled levels of this day are rebuilt from the complete raw partition
+                raw_arr = self._read(raw_fpath, GatorTrigRateStore.RECORD_DTYPE)
+                for width in self.levels:
+                    self._write_atomic(self._level_dir(width) / self._partition_fname(partition), self._downsample(raw_arr, width))
+                #
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            #
+        #
+    #
+
+    def _downsample(self, raw_arr, width):
+        bins = raw_arr['timestamp'] // width
+        ubins, inv, counts = np.unique(bins, return_inverse=True, return_counts=True)
+
+        level_arr = np.zeros(ubins.size, dtype=GatorTrigRateStore.LEVEL_DTYPE)
+        level_arr['timestamp'] = ubins * width
+        level_arr['rate'] = np.bincount(inv, weights=raw_arr['rate'], minlength=ubins.size) / counts
+        level_arr['rate_err'] = np.sqrt(np.bincount(inv, weights=raw_arr['rate_err']**2, minlength=ubins.size)) / counts
+        level_arr['n_points'] = counts
+        return level_arr
+    #
+
+    def _partitions(self, tstart, tstop):
+        partitions = sorted(int(fpath.stem) for fpath in self._level_dir(None).glob('*.bin'))
+        partitions = [self._partition_from_day(day) for day in partitions]
+        if tstart is not None:
+            partitions = [partition for partition in partitions if partition >= tstart // GatorTrigRateStore.PARTITION_SEC]
+        if tstop is not None:
+            partitions = [partition for partition in partitions if partition <= tstop // GatorTrigRateStore.PARTITION_SEC]
+        return partitions
+    #
+
+    def _level_dir(self, level):
+        if level is None:
+            return self.store_dir / GatorTrigRateStore.RAW_DIRNAME
+        return self.store_dir / f'L{level}'
+    #
+
+    def _partition_fname(self, partition):
+        return np.datetime_as_string(np.datetime64(partition, 'D'), unit='D').replace('-', '') + '.bin'
+    #
+
+    def _partition_from_day(self, day:int):
+        # From the YYYYMMDD integer of the file name to the partition number (days since the epoch)
+        return int(np.datetime64(f'{day//10000:04d}-{(day//100)%100:02d}-{day%100:02d}', 'D').astype(np.int64))
+    #
+
+    def _n_records(self, fpath):
+        if not fpath.exists():
+            return 0
+        return fpath.stat().st_size // GatorTrigRateStore.RECORD_DTYPE.itemsize
+    #
+
+    def _read(self, fpath, dtype):
+        if not fpath.exists():
+            return np.zeros(0, dtype=dtype)
+        #
+        with open(fpath, 'rb') as f:
+            # A reader can run concurrently to an append: only complete records are read
+            n_records = os.fstat(f.fileno()).st_size // dtype.itemsize
+            return np.fromfile(f, dtype=dtype, count=n_records)
+        #
+    #
+
+    def _log_error(self, msg):
+        if self.logger is not None:
+            self.logger.error(msg)
+        else:
+            print(msg, file=sys.stderr)
+        #
+    #
+
+    def _write_atomic(self, fpath, arr):
+        tmp_fpath = fpath.with_name(fpath.name + f'.tmp{os.getpid()}')
+        with open(tmp_fpath, 'wb') as f:
+            f.write(arr.tobytes())
+        #
+        os.replace(tmp_fpath, fpath)
+    #
+#
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage a binary trigger rate store.')
+    parser.add_argument('store', help='Directory of the trigger rate store (created if missing).')
+    subparsers = parser.add_subparsers(dest='cmd', required=True)
+
+    import_parser = subparsers.add_parser('import', help='Import a "timestamp  rate  err" text file.')
+    import_parser.add_argument('fpath')
+
+    export_parser = subparsers.add_parser('export', help='Export (a time range of) the store in the "timestamp  rate  err" text format.')
+    export_parser.add_argument('fpath')
+    export_parser.add_argument('--tstart', type=int, default=None)
+    export_parser.add_argument('--tstop', type=int, default=None)
+    export_parser.add_argument('--level', type=int, default=None, help='Width (s) of the downsampled level to export (default: raw points).')
+
+    args = parser.parse_args()
+
+    store = GatorTrigRateStore(args.store)
+    if args.cmd=='import':
+        n_points = store.import_text(args.fpath)
+        print(f'Imported {n_points} points from "{args.fpath}" into "{args.store}".')
+    elif args.cmd=='export':
+        n_points = store.export_text(args.fpath, tstart=args.tstart, tstop=args.tstop, level=args.level)
+        print(f'Exported {n_points} points from "{args.store}" into "{args.fpath}".')
+    #
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
 import os
 import sys
+import json
+import fcntl
+import shutil
+import threading
+from contextlib import contextmanager
 
 import logging
 from logging.handlers import TimedRotatingFileHandler
@@ -66,4 +71,395 @@ def set_logger_level(logger, level):
         raise TypeError(f"log_level must be str or int, got {type(level)}")
 
     logger.setLevel(level)
-#
\ No newline at end of file
+#
+
+class JournaledStateStore:
+    """
+    Dictionary-like state store made of a JSON snapshot plus an append-only journal.
+
+    Every commit appends one JSON record to "<snapshot>.journal" and fsyncs it before returning, so an update
+    survives a crash as soon as it is committed and a save costs O(1). The journal is periodically folded into
+    the snapshot (compaction), which is written atomically (temporary file + rename) and can run in a background
+    thread. A snapshot written by the older "rewrite everything" code is loaded as-is, so existing state files
+    keep working.
+
+    Several processes can share the same files (e.g. the daemon and a reprocessing script): the appends and the
+    journal rotation hold an exclusive flock on "<snapshot>.lock", a compaction holds one on "<snapshot>.compact.lock",
+    and the snapshot is always rebuilt from the files (snapshot + journal) rather than from the memory of the instance,
+    so the records committed by the other processes are kept.
+    """
+    JOURNAL_SUFFIX = '.journal'
+    COMPACTING_SUFFIX = '.compacting'
+    LOCK_SUFFIX = '.lock'
+    COMPACT_LOCK_SUFFIX = '.compact.lock'
+
+    # One pair of locks (records, compaction) per snapshot path, shared by all the instances of this process pointing to the same files
+    _PATH_LOCKS = dict()
+    _PATH_LOCKS_GUARD = threading.Lock()
+
+    def __init__(self, snapshot_fpath, compact_every:int=256, logger=None):
+        self.snapshot_fpath = str(snapshot_fpath)
+        self.journal_fpath = self.snapshot_fpath + JournaledStateStore.JOURNAL_SUFFIX
+        self.compacting_fpath = self.journal_fpath + JournaledStateStore.COMPACTING_SUFFIX
+        self.lock_fpath = self.snapshot_fpath + JournaledStateStore.LOCK_SUFFIX
+        self.compact_lock_fpath = self.snapshot_fpath + JournaledStateStore.COMPACT_LOCK_SUFFIX
+        self.compact_every = compact_every
+        self.logger = logger
+
+        self.state = dict()
+        self.n_journal_records = 0
+        self._compact_thread = None
+
+        with JournaledStateStore._PATH_LOCKS_GUARD:
+            self._lock, self._compact_lock = JournaledStateStore._PATH_LOCKS.setdefault(os.path.abspath(self.snapshot_fpath), (threading.RLock(), threading.Lock()))
+        #
+    #
+
+    def __contains__(self, key):
+        return key in self.state
+    #
+
+    def __getitem__(self, key):
+        return self.state[key]
+    #
+
+    def __setitem__(self, key, value):
+        self.commit(key, value)
+    #
+
+    def __delitem__(self, key):
+        self.delete(key)
+    #
+
+    def __len__(self):
+        return len(self.state)
+    #
+
+    def __iter__(self):
+        return iter(self.state)
+    #
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+    #
+
+    def keys(self):
+        return self.state.keys()
+    #
+
+    def items(self):
+        return self.state.items()
+    #
+
+    def load(self, read_only:bool=False):
+        """
+        Load the snapshot and replay the journal(s) on top of it.
+        A torn record at the end of the journal (crash in the middle of a write) is dropped and the journal is truncated to the last complete record.
+        With "read_only" the files are only read: no lock file is created and a torn record is skipped but left in place
+        (the state may then miss the records of a compaction running at the same time). Such an instance must not commit.
+        """
+        if read_only:
+            with self._lock:
+                self.state, self.n_journal_records = self._read_files(truncate=False)
+            #
+            return self
+        #
+        with self._lock, _flocked(self.lock_fpath):
+            self.state, self.n_journal_records = self._read_files()
+        #
+        return self
+    #
+
+    def commit(self, key, value):
+        with self._lock, _flocked(self.lock_fpath):
+            self.state[key] = value
+            self._append({'k': key, 'v': value})
+        #
+        self._maybe_compact()
+    #
+
+    def delete(self, key):
+        with self._lock, _flocked(self.lock_fpath):
+            if not key in self.state:
+                return
+            #
+            del self.state[key]
+            self._append({'k': key, 'd': 1})
+        #
+        self._maybe_compact()
+    #
+
+    def compact(self, background:bool=False):
+        if not background:
+            self._compact()
+            return
+        #
+        if (self._compact_thread is not None) and self._compact_thread.is_alive():
+            return
+        #
+        self._compact_thread = threading.Thread(target=self._compact, name=f'compact:{os.path.basename(self.snapshot_fpath)}')
+        self._compact_thread.start()
+    #
+
+    def close(self, background:bool=True):
+        # Fold what is left in the journal into the snapshot, so that the next load is a single json read
+        if self.n_journal_records>0:
+            self.compact(background=background)
+        #
+    #
+
+    def wait(self):
+        if self._compact_thread is not None:
+            self._compact_thread.join()
+        #
+    #
+
+    def _read_files(self, truncate:bool=True):
+        # The state on disk (snapshot + journals) and the number of journal records, to be called holding the locks
+        state = dict()
+        if os.path.exists(self.snapshot_fpath):
+            try:
+                with open(self.snapshot_fpath, "r") as f:
+                    state = json.load(f)
+            except Exception as err:
+                self._log_error(f'JournaledStateStore.load: failed to read the snapshot "{self.snapshot_fpath}": {err}')
+                state = dict()
+            #
+        #
+
+        n_records = 0
+        for fpath in (self.compacting_fpath, self.journal_fpath):
+            n_records += self._replay(fpath, state, truncate=truncate)
+        #
+        return state, n_records
+    #
+
+    def _replay(self, fpath, state, truncate:bool=True):
+        try:
+            with open(fpath, "rb") as f:
+                data = f.read()
+            #
+        except FileNotFoundError:
+            return 0
+        #
+
+        end = data.rfind(b'\n') + 1
+        if (end < len(data)) and truncate:
+            self._log_error(f'JournaledStateStore._replay: dropping a torn record ({len(data)-end} bytes) at the end of "{fpath}".')
+            with open(fpath, "r+b") as f:
+                f.truncate(end)
+            #
+        #
+
+        n_records = 0
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                self._log_error(f'JournaledStateStore._replay: skipping a corrupted record in "{fpath}".')
+                continue
+            #
+            if 'd' in rec:
+                state.pop(rec['k'], None)
+            else:
+                state[rec['k']] = rec['v']
+            #
+            n_records += 1
+        #
+        return n_records
+    #
+
+    def _append(self, rec):
+        # The file is reopened at every record on purpose: other instances may rotate the journal while compacting
+        line = (json.dumps(rec) + '\n').encode()
+        with open(self.journal_fpath, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        #
+        self.n_journal_records += 1
+    #
+
+    def _maybe_compact(self):
+        if self.compact_every and (self.n_journal_records >= self.compact_every):
+            self.compact(background=True)
+        #
+    #
+
+    def _compact(self):
+        with self._compact_lock, _flocked(self.compact_lock_fpath):
+            self._compact_locked()
+        #
+    #
+
+    def _compact_locked(self):
+        try:
+            with self._lock, _flocked(self.lock_fpath):
+                # Rotate the journal: the records committed from now on go to a fresh journal while the snapshot is written
+                if os.path.exists(self.journal_fpath):
+                    if os.path.exists(self.compacting_fpath):
+                        # Left over by an interrupted compaction: merge instead of overwriting it
+                        with open(self.journal_fpath, "rb") as src, open(self.compacting_fpath, "ab") as dst:
+                            shutil.copyfileobj(src, dst)
+                            dst.flush()
+                            os.fsync(dst.fileno())
+                        #
+                        os.remove(self.journal_fpath)
+                    else:
+                        os.replace(self.journal_fpath, self.compacting_fpath)
+                    #
+                #
+                # Replay the files again, with the lock: they also hold the records committed by the other processes, which
+                # are not in the memory of this instance (and would be lost writing it)
+                state, _ = self._read_files()
+                self.state = dict(state)
+                self.n_journal_records = 0
+            #
+
+            tmp_fpath = self.snapshot_fpath + '.tmp'
+            with open(tmp_fpath, "w") as f:
+                json.dump(state, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            #
+
+            with self._lock, _flocked(self.lock_fpath):
+                os.replace(tmp_fpath, self.snapshot_fpath)
+                _fsync_dir(os.path.dirname(os.path.abspath(self.snapshot_fpath)))
+                # Only now the rotated records are safely inside the snapshot
+                if os.path.exists(self.compacting_fpath):
+                    os.remove(self.compacting_fpath)
+                #
+            #
+        except Exception as err:
+            self._log_error(f'JournaledStateStore._compact: failed to compact "{self.snapshot_fpath}": {err}')
+        #
+    #
+
+    def _log_error(self, msg):
+        if self.logger is not None:
+            self.logger.error(msg)
+        else:
+            print(msg, file=sys.stderr)
+        #
+    #
+
+
+@contextmanager
+def _flocked(lock_fpath):
+    # Exclusive lock among the processes (flock is released when the file is closed, also if the process dies)
+    with open(lock_fpath, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        #
+    #
+#
+
+def _fsync_dir(dir_path):
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class PromTextfileExporter:
+    """
+    Writes processing metrics in the Prometheus text format, to be collected by the node_exporter "textfile" collector.
+
+    The gauges describe the last processed file (per stage), the counters are accumulated since the start of the daemon.
+    The file is replaced atomically at every update, as required by the collector.
+    """
+    def __init__(self, fpath, prefix:str='gator_proc'):
+        self.fpath = str(fpath)
+        self.prefix = prefix
+        self.last_metrics = None
+        self.last_labels = dict()
+        self.totals = dict(files=0, events=0, bytes_read=0)
+        self.stage_totals = dict() #{stage: {'wall_sec':..., 'cpu_sec':...}}
+    #
+
+    def update(self, metrics_dict, labels:dict=None):
+        self.last_metrics = metrics_dict
+        self.last_labels = dict(labels) if labels is not None else dict()
+
+        self.totals['files'] += 1
+        self.totals['events'] += metrics_dict.get('n_events', 0)
+        self.totals['bytes_read'] += metrics_dict.get('bytes_read', 0)
+        for stage, stage_dict in metrics_dict['stages'].items():
+            stage_totals = self.stage_totals.setdefault(stage, dict(wall_sec=0., cpu_sec=0.))
+            stage_totals['wall_sec'] += stage_dict['wall_sec']
+            stage_totals['cpu_sec'] += stage_dict['cpu_sec']
+        #
+        self.write()
+    #
+
+    def write(self):
+        lines = list()
+        p = self.prefix
+
+        def add(name, mtype, helpstr, samples):
+            lines.append(f'# HELP {p}_{name} {helpstr}')
+            lines.append(f'# TYPE {p}_{name} {mtype}')
+            for labels, value in samples:
+                lines.append(f'{p}_{name}{_prom_labels(labels)} {float(value)}')
+            #
+        #
+
+        add('files_total', 'counter', 'Number of processed files.', [({}, self.totals['files'])])
+        add('events_total', 'counter', 'Number of processed events.', [({}, self.totals['events'])])
+        add('read_bytes_total', 'counter', 'Bytes of raw data read.', [({}, self.totals['bytes_read'])])
+        add('stage_wall_seconds_total', 'counter', 'Wall time spent per processing stage.', [({'stage': stage}, tot['wall_sec']) for stage, tot in self.stage_totals.items()])
+        add('stage_cpu_seconds_total', 'counter', 'Cpu time spent per processing stage.', [({'stage': stage}, tot['cpu_sec']) for stage, tot in self.stage_totals.items()])
+
+        if self.last_metrics is not None:
+            last = self.last_metrics
+            labels = self.last_labels
+            for key, name, helpstr in (('wall_sec', 'file_wall_seconds', 'Wall time of the last processed file.'),
+                                       ('cpu_sec', 'file_cpu_seconds', 'Cpu time of the last processed file.'),
+                                       ('events_per_sec', 'file_events_per_second', 'Throughput of the last processed file.'),
+                                       ('n_events', 'file_events', 'Events of the last processed file.'),
+                                       ('bytes_read', 'file_read_bytes', 'Size of the last processed file.'),
+                                       ('peak_rss_mb', 'peak_rss_megabytes', 'Peak resident memory while processing the last file.'),
+                                       ):
+                if key in last:
+                    add(name, 'gauge', helpstr, [(labels, last[key])])
+                #
+            #
+            for key, name, helpstr in (('wall_sec', 'stage_wall_seconds', 'Wall time per stage of the last processed file.'),
+                                       ('cpu_sec', 'stage_cpu_seconds', 'Cpu time per stage of the last processed file.'),
+                                       ('events_per_sec', 'stage_events_per_second', 'Throughput per stage of the last processed file.'),
+                                       ('peak_rss_mb', 'stage_peak_rss_megabytes', 'Peak resident memory per stage of the last processed file.'),
+                                       ('rss_growth_mb', 'stage_rss_growth_megabytes', 'Growth of the resident memory per stage of the last processed file.'),
+                                       ('peak_traced_mb', 'stage_peak_traced_megabytes', 'Peak traced memory per stage of the last processed file.'),
+                                       ):
+                samples = [({**labels, 'stage': stage}, stage_dict[key]) for stage, stage_dict in last['stages'].items() if key in stage_dict]
+                if len(samples)>0:
+                    add(name, 'gauge', helpstr, samples)
+                #
+            #
+        #
+
+        tmp_fpath = self.fpath + '.tmp'
+        with open(tmp_fpath, "w") as f:
+            f.write('\n'.join(lines) + '\n')
+        #
+        os.replace(tmp_fpath, self.fpath)
+    #
+
+
+def _prom_labels(labels:dict):
+    if len(labels)==0:
+        return ''
+    escaped = [f'{key}="{str(value).replace(chr(92), chr(92)*2).replace(chr(34), chr(92)+chr(34))}"' for key, value in labels.items()]
+    return '{' + ','.join(escaped) + '}'
@@ -4,17 +4,54 @@ import json
 import glob
 import time
 import stat
+import hashlib
+import uuid
+import shlex
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import paramiko
 
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
-from GatorUtils import setup_logger
+from GatorUtils import setup_logger, JournaledStateStore
+
+
+class UploadRateLimiter:
+    '''
+    Token bucket shared by the upload workers: each consumed byte costs a token, tokens are refilled at "rate" bytes/s
+    up to a burst of one second. A consumer that goes in debt sleeps until the debt is paid back.
+    '''
+    def __init__(self, rate:float):
+        self.rate = rate
+        self.capacity = rate
+        self.tokens = rate
+        self.t_last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n_bytes:int):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.t_last)*self.rate)
+            self.t_last = now
+            self.tokens -= n_bytes
+            wait_sec = -self.tokens/self.rate if self.tokens<0 else 0
+        if wait_sec>0:
+            time.sleep(wait_sec)
 
 
 class GatorDaqSync:
     FILES_EXT = {".root", ".json", ".txt"}
+    METADATA_EXTS = {".json", ".txt"}
+    UPLOAD_ORDER_CRITERIA = ('small_first', 'newest_run', 'oldest_first')
     SYNC_STATE_FNAME = '.sync_state'
+    SYNC_SUMMARY_FNAME = '.sync_summary'
+    PART_SUFFIX = '.part'
+    UPLOAD_REQUEST_KB = 32 #Default size of the single sftp write requests (as in paramiko put)
+    RESUME_VERIFY_BYTES = 1024*1024 #The last bytes of a ".part" file are compared with the local file before resuming
+    HASH_READ_SIZE = 1024*1024 #Read size when hashing the already uploaded part of a resumed file
+    SSH_MAX_SESSIONS = 10 #Default MaxSessions of the OpenSSH server: channels open at once on one ssh connection
 
     def __init__(self, config_fpath:str=""):
         if config_fpath=="":
@@ -33,6 +70,28 @@ class GatorDaqSync:
         self.username = config_dict['username']
         self.ssh_key_file = config_dict['ssh_key_file']
         self.remote_base_dir = config_dict['remote_base_dir']
+        self.remote_port = int(config_dict.get('remote_port', 22))
+
+        # The ssh session is kept open across the loops: keepalive interval and reconnection backoff (doubled at every failed attempt)
+        self.keepalive_sec = int(config_dict.get('keepalive_sec', 30))
+        self.connect_timeout_sec = float(config_dict.get('connect_timeout_sec', 30))
+        self.reconnect_backoff_sec = float(config_dict.get('reconnect_backoff_sec', 5))
+        self.reconnect_backoff_max_sec = float(config_dict.get('reconnect_backoff_max_sec', 300))
+
+        # Number of journal records of a directory sync state after which it is compacted into its snapshot
+        self.sync_state_compact_every = int(config_dict.get('sync_state_compact_every', 256))
+
+        # Summary of the completely synchronized directories (in local_base_dir), skipped by the next passes as long as
+        # their mtime and the newest mtime and total size of their append_exts files (appending to a file does not change the
+        # directory mtime) do not change. A directory is marked only once its newest file is at least summary_min_age_sec old.
+        self.use_sync_summary = bool(config_dict.get('use_sync_summary', True))
+        self.summary_min_age_sec = float(config_dict.get('summary_min_age_sec', 3600))
+        self._sync_summary = None
+
+        # Optional handoff to the processing: after every completed upload of a file with the notify_exts extensions a completion
+        # marker (json with the path relative to remote_base_dir) is written in the remote notify_spool_dir, consumed by GatorDaqProc
+        self.notify_spool_dir = config_dict.get('notify_spool_dir')
+        self.notify_exts = set(config_dict.get('notify_exts', ['.root']))
 
         self.loop_sleep_sec = 600 #Default sleep is 10 mins
         if('loop_sleep_sec' in config_dict):
@@ -43,9 +102,69 @@ class GatorDaqSync:
         else:
             self.logger = setup_logger()
 
+        # Number of concurrent uploads, each one on its own sftp channel (1: sequential uploads on the main channel)
+        self.upload_workers = 1
+        if 'upload_workers' in config_dict:
+            self.upload_workers = max(1, int(config_dict['upload_workers']))
+
+        # The progress of the large uploads is saved in the sync state every resume_checkpoint_mb, so that an interrupted upload
+        # (also by a crash or restart of the sync) continues from the ".part" file left in the destination
+        self.resume_checkpoint_bytes = int(float(config_dict.get('resume_checkpoint_mb', 64))*1024*1024)
+
+        # Tuning of the upload path for long fat links: size of the (pipelined) write requests, sftp channel window and packet sizes
+        # (None: paramiko defaults), preferred ciphers (in order) and the file extensions uploaded through a second, compressed, session
+        self.upload_request_size = int(float(config_dict.get('upload_request_kb', GatorDaqSync.UPLOAD_REQUEST_KB))*1024)
+        self.sftp_window_size = int(float(config_dict['sftp_window_mb'])*1024*1024) if config_dict.get('sftp_window_mb') else None
+        self.sftp_max_packet_size = int(float(config_dict['sftp_max_packet_kb'])*1024) if config_dict.get('sftp_max_packet_kb') else None
+        self.ciphers = config_dict.get('ciphers')
+        self.compress_exts = set(config_dict.get('compress_exts', []))
+
+        # Order of the global upload queue (see _order_uploads) and optional cap of the upload rate (MB/s), which also
+        # limits the reads from the local disk while the DAQ is writing
+        self.upload_order = list(config_dict.get('upload_order', ['small_first', 'newest_run']))
+        for criterion in self.upload_order:
+            if not criterion in GatorDaqSync.UPLOAD_ORDER_CRITERIA:
+                raise ValueError(f'GatorDaqSync.__init__: unknown upload order criterion "{criterion}". Valid criteria: {GatorDaqSync.UPLOAD_ORDER_CRITERIA}')
+        self.rate_limiter = None
+        if config_dict.get('max_upload_mb_per_sec'):
+            self.rate_limiter = UploadRateLimiter(float(config_dict['max_upload_mb_per_sec'])*1e6)
+
+        # Files still written by the DAQ are not uploaded: a file is stable when it was not modified for stable_quiet_sec
+        # and (where /proc is available) no process has it open for writing. Growing files with the append_exts
+        # extensions (the text logs) are instead uploaded incrementally, only the bytes appended since the last upload.
+        self.stable_quiet_sec = float(config_dict.get('stable_quiet_sec', 60))
+        self.check_open_files = bool(config_dict.get('check_open_files', True))
+        self.append_exts = set(config_dict.get('append_exts', ['.txt']))
+
+        # End-to-end check of the uploads: the sha256 of the local file (computed while it is read for the upload) must match
+        # the one computed on the remote host by "remote_hash_cmd" (run over ssh, it must print the hex digest first)
+        self.verify_checksum = bool(config_dict.get('verify_checksum', True))
+        self.remote_hash_cmd = config_dict.get('remote_hash_cmd', 'sha256sum')
+        self.checksum_active = False #Set at every connection, after checking that "remote_hash_cmd" works (see _probe_remote_hash)
+
+        # Every upload worker keeps its own sftp channel open on the main ssh connection, next to the main sftp channel and,
+        # with verify_checksum, it also opens an exec channel for the remote hash: the channels open at once must stay within
+        # the MaxSessions of the sshd of the remote host (ssh_max_sessions), otherwise the server refuses the extra ones
+        self.ssh_max_sessions = int(config_dict.get('ssh_max_sessions', GatorDaqSync.SSH_MAX_SESSIONS))
+        max_upload_workers = max(1, (self.ssh_max_sessions - 1)//(2 if self.verify_checksum else 1))
+        if self.upload_workers > max_upload_workers:
+            self.logger.warning(f'GatorDaqSync.__init__: {self.upload_workers} upload workers need more than the {self.ssh_max_sessions} ssh channels allowed by "ssh_max_sessions" (the MaxSessions of the remote sshd): using {max_upload_workers} workers.')
+            self.upload_workers = max_upload_workers
+
         self.ssh_client = None
         self.sftp_client = None
 
+        self._upload_pool = None
+        self._worker_local = threading.local()
+        self._worker_sftp_clients = []
+        self._state_lock = threading.Lock()
+
+        self._remote_dirs_known = set() #Remote directories known to exist in the current session
+
+        self._compressed_ssh_client = None
+        self._compressed_sftp_client = None
+        self._compressed_lock = threading.Lock() #The compressed sftp channel serves one upload at a time
+
     
     def _search_config_file(self):
         #Check if it is encoded in an environment variable
@@ -71,46 +190,77 @@ class GatorDaqSync:
         return None
 
     def _load_sync_state_file(self, _path):
-        if not os.path.exists(_path):
-            return {}
-        try:
-            with open(_path, "r") as f:
-                return json.load(f)
-        except Exception as err:
-            self.logger.error(f'GatorDaqSync.load_transferred_file: failed to read the sync state file "{_path}": {err}', exc_info=True)
-            return {}
+        # The sync state is a snapshot plus an append-only journal: every update is a single fsync'ed record (see JournaledStateStore)
+        return JournaledStateStore(_path, compact_every=self.sync_state_compact_every, logger=self.logger).load()
+
+    def _close_sync_state_file(self, sync_state_dict):
+        # Fold the journal of the pass into the snapshot
+        sync_state_dict.close(background=True)
+
+    def _open_ssh_client(self, compress:bool=False):
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
-    def _save_sync_state_file(self, sync_state_fpath, sync_state_dict):
-        with open(sync_state_fpath, "w") as f:
-            json.dump(sync_state_dict, f, indent=2)
+        disabled_algorithms = None
+        if self.ciphers:
+            # Only the configured ciphers are offered, paramiko keeps its own order of preference among them
+            disabled_algorithms = {'ciphers': [cipher for cipher in paramiko.Transport._preferred_ciphers if not cipher in self.ciphers]}
+
+        ssh_client.connect(self.remote_host,
+                        port=self.remote_port,
+                        username=self.username,
+                        key_filename=self.ssh_key_file,
+                        timeout=self.connect_timeout_sec,
+                        compress=compress,
+                        disabled_algorithms=disabled_algorithms
+                        )
+        # Keepalives keep the idle session (between two loops) through firewalls/NATs and detect a dead peer
+        ssh_client.get_transport().set_keepalive(self.keepalive_sec)
+        return ssh_client
+
+    def _open_sftp(self, ssh_client):
+        return paramiko.SFTPClient.from_transport(ssh_client.get_transport(), window_size=self.sftp_window_size, max_packet_size=self.sftp_max_packet_size)
 
     def connect(self):
-        self.ssh_client = paramiko.SSHClient()
-        self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        # A new session starts without any knowledge of the remote directories
+        self._remote_dirs_known = set()
 
         try:
-            self.ssh_client.connect(self.remote_host,
-                                username=self.username,
-                                key_filename=self.ssh_key_file
-                                )
-            self.logger.info('GatorDaqSync.connect: ssh client connected successfully')
+            self.ssh_client = self._open_ssh_client()
+            self.logger.info(f'GatorDaqSync.connect: ssh client connected successfully (cipher {self.ssh_client.get_transport().remote_cipher})')
         except Exception as err:
             self.logger.critical(f'GatorDaqSync.connect: failed to establish ssh connection with the remote server: {err}', exc_info=True)
             return None, None
         #
 
         try:
-            self.sftp_client = self.ssh_client.open_sftp()
+            self.sftp_client = self._open_sftp(self.ssh_client)
             self.logger.info('GatorDaqSync.connect: sftp client connected successfully')
         except Exception as err:
             self.logger.critical(f'GatorDaqSync.connect: failed to open the sftp connection with the remote server: {err}', exc_info=True)
             return self.ssh_client, None
-            
+
+        self.checksum_active = self.verify_checksum and self._probe_remote_hash()
+
         return self.ssh_client, self.sftp_client
 
+    def _probe_remote_hash(self):
+        """
+        Run "remote_hash_cmd" once on the remote host (on /dev/null, whose sha256 is known) before any upload.
+        If it is missing or does not print a sha256 the verification is turned off for this session with an error:
+        otherwise every upload would fail its check and nothing would be synchronized.
+        """
+        remote_sha256 = self._remote_sha256('/dev/null')
+        if remote_sha256 == hashlib.sha256(b'').hexdigest():
+            return True
+        self.logger.error(f'GatorDaqSync._probe_remote_hash: the remote hash command "{self.remote_hash_cmd}" does not work on the remote host (output on /dev/null: {remote_sha256}, a sha256 digest is expected). The checksum verification of the uploads is DISABLED for this session: fix "remote_hash_cmd" or set "verify_checksum" to false.')
+        return False
+
     def _ensure_remote_dirs(self, remote_dir:str, check_only:bool):
         """
         Ensure that the remote directory exists.
+        The directories found (or made) are remembered for the rest of the session, so that the same path components
+        are not checked again for every file. If the check fails with the help of the cache, it is repeated without it.
 
         Parameters:
             remote_dir (str): full remote directory path
@@ -124,6 +274,20 @@ class GatorDaqSync:
         if (remote_dir=="/") or (remote_dir==""):
             return True  # root always exists
 
+        if posixpath.normpath(remote_dir) in self._remote_dirs_known:
+            return True
+
+        dir_ok, cache_used = self._walk_remote_dirs(remote_dir, check_only, use_cache=True)
+        if (not dir_ok) and cache_used:
+            # Some cached parent directory may have been moved away (e.g. archived on the farm side) in the meanwhile
+            self._forget_remote_dir(remote_dir, parents=True)
+            dir_ok, _ = self._walk_remote_dirs(remote_dir, check_only, use_cache=False)
+        return dir_ok
+
+    def _walk_remote_dirs(self, remote_dir:str, check_only:bool, use_cache:bool):
+        # Returns whether the directory exists (or was made) and whether any information was taken from the cache
+        cache_used = False
+
         relpath = os.path.relpath(remote_dir, self.remote_base_dir)
 
         parts = relpath.strip("/").split("/")
@@ -133,31 +297,61 @@ class GatorDaqSync:
                 continue
 
             path = path + '/' + p
+
+            if use_cache and (posixpath.normpath(path) in self._remote_dirs_known):
+                cache_used = True
+                continue
             
             try:
                 st = self.sftp_client.stat(path)
                 if not stat.S_ISDIR(st.st_mode):
                     # Exists but is not a directory → fatal
-                    self.logger.error(f'GatorDaqSync._ensure_remote_dirs: the path "{path}" is not a directory as expected. Cannot continue chcking the existence of the destination other sub-directories "{remote_dir}"', file=sys.stderr)
-                    return False
+                    self.logger.error(f'GatorDaqSync._ensure_remote_dirs: the path "{path}" is not a directory as expected. Cannot continue chcking the existence of the destination other sub-directories "{remote_dir}"')
+                    return False, cache_used
             
             except FileNotFoundError:
                 # Directory does not exist
                 if check_only:
-                    return False
+                    return False, cache_used
                 # Create it
                 try:
                     self.logger.info(f'GatorDaqSync._ensure_remote_dirs:making directory "{path}"')
                     self.sftp_client.mkdir(path)
                 except IOError as err:
+                    if cache_used:
+                        # Probably a cached parent is gone: the caller checks again without the cache
+                        return False, cache_used
                     # Creation failed → remote FS changed or permission denied
                     self.logger.error(f'GatorDaqSync._ensure_remote_dirs: failed to create directory "{path}" while checking the existence of the destination directory "{remote_dir}": {err}', exc_info=True)
-                    return False
-        return True
-            
-    def _file_needs_upload(self, local_f_path, remote_f_path, sync_state_dict):
+                    return False, cache_used
+            self._remote_dirs_known.add(posixpath.normpath(path))
+        return True, cache_used
+
+    def _forget_remote_dir(self, remote_dir:str, parents:bool=False):
+        # Drop a directory (and its sub-directories, optionally also its parents) from the cache of the known remote directories
+        remote_dir = posixpath.normpath(remote_dir)
+        with self._state_lock:
+            for path in list(self._remote_dirs_known):
+                if (path==remote_dir) or path.startswith(remote_dir + '/') or (parents and remote_dir.startswith(path + '/')):
+                    self._remote_dirs_known.discard(path)
+
+    def _list_remote_dir(self, remote_dir):
+        """
+        List the remote directory with a single round trip (names and attributes).
+
+        Returns:
+            dict: {fname: SFTPAttributes} of the remote directory, None if the directory does not exist
+        """
+        try:
+            return {attr.filename: attr for attr in self.sftp_client.listdir_attr(remote_dir)}
+        except IOError:
+            # remote directory missing? then treat as "file does not exist"
+            return None
+
+    def _file_needs_upload(self, local_f_path, remote_f_path, sync_state_dict, remote_listing):
         """
         Determine whether a local file needs to be uploaded to the remote host.
+        The remote side is known from the listing of the remote directory (see _list_remote_dir): no round trips here.
 
         Conditions requiring upload:
           - Not present in sync_state_dict
@@ -182,24 +376,12 @@ class GatorDaqSync:
         if int(local_stat.st_mtime) > int(sync_state["mtime"]):
             return True
 
-        # Check if remote file exists using listdir (no exceptions)
-        remote_dir = os.path.dirname(remote_f_path)
-        try:
-            remote_f_exists = fname in self.sftp_client.listdir(remote_dir)
-        except IOError:
-            # remote directory missing? then treat as "file does not exist"
-            remote_f_exists = False
-        
         # It means that the file was transferred and already archived
-        if not remote_f_exists:
+        if (remote_listing is None) or (not fname in remote_listing):
             return False
 
         # Remote file exists → compare mtimes
-        try:
-            remote_stat = self.sftp_client.stat(remote_f_path)
-        except IOError:
-            # Although we just checked listdir, race conditions can happen and the file being archived in the meanwhile
-            return False
+        remote_stat = remote_listing[fname]
         
         # Remote file older than local → upload
         if int(remote_stat.st_mtime) < int(local_stat.st_mtime):
@@ -207,9 +389,332 @@ class GatorDaqSync:
 
         return False
 
-    def _sync_directory(self, relpath, f_list):
+    def _upload_file(self, sftp_client, local_f_path, remote_f_path, remote_listing, resume_state=None, checkpoint=None):
+        """
+        Upload one file with the ".part"/rename protocol through the given sftp client (channel).
+        The listing of the remote directory tells whether an outdated destination file must be removed first,
+        and it is updated with the uploaded file.
+        An upload interrupted before is resumed from its ".part" file (see _resume_offset).
+
+        Parameters:
+            resume_state (dict): progress of a previous upload of this file saved in the sync state, None if missing
+            checkpoint (callable): called with the new progress entry while uploading
+
+        Returns:
+            dict: the sync state entry of the file if the upload succeeded, None otherwise
+        """
+        fname = os.path.basename(local_f_path)
+
+        sync_fail = False
+
+        local_st = os.stat(local_f_path)
+
+        tmp = remote_f_path + GatorDaqSync.PART_SUFFIX
+        unixtime = time.time()
+        compressed = (sftp_client is self._compressed_sftp_client)
+
+        offset = self._resume_offset(sftp_client, local_f_path, local_st, tmp, remote_listing.get(fname + GatorDaqSync.PART_SUFFIX), resume_state)
+        if offset>0:
+            self.logger.info(f"GatorDaqSync._upload_file: [RESUME] {local_f_path} from byte {offset} of {local_st.st_size}")
+        else:
+            self.logger.info(f"GatorDaqSync._upload_file: [UPLOAD] {local_f_path}")
+        t_put = time.time()
+        local_sha256 = self._put_from_offset(sftp_client, local_f_path, local_st, tmp, offset, checkpoint)
+        t_put = time.time() - t_put
+        sftp_client.chmod(tmp, stat.S_IMODE(local_st.st_mode))
+        sftp_client.utime(tmp, (local_st.st_atime, local_st.st_mtime))
+
+        try:
+            tmp_st = sftp_client.stat(tmp)
+            if tmp_st.st_size != local_st.st_size:
+                self.logger.error(f'GatorDaqSync._upload_file: size mismatch of the temporary file "{tmp}" ({tmp_st.st_size} bytes) with respect to the local file "{local_f_path}" ({local_st.st_size} bytes)')
+                sync_fail = True
+        except FileNotFoundError as err:
+            self.logger.error(f'GatorDaqSync._upload_file: temporary file "{tmp}" vanished before rename: {err}', exc_info=True)
+            sync_fail = True
+        #
+
+        t_hash = 0.
+        if (not sync_fail) and self.checksum_active:
+            t_hash = time.time()
+            remote_sha256 = self._remote_sha256(tmp)
+            t_hash = time.time() - t_hash
+            if remote_sha256 != local_sha256:
+                self.logger.error(f'GatorDaqSync._upload_file: checksum mismatch of the temporary file "{tmp}" (sha256 {remote_sha256}) with respect to the local file "{local_f_path}" (sha256 {local_sha256})')
+                sync_fail = True
+                if remote_sha256 is not None:
+                    # The next attempt must not resume from corrupted data
+                    try:
+                        sftp_client.remove(tmp)
+                    except IOError:
+                        pass
+            #
+        #
+
+        #Check before whether the destination file already exists
+        if (not sync_fail) and (fname in remote_listing):
+            try:
+                sftp_client.remove(remote_f_path)
+            except Exception as err:
+                self.logger.error(f'GatorDaqSync._upload_file: failed to remove the outdated file "{remote_f_path}" from the destination directory. Cannot finish synchronization of the local file "{local_f_path}". A ".part" file may be left over in the destination directory and may need of manual removal', exc_info=True)
+                sync_fail = True
+
+        if sync_fail:
+            return None
+
+        sftp_client.rename(tmp, remote_f_path)
+
+        # Throughput report of the file, to measure the effect of the upload settings
+        mb_sent = (local_st.st_size - offset)/1e6
+        self.logger.info(f'GatorDaqSync._upload_file: [DONE] {local_f_path}: {mb_sent:.2f} MB in {t_put:.2f} s ({mb_sent/max(t_put, 1e-6):.2f} MB/s, request {self.upload_request_size//1024} kB{", compressed" if compressed else ""}), remote checksum {t_hash:.2f} s, total {time.time()-unixtime:.2f} s')
+
+        # The remote file has now the size and times of the local one at the beginning of the upload
+        remote_attr = paramiko.SFTPAttributes.from_stat(local_st, filename=fname)
+        with self._state_lock:
+            remote_listing[fname] = remote_attr
+            remote_listing.pop(fname + GatorDaqSync.PART_SUFFIX, None)
+        
+        # The state describes the uploaded version of the file: if it grew in the meanwhile it is uploaded again by the next pass
+        return {
+            "unixtime": int(unixtime),
+            "mtime": int(local_st.st_mtime),
+            "size": local_st.st_size,
+            "sha256": local_sha256
+            }
+
+    def _append_file(self, sftp_client, local_f_path, remote_f_path, remote_listing, offset, prefix_sha256):
+        """
+        Append to the remote file the bytes added to the local file after "offset" (the size of the last upload).
+        The remote file is written in place: this is meant for the text logs, which are only appended to.
+
+        Returns:
+            dict: the sync state entry of the file if the append succeeded, None if the file must be uploaded as a whole
+        """
+        fname = os.path.basename(local_f_path)
+        local_st = os.stat(local_f_path)
+
+        self.logger.info(f"GatorDaqSync._append_file: [APPEND] {local_f_path} from byte {offset} of {local_st.st_size}")
+        unixtime = time.time()
+        local_sha256 = self._put_from_offset(sftp_client, local_f_path, local_st, remote_f_path, offset, None, prefix_sha256=prefix_sha256)
+        if local_sha256 is None:
+            self.logger.warning(f'GatorDaqSync._append_file: the beginning of "{local_f_path}" changed since its last upload, it is uploaded again')
+            return None
+        sftp_client.utime(remote_f_path, (local_st.st_atime, local_st.st_mtime))
+
+        if self.checksum_active:
+            remote_sha256 = self._remote_sha256(remote_f_path)
+            if remote_sha256 != local_sha256:
+                self.logger.error(f'GatorDaqSync._append_file: checksum mismatch of the remote file "{remote_f_path}" (sha256 {remote_sha256}) with respect to the local file "{local_f_path}" (sha256 {local_sha256}), it is uploaded again')
+                return None
+            #
+        #
+
+        with self._state_lock:
+            remote_listing[fname] = paramiko.SFTPAttributes.from_stat(local_st, filename=fname)
+
+        return {
+            "unixtime": int(unixtime),
+            "mtime": int(local_st.st_mtime),
+            "size": local_st.st_size,
+            "sha256": local_sha256
+            }
+
+    def _notify_uploaded(self, sftp_client, remote_f_path, sync_state_entry):
+        """
+        Write the completion marker of an uploaded file in the remote spool directory (if configured).
+        The marker is written under a hidden temporary name and renamed, so that the consumer never reads it half written.
+        A failure is only logged: the file is anyway found by the next full pass of the processing.
+        """
+        if (self.notify_spool_dir is None) or (not os.path.splitext(remote_f_path)[1] in self.notify_exts):
+            return
+        marker = {
+            "relpath": posixpath.relpath(remote_f_path, self.remote_base_dir),
+            "size": sync_state_entry["size"],
+            "sha256": sync_state_entry.get("sha256"),
+            "unixtime": int(time.time())
+            }
+        marker_fname = f'{time.time_ns()}_{uuid.uuid4().hex[:8]}.json'
+        tmp = posixpath.join(self.notify_spool_dir, '.' + marker_fname + '.tmp')
+        try:
+            with sftp_client.open(tmp, 'w') as f:
+                f.write(json.dumps(marker))
+            sftp_client.rename(tmp, posixpath.join(self.notify_spool_dir, marker_fname))
+        except Exception as err:
+            self.logger.warning(f'GatorDaqSync._notify_uploaded: failed to write the completion marker of "{remote_f_path}" in "{self.notify_spool_dir}": {err}')
+
+    def _resume_offset(self, sftp_client, local_f_path, local_st, tmp, part_attr, resume_state):
+        """
+        Offset from which the upload of a file can continue.
+        The ".part" file is resumed only if the progress saved in the sync state refers to the same version (size and mtime)
+        of the local file, and only up to the saved offset. The last bytes before the offset are then compared (sha256)
+        with the local file: on any mismatch the upload starts again from the beginning.
+        """
+        if (part_attr is None) or (resume_state is None):
+            return 0
+        if (resume_state.get('size') != local_st.st_size) or (resume_state.get('mtime') != int(local_st.st_mtime)):
+            return 0
+
+        offset = min(int(resume_state.get('offset', 0)), part_attr.st_size, local_st.st_size)
+        if offset<=0:
+            return 0
+
+        n_verify = min(offset, GatorDaqSync.RESUME_VERIFY_BYTES)
+        try:
+            with open(local_f_path, 'rb') as f:
+                f.seek(offset - n_verify)
+                local_hash = hashlib.sha256(f.read(n_verify)).digest()
+            with sftp_client.open(tmp, 'rb') as f:
+                f.seek(offset - n_verify)
+                f.prefetch(n_verify)
+                remote_hash = hashlib.sha256(f.read(n_verify)).digest()
+        except IOError as err:
+            self.logger.warning(f'GatorDaqSync._resume_offset: cannot verify the partial upload "{tmp}", uploading "{local_f_path}" from the beginning: {err}')
+            return 0
+
+        if local_hash != remote_hash:
+            self.logger.warning(f'GatorDaqSync._resume_offset: the partial upload "{tmp}" does not match the local file "{local_f_path}", uploading from the beginning')
+            return 0
+        return offset
+
+    def _remote_sha256(self, remote_f_path):
+        # sha256 hex digest of a remote file computed on the remote host, None if it could not be computed
+        cmd = f'{self.remote_hash_cmd} {shlex.quote(remote_f_path)}'
+        try:
+            _, stdout, stderr = self.ssh_client.exec_command(cmd)
+            output = stdout.read().decode(errors='replace')
+            exit_status = stdout.channel.recv_exit_status()
+        except Exception as err:
+            self.logger.error(f'GatorDaqSync._remote_sha256: failed to run "{cmd}" on the remote host: {err}', exc_info=True)
+            return None
+        #
+        if (exit_status != 0) or (len(output.split())==0):
+            self.logger.error(f'GatorDaqSync._remote_sha256: "{cmd}" failed on the remote host (exit status {exit_status}): {stderr.read().decode(errors="replace").strip()}')
+            return None
+        return output.split()[0].lower()
+
+    def _put_from_offset(self, sftp_client, local_f_path, local_st, tmp, offset, checkpoint, prefix_sha256=None):
+        """
+        Write the local file into the remote "tmp" file starting at "offset", saving the progress every resume_checkpoint_bytes.
+        The file is read once, sequentially: the part before the offset is only hashed.
+        With "prefix_sha256", nothing is written if the part before the offset does not have that digest.
+
+        Returns:
+            str: sha256 hex digest of the local file (the first local_st.st_size bytes), None if the prefix does not match
+        """
+        def save_progress(n_bytes):
+            if checkpoint is not None:
+                checkpoint({"offset": n_bytes, "size": local_st.st_size, "mtime": int(local_st.st_mtime)})
+
+        checkpoint_bytes = self.resume_checkpoint_bytes
+        if (checkpoint_bytes <= 0) or (local_st.st_size <= checkpoint_bytes):
+            # Small files are just uploaded again
+            checkpoint_bytes = None
+
+        sha256 = hashlib.sha256()
+        with open(local_f_path, 'rb') as fl:
+            n_hashed = 0
+            while n_hashed < offset:
+                data = fl.read(min(GatorDaqSync.HASH_READ_SIZE, offset - n_hashed))
+                if self.rate_limiter is not None:
+                    self.rate_limiter.consume(len(data))
+                if len(data)==0:
+                    raise IOError(f'GatorDaqSync._put_from_offset: the local file "{local_f_path}" was truncated during the upload')
+                sha256.update(data)
+                n_hashed += len(data)
+            #
+            if (prefix_sha256 is not None) and (sha256.hexdigest() != prefix_sha256):
+                return None
+            with sftp_client.open(tmp, 'r+b' if offset>0 else 'wb') as fr:
+                if offset>0:
+                    # Drop whatever was written after the last saved offset
+                    fr.truncate(offset)
+                    fr.seek(offset)
+                fr.MAX_REQUEST_SIZE = self.upload_request_size
+                fr.set_pipelined(True)
+
+                n_bytes = offset
+                next_checkpoint = None
+                if checkpoint_bytes is not None:
+                    save_progress(n_bytes)
+                    next_checkpoint = n_bytes + checkpoint_bytes
+                while n_bytes < local_st.st_size:
+                    data = fl.read(min(self.upload_request_size, local_st.st_size - n_bytes))
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.consume(len(data))
+                    if len(data)==0:
+                        raise IOError(f'GatorDaqSync._put_from_offset: the local file "{local_f_path}" was truncated during the upload')
+                    sha256.update(data)
+                    fr.write(data)
+                    n_bytes += len(data)
+                    if (next_checkpoint is not None) and (n_bytes >= next_checkpoint):
+                        # The offset may be ahead of the bytes acknowledged by the server: _resume_offset never goes beyond the size of the ".part" file
+                        save_progress(n_bytes)
+                        next_checkpoint = n_bytes + checkpoint_bytes
+        return sha256.hexdigest()
+
+    def _worker_sftp_client(self):
+        # Each upload worker thread gets its own sftp channel on the shared ssh transport
+        sftp_client = getattr(self._worker_local, 'sftp_client', None)
+        if sftp_client is None:
+            sftp_client = self._open_sftp(self.ssh_client)
+            self._worker_local.sftp_client = sftp_client
+            with self._state_lock:
+                self._worker_sftp_clients.append(sftp_client)
+        return sftp_client
+
+    def _get_compressed_sftp_client(self):
+        # The compressed session is opened at its first use (and again if it dropped), None if it cannot be opened
+        if self._compressed_ssh_client is not None:
+            transport = self._compressed_ssh_client.get_transport()
+            if (transport is not None) and transport.is_active():
+                return self._compressed_sftp_client
+            self._close_compressed_session()
+        try:
+            self._compressed_ssh_client = self._open_ssh_client(compress=True)
+            self._compressed_sftp_client = self._open_sftp(self._compressed_ssh_client)
+            self.logger.info('GatorDaqSync._get_compressed_sftp_client: compressed ssh session opened')
+        except Exception as err:
+            self.logger.warning(f'GatorDaqSync._get_compressed_sftp_client: failed to open the compressed ssh session, using the uncompressed one: {err}')
+            self._close_compressed_session()
+        return self._compressed_sftp_client
+
+    def _close_compressed_session(self):
+        for client in (self._compressed_sftp_client, self._compressed_ssh_client):
+            if client is not None:
+                try:
+                    client.close()
+                except Exception:
+                    pass
+        self._compressed_sftp_client = None
+        self._compressed_ssh_client = None
+
+    def _close_upload_workers(self):
+        if self._upload_pool is not None:
+            self._upload_pool.shutdown(wait=True)
+            self._upload_pool = None
+        for sftp_client in self._worker_sftp_clients:
+            try:
+                sftp_client.close()
+            except Exception:
+                pass
+        self._worker_sftp_clients = []
+        self._worker_local = threading.local()
+
+    def _plan_directory(self, relpath, f_list, open_files=frozenset()):
+        """
+        Find the files of a local directory that need to be uploaded.
+        Files still being written are left for a later pass, except the growing text logs (append_exts), whose new lines are appended.
+
+        Parameters:
+            open_files (set): real paths of the local files open for writing (see _files_open_for_writing)
+
+        Returns:
+            dict: the state of the directory synchronization ("dirpath", "remote_dir", "sync_state_fpath", "sync_state_dict",
+                  "remote_listing", "run_mtime"), the list of the files to upload ("uploads") and the offsets of the
+                  files to upload in append mode ("append_offsets")
+        """
         dirpath = os.path.join(self.local_base_dir, relpath)
-        self.logger.info(f'GatorDaqSync._sync_directory: synchronizing directory {dirpath} ({len(f_list)} files)')
+        self.logger.info(f'GatorDaqSync._plan_directory: checking directory {dirpath} ({len(f_list)} files)')
 
         # Build remote directory path
         remote_dir = os.path.join(self.remote_base_dir, relpath)
@@ -217,6 +722,17 @@ class GatorDaqSync:
         sync_state_fpath = os.path.join(dirpath, GatorDaqSync.SYNC_STATE_FNAME)
         sync_state_dict = self._load_sync_state_file(sync_state_fpath)
 
+        # One listing of the remote directory per pass, kept up to date by the uploads.
+        # It is also the check of its existence: a directory archived on the farm side is not in the cache anymore
+        remote_listing = self._list_remote_dir(remote_dir)
+        if remote_listing is None:
+            self._forget_remote_dir(remote_dir)
+        else:
+            self._remote_dirs_known.add(posixpath.normpath(remote_dir))
+
+        uploads_lst = list()
+        append_offsets = dict()
+        n_deferred = 0
         for fname in f_list:
             skip_file = False
             local_f_path = os.path.join(dirpath, fname)
@@ -224,7 +740,7 @@ class GatorDaqSync:
 
             if fname in sync_state_dict:
                 # Just check if the remote directory exists. If it doesn't it means that it was archived already
-                if not self._ensure_remote_dirs(remote_dir, check_only=True):
+                if remote_listing is None:
                     skip_file = True
             else:
                 # The file was never transferred: if the remote dir does not exist make it
@@ -233,55 +749,242 @@ class GatorDaqSync:
                     skip_file = True
             #
 
-            if (not skip_file) and self._file_needs_upload(local_f_path, remote_f_path, sync_state_dict):
-                
-                sync_fail = False
+            if (not skip_file) and self._file_needs_upload(local_f_path, remote_f_path, sync_state_dict, remote_listing):
+                append_offset = self._append_offset(local_f_path, sync_state_dict.get(fname), remote_listing)
+                if append_offset is not None:
+                    append_offsets[fname] = append_offset
+                    uploads_lst.append(fname)
+                elif (os.path.splitext(fname)[1] in self.append_exts) or self._file_is_stable(local_f_path, open_files):
+                    # A growing text log is uploaded as it is now, the next passes append the new lines
+                    uploads_lst.append(fname)
+                else:
+                    self.logger.debug(f"GatorDaqSync._plan_directory: [BUSY] {local_f_path}")
+                    n_deferred += 1
+            else:
+                self.logger.debug(f"GatorDaqSync._plan_directory: [SKIP] {local_f_path}")
+
+        if remote_listing is None:
+            # The directory did not exist at the time of the listing and it was created for the new files
+            remote_listing = dict()
+
+        # The newest file tells how recent the run is
+        run_mtime = max((os.stat(os.path.join(dirpath, fname)).st_mtime for fname in f_list), default=0)
+
+        return {
+            "dirpath": dirpath,
+            "remote_dir": remote_dir,
+            "sync_state_fpath": sync_state_fpath,
+            "sync_state_dict": sync_state_dict,
+            "remote_listing": remote_listing,
+            "run_mtime": run_mtime,
+            "uploads": uploads_lst,
+            "append_offsets": append_offsets,
+            "n_deferred": n_deferred
+            }
+
+    def _append_files_signature(self, dirpath, f_list):
+        # Newest mtime and total size of the append_exts files of a directory: they grow in place, without changing the directory mtime
+        mtime_ns, size = 0, 0
+        for fname in f_list:
+            if os.path.splitext(fname)[1] in self.append_exts:
+                st = os.stat(os.path.join(dirpath, fname))
+                mtime_ns = max(mtime_ns, st.st_mtime_ns)
+                size += st.st_size
+        return [mtime_ns, size]
+
+    def _summary_skips(self, relpath, dir_mtime_ns, append_signature):
+        # Whether the directory was found completely synchronized by a previous pass and did not change since then
+        summary = self._sync_summary.get(relpath)
+        if summary is None:
+            return False
+        if summary.get("all_synced") and (summary.get("dir_mtime_ns") == dir_mtime_ns) and (summary.get("append_signature") == append_signature):
+            return True
+        # The directory changed: the entry is obsolete
+        self._sync_summary.delete(relpath)
+        return False
+
+    def _update_summary(self, relpath, dir_mtime_ns, append_signature, dir_plan):
+        """
+        Mark the directory as completely synchronized if nothing is left to upload, no file was deferred, all its files are
+        old enough that they will not be modified anymore, and its sync state has no journal to fold (the compaction would change the directory mtime).
+        """
+        if (len(dir_plan["uploads"])>0) or (dir_plan["n_deferred"]>0) or (dir_plan["sync_state_dict"].n_journal_records>0):
+            return
+        if time.time() - dir_plan["run_mtime"] < max(self.summary_min_age_sec, self.stable_quiet_sec):
+            return
+        self._sync_summary.commit(relpath, {"dir_mtime_ns": dir_mtime_ns, "append_signature": append_signature, "all_synced": True, "unixtime": int(time.time())})
+        self.logger.debug(f'GatorDaqSync._update_summary: [SYNCED] {dir_plan["dirpath"]}')
 
-                local_st = os.stat(local_f_path)
+    def _file_is_stable(self, local_f_path, open_files):
+        # A file is stable when it was not modified during the quiet period and it is not open for writing
+        if time.time() - os.stat(local_f_path).st_mtime < self.stable_quiet_sec:
+            return False
+        return not (os.path.realpath(local_f_path) in open_files)
 
-                self.logger.info(f"GatorDaqSync._sync_directory: [UPLOAD] {local_f_path}")
+    def _append_offset(self, local_f_path, sync_state, remote_listing):
+        """
+        Offset from which a file can be uploaded in append mode, None if it must be uploaded as a whole.
+        Only files with the append_exts extensions that grew since their last upload, whose remote copy has still the
+        uploaded size, are appended. The unchanged beginning of the file is verified against the recorded sha256 while uploading.
+        """
+        fname = os.path.basename(local_f_path)
+        if (not os.path.splitext(fname)[1] in self.append_exts) or (sync_state is None) or (not "sha256" in sync_state):
+            return None
+        if (not fname in remote_listing) or (remote_listing[fname].st_size != sync_state["size"]):
+            return None
+        if os.stat(local_f_path).st_size <= sync_state["size"]:
+            return None
+        return sync_state["size"]
 
-                tmp = remote_f_path + ".part"
-                unixtime = time.time()
-                self.sftp_client.put(local_f_path, tmp)
-                self.sftp_client.chmod(tmp, stat.S_IMODE(local_st.st_mode))
-                self.sftp_client.utime(tmp, (local_st.st_atime, local_st.st_mtime))
+    def _files_open_for_writing(self):
+        """
+        Real paths of the files under the local base directory that some process has open for writing,
+        from the file descriptors in /proc (only the processes that can be inspected). Empty where /proc is not available.
+        """
+        open_files = set()
+        if (not self.check_open_files) or (not os.path.isdir('/proc')):
+            return open_files
 
+        base_dir = os.path.realpath(self.local_base_dir) + os.sep
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            fd_dir = os.path.join('/proc', pid, 'fd')
+            try:
+                fds = os.listdir(fd_dir)
+            except OSError:
+                continue
+            for fd in fds:
                 try:
-                    self.sftp_client.stat(tmp)
-                except FileNotFoundError as err:
-                    self.logger.error(f'GatorDaqSync._sync_directory: temporary file "{tmp}" vanished before rename: {err}', exc_info=True)
-                    sync_fail = True
-                #
-
-                #Check before whether the destination file already exists
-                if (not sync_fail) and (fname in self.sftp_client.listdir(remote_dir)):
-                    try:
-                        self.sftp_client.remove(remote_f_path)
-                    except Exception as err:
-                        self.logger.error(f'GatorDaqSync._sync_directory: failed to remove the outdated file "{remote_f_path}" from the destination directory. Cannot finish synchronization of the local file "{local_f_path}". A ".part" file may be left over in the destination directory and may need of manual removal', exc_info=True)
-                        sync_fail = True
-
-                if not sync_fail:
-                    self.sftp_client.rename(tmp, remote_f_path)
-                    
-                    st = os.stat(local_f_path)
-                    sync_state_dict[fname] = {
-                        "unixtime": int(unixtime),
-                        "mtime": int(st.st_mtime),
-                        "size": st.st_size
-                        }
-                    # save updated per-file sync status. Many overwrites, but much safer
-                    self._save_sync_state_file(sync_state_fpath, sync_state_dict)
-            else:
-                self.logger.debug(f"GatorDaqSync._sync_directory: [SKIP] {local_f_path}")
+                    target = os.readlink(os.path.join(fd_dir, fd))
+                except OSError:
+                    continue
+                if not target.startswith(base_dir):
+                    continue
+                flags = os.O_WRONLY #If the flags cannot be read the file is assumed to be written
+                try:
+                    with open(os.path.join('/proc', pid, 'fdinfo', fd), 'r') as f:
+                        for line in f:
+                            if line.startswith('flags:'):
+                                flags = int(line.split()[1], 8)
+                                break
+                except (OSError, ValueError):
+                    pass
+                if flags & (os.O_WRONLY | os.O_RDWR):
+                    open_files.add(target)
+            #
+        #
+        return open_files
+
+    def _order_uploads(self, dir_plans_lst):
+        """
+        Global queue of the pending uploads of all the directories, as (dir_plan, fname) tuples, sorted according to the
+        criteria of upload_order (in order of importance):
+          - "small_first":  metadata/configuration files (METADATA_EXTS) before the data files
+          - "newest_run":   the directories with the most recent files first
+          - "oldest_first": the oldest files first (backlog drain)
+        Ties keep the order of the files within the run (by mtime, then name).
+        """
+        queue = list()
+        for dir_plan in dir_plans_lst:
+            for fname in dir_plan["uploads"]:
+                st = os.stat(os.path.join(dir_plan["dirpath"], fname))
+                queue.append((dir_plan, fname, st))
+            #
+        #
+
+        def sort_key(item):
+            dir_plan, fname, st = item
+            key = list()
+            for criterion in self.upload_order:
+                if criterion=='small_first':
+                    key.append(0 if (os.path.splitext(fname)[1] in GatorDaqSync.METADATA_EXTS) else 1)
+                elif criterion=='newest_run':
+                    key.append(-dir_plan["run_mtime"])
+                elif criterion=='oldest_first':
+                    key.append(st.st_mtime)
+            key.extend([st.st_mtime, dir_plan["dirpath"], fname])
+            return key
+
+        queue.sort(key=sort_key)
+        return [(dir_plan, fname) for dir_plan, fname, _ in queue]
+
+    def _upload_queue(self, queue):
+        # Upload the files in the order of the queue, sequentially or with the pool of workers
+        def upload(dir_plan, fname, sftp_client=None):
+            if sftp_client is None:
+                sftp_client = self._worker_sftp_client()
+
+            dirpath, remote_dir = dir_plan["dirpath"], dir_plan["remote_dir"]
+            sync_state_dict = dir_plan["sync_state_dict"]
+            remote_listing = dir_plan["remote_listing"]
+
+            part_key = fname + GatorDaqSync.PART_SUFFIX
+            def checkpoint(progress_entry):
+                # The progress of the upload is saved as the entry of the ".part" file
+                sync_state_dict.commit(part_key, progress_entry)
+
+            def upload_through(client):
+                if fname in dir_plan["append_offsets"]:
+                    sync_state_entry = self._append_file(client, os.path.join(dirpath, fname), os.path.join(remote_dir, fname), remote_listing,
+                                                         dir_plan["append_offsets"][fname], sync_state_dict[fname]["sha256"])
+                    if sync_state_entry is not None:
+                        return sync_state_entry
+                    # The beginning of the file changed (or the append failed): it is uploaded as a whole
+                return self._upload_file(client, os.path.join(dirpath, fname), os.path.join(remote_dir, fname), remote_listing,
+                                         resume_state=sync_state_dict.get(part_key), checkpoint=checkpoint)
+
+            try:
+                if os.path.splitext(fname)[1] in self.compress_exts:
+                    with self._compressed_lock:
+                        compressed_sftp_client = self._get_compressed_sftp_client()
+                        sync_state_entry = upload_through(compressed_sftp_client if (compressed_sftp_client is not None) else sftp_client)
+                else:
+                    sync_state_entry = upload_through(sftp_client)
+            except Exception:
+                # Do not trust the cached existence of the destination anymore
+                self._forget_remote_dir(remote_dir)
+                raise
+            if sync_state_entry is None:
+                return
+            # Each commit is a journal record, durable when it returns (the store serializes the workers)
+            sync_state_dict.commit(fname, sync_state_entry)
+            sync_state_dict.delete(part_key)
+
+            self._notify_uploaded(sftp_client, os.path.join(remote_dir, fname), sync_state_entry)
+
+        if (self.upload_workers <= 1) or (len(queue) <= 1):
+            for dir_plan, fname in queue:
+                upload(dir_plan, fname, self.sftp_client)
+            return
+
+        if self._upload_pool is None:
+            self._upload_pool = ThreadPoolExecutor(max_workers=self.upload_workers, thread_name_prefix='GatorDaqSyncUpload')
+
+        # The pool starts the uploads in the order of submission
+        futures = {self._upload_pool.submit(upload, dir_plan, fname): os.path.join(dir_plan["dirpath"], fname) for dir_plan, fname in queue}
+        first_err = None
+        for future in as_completed(futures):
+            err = future.exception()
+            if err is not None:
+                self.logger.error(f'GatorDaqSync._upload_queue: failed to upload "{futures[future]}": {err}', exc_info=err)
+                if first_err is None:
+                    first_err = err
+        # As in the sequential case, an error of the connection interrupts the synchronization of the tree
+        if first_err is not None:
+            raise first_err
 
-        
-    
     def _sync_tree(self):
         # First change directory
         os.chdir(self.local_base_dir)
 
+        if self.use_sync_summary and (self._sync_summary is None):
+            self._sync_summary = JournaledStateStore(os.path.join(self.local_base_dir, GatorDaqSync.SYNC_SUMMARY_FNAME), compact_every=self.sync_state_compact_every, logger=self.logger).load()
+
+        # All the directories are checked first, then the pending files are uploaded from a single queue
+        open_files = self._files_open_for_writing()
+        dir_plans_lst = list()
+        n_skipped = 0
         for dirpath, dirnames, filenames in os.walk('.'):
             # relative path for remote
             relpath = os.path.relpath(dirpath, self.local_base_dir)
@@ -294,34 +997,119 @@ class GatorDaqSync:
             f_list = [fname for fname in filenames if (os.path.splitext(fname)[1] in GatorDaqSync.FILES_EXT)]
             if len(f_list)==0:
                 continue
-            
-            self._sync_directory(relpath, f_list)
+
+            if self._sync_summary is not None:
+                dir_mtime_ns = os.stat(dirpath).st_mtime_ns
+                append_signature = self._append_files_signature(dirpath, f_list)
+                if self._summary_skips(relpath, dir_mtime_ns, append_signature):
+                    n_skipped += 1
+                    continue
+                dir_plan = self._plan_directory(relpath, f_list, open_files)
+                self._update_summary(relpath, dir_mtime_ns, append_signature, dir_plan)
+            else:
+                dir_plan = self._plan_directory(relpath, f_list, open_files)
+            dir_plans_lst.append(dir_plan)
+
+        if n_skipped>0:
+            self.logger.info(f'GatorDaqSync._sync_tree: {n_skipped} directories already synchronized skipped')
+
+        queue = self._order_uploads(dir_plans_lst)
+        if len(queue)>0:
+            self.logger.info(f'GatorDaqSync._sync_tree: {len(queue)} files to upload from {sum(1 for dir_plan in dir_plans_lst if dir_plan["uploads"])} directories (order: {", ".join(self.upload_order)})')
+        try:
+            self._upload_queue(queue)
+        finally:
+            for dir_plan in dir_plans_lst:
+                self._close_sync_state_file(dir_plan["sync_state_dict"])
+            if self._sync_summary is not None:
+                self._sync_summary.close(background=True)
     
+    def close(self):
+        # Close the upload workers channels, the sftp client and the ssh session(s)
+        self._close_upload_workers()
+        with self._compressed_lock:
+            self._close_compressed_session()
+        if self.sftp_client:
+            try:
+                self.sftp_client.close()
+            except Exception:
+                pass
+            self.sftp_client = None
+        if self.ssh_client:
+            try:
+                self.ssh_client.close()
+            except Exception:
+                pass
+            self.ssh_client = None
+
+    def _session_alive(self):
+        """
+        Health check of the long-lived session: the transport must be active and the sftp channel must answer
+        (a stat of the remote base directory, one round trip).
+        """
+        if (self.ssh_client is None) or (self.sftp_client is None):
+            return False
+        transport = self.ssh_client.get_transport()
+        if (transport is None) or (not transport.is_active()):
+            return False
+        try:
+            self.sftp_client.stat(self.remote_base_dir)
+        except Exception as err:
+            self.logger.warning(f'GatorDaqSync._session_alive: the sftp session does not respond: {err}')
+            return False
+        return True
+
+    def _ensure_session(self):
+        """
+        Reuse the current session if it is healthy, otherwise reconnect.
+
+        Returns:
+            bool: True if a working session is available
+        """
+        if self._session_alive():
+            return True
+        if self.ssh_client is not None:
+            self.logger.warning('GatorDaqSync._ensure_session: the session with the remote server was lost, reconnecting')
+        self.close()
+        ssh, sftp = self.connect()
+        if (ssh is None) or (sftp is None):
+            self.close()
+            return False
+        return True
+
+    def _next_backoff(self, backoff_sec):
+        if backoff_sec is None:
+            return self.reconnect_backoff_sec
+        return min(2*backoff_sec, self.reconnect_backoff_max_sec)
+
     def sync_loop(self):
+        backoff_sec = None #Set only while the connection keeps failing
         try:
             while True:
                 self.logger.info('GatorDaqSync.sync_loop: start loop')
-                ssh, sftp = self.connect()
-                if (not ssh is None) and (not sftp is None):
-                    try:
-                        self._sync_tree()
-                    finally:
-                        # Ensure connections are closed even if sync_tree fails
-                        if self.sftp_client:
-                            self.sftp_client.close()
-                            self.sftp_client = None
-                        if self.ssh_client:
-                            self.ssh_client.close()
-                            self.ssh_client = None
-                        #
+                if not self._ensure_session():
+                    backoff_sec = self._next_backoff(backoff_sec)
+                    self.logger.warning(f'GatorDaqSync.sync_loop: no connection with the remote server, next attempt in {backoff_sec} s')
+                    time.sleep(backoff_sec)
+                    continue
+
+                try:
+                    self._sync_tree()
+                except Exception as err:
+                    if not self._session_alive():
+                        # The connection dropped in the middle of the pass: reconnect and resume as soon as possible
+                        backoff_sec = self._next_backoff(backoff_sec)
+                        self.logger.error(f'GatorDaqSync.sync_loop: connection lost during the synchronization ({err}), resuming in {backoff_sec} s')
+                        self.close()
+                        time.sleep(backoff_sec)
+                        continue
+                    self.logger.exception('GatorDaqSync.sync_loop: failed to synchronize the directory tree')
+
+                backoff_sec = None
                 time.sleep(self.loop_sleep_sec)
         except KeyboardInterrupt:
             self.logger.info("GatorDaqSync.sync_loop: interrupted by user (Ctrl+C), exiting gracefully")
-            # Optionally close connections if still open
-            if self.sftp_client:
-                self.sftp_client.close()
-            if self.ssh_client:
-                self.ssh_client.close()
+            self.close()
             return
 
 def main():
@@ -0,0 +1,429 @@
+import os
+import time
+import queue
+import socket
+import threading
+import subprocess
+from collections import Counter
+
+import paramiko
+from paramiko import SFTPServer, SFTPServerInterface, SFTPAttributes, SFTPHandle, SFTP_OK, SFTP_FAILURE
+
+
+class LocalSftpServer:
+    '''
+    SFTP server on 127.0.0.1 serving the local filesystem (remote paths are local paths), a stand-in of the farm for the benchmarks.
+    Any key is accepted. Every SFTP request is counted by type ("write_bytes" counts the uploaded bytes), and the "exec"
+    requests (e.g. the remote checksum) run the command in a local shell.
+    '''
+    def __init__(self):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.counts = Counter()
+        self._counts_lock = threading.Lock()
+        self._transports = list()
+        self._sock = None
+        self.port = None
+    #
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(100)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept_loop, name='LocalSftpServer', daemon=True).start()
+        return self
+    #
+
+    def stop(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        #
+        for transport in self._transports:
+            transport.close()
+        #
+        self._transports = list()
+    #
+
+    def count(self, request, n=1):
+        with self._counts_lock:
+            self.counts[request] += n
+        #
+    #
+
+    def reset_counts(self):
+        with self._counts_lock:
+            self.counts = Counter()
+        #
+    #
+
+    def n_requests(self, data_requests:bool=True):
+        # Number of requests, optionally without the (pipelined) data transfers
+        with self._counts_lock:
+            return sum(n for request, n in self.counts.items() if (request!='write_bytes') and (data_requests or not request in ('write', 'read')))
+        #
+    #
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            #
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', SFTPServer, _LocalSftpInterface)
+            transport.start_server(server=_LocalSshInterface(self))
+            self._transports.append(transport)
+        #
+    #
+#
+
+
+class _LocalSshInterface(paramiko.ServerInterface):
+    def __init__(self, bench_server):
+        self.bench_server = bench_server
+    #
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+    #
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+    #
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+    #
+
+    def check_channel_exec_request(self, channel, command):
+        self.bench_server.count('exec')
+
+        def run():
+            try:
+                res = subprocess.run(command.decode(), shell=True, capture_output=True)
+                channel.sendall(res.stdout)
+                channel.sendall_stderr(res.stderr)
+                channel.send_exit_status(res.returncode)
+            finally:
+                channel.close()
+            #
+        #
+        threading.Thread(target=run, daemon=True).start()
+        return True
+    #
+#
+
+
+class _LocalSftpHandle(SFTPHandle):
+    def __init__(self, bench_server, flags):
+        super().__init__(flags)
+        self.bench_server = bench_server
+    #
+
+    def read(self, offset, length):
+        self.bench_server.count('read')
+        return super().read(offset, length)
+    #
+
+    def write(self, offset, data):
+        self.bench_server.count('write')
+        self.bench_server.count('write_bytes', len(data))
+        return super().write(offset, data)
+    #
+
+    def stat(self):
+        self.bench_server.count('fstat')
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        #
+    #
+
+    def chattr(self, attr):
+        self.bench_server.count('fsetstat')
+        return SFTP_OK
+    #
+
+    def close(self):
+        self.bench_server.count('close')
+        super().close()
+    #
+#
+
+
+class _LocalSftpInterface(SFTPServerInterface):
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.bench_server = server.bench_server
+    #
+
+    def list_folder(self, path):
+        self.bench_server.count('listdir')
+        try:
+            attrs_lst = list()
+            for fname in os.listdir(path):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(path, fname)))
+                attr.filename = fname
+                attrs_lst.append(attr)
+            #
+            return attrs_lst
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        #
+    #
+
+    def stat(self, path):
+        self.bench_server.count('stat')
+        try:
+            return SFTPAttributes.from_stat(os.stat(path))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        #
+    #
+
+    def lstat(self, path):
+        self.bench_server.count('stat')
+        try:
+            return SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        #
+    #
+
+    def open(self, path, flags, attr):
+        self.bench_server.count('open')
+        try:
+            fd = os.open(path, flags, 0o644)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        #
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        #
+        handle = _LocalSftpHandle(self.bench_server, flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+    #
+
+    def remove(self, path):
+        self.bench_server.count('remove')
+        try:
+            os.remove(path)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        #
+        return SFTP_OK
+    #
+
+    def rename(self, oldpath, newpath):
+        # Plain SFTP rename semantics: the destination must not exist
+        self.bench_server.count('rename')
+        if os.path.exists(newpath):
+            return SFTP_FAILURE
+        #
+        try:
+            os.rename(oldpath, newpath)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        #
+        return SFTP_OK
+    #
+
+    def mkdir(self, path, attr):
+        self.bench_server.count('mkdir')
+        try:
+            os.mkdir(path)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        #
+        return SFTP_OK
+    #
+
+    def rmdir(self, path):
+        self.bench_server.count('rmdir')
+        try:
+            os.rmdir(path)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        #
+        return SFTP_OK
+    #
+
+    def chattr(self, path, attr):
+        self.bench_server.count('setstat')
+        try:
+            if attr._flags & attr.FLAG_PERMISSIONS:
+                os.chmod(path, attr.st_mode)
+            #
+            if attr._flags & attr.FLAG_AMTIME:
+                os.utime(path, (attr.st_atime, attr.st_mtime))
+            #
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        #
+        return SFTP_OK
+    #
+#
+
+
+class LinkEmulator:
+    '''
+    TCP relay in front of a server emulating the network link: a one-way delay of half the round trip time and an
+    optional bandwidth cap for each direction. The data is relayed in chunks, so the pipelined requests in flight
+    are not serialized by the delay (as on a real link, where only the ssh window limits them).
+    The connections can be dropped after a given number of bytes sent by the client, to emulate a crash of the link.
+    '''
+    CHUNK_SIZE = 65536
+
+    def __init__(self, target_port:int, rtt_ms:float=0., bandwidth_mb_per_sec:float=None):
+        self.target_port = target_port
+        self.delay_sec = rtt_ms/2000.
+        self.bandwidth = bandwidth_mb_per_sec*1e6 if bandwidth_mb_per_sec else None
+        self.port = None
+        self._sock = None
+        self._conns = list()
+        self._conns_lock = threading.Lock()
+        self._drop_after = None
+        self._client_bytes = 0
+    #
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(100)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept_loop, name='LinkEmulator', daemon=True).start()
+        return self
+    #
+
+    def stop(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        #
+        self.drop_connections()
+    #
+
+    def drop_after(self, n_bytes:int):
+        # Drop all the connections once the clients sent n_bytes more (None: never)
+        with self._conns_lock:
+            self._client_bytes = 0
+            self._drop_after = n_bytes
+        #
+    #
+
+    def drop_connections(self):
+        with self._conns_lock:
+            conns, self._conns = self._conns, list()
+        #
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            #
+            conn.close()
+        #
+    #
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            #
+            server = socket.create_connection(('127.0.0.1', self.target_port))
+            for conn in (client, server):
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            #
+            with self._conns_lock:
+                self._conns.extend([client, server])
+            #
+            self._start_pump(client, server, from_client=True)
+            self._start_pump(server, client, from_client=False)
+        #
+    #
+
+    def _start_pump(self, src, dst, from_client):
+        chunks = queue.Queue()
+
+        def receive():
+            while True:
+                try:
+                    data = src.recv(LinkEmulator.CHUNK_SIZE)
+                except OSError:
+                    data = b''
+                #
+                chunks.put((time.monotonic(), data))
+                if not data:
+                    return
+                #
+                if from_client and self._count_client_bytes(len(data)):
+                    self.drop_connections()
+                    chunks.put((time.monotonic(), b''))
+                    return
+                #
+            #
+        #
+
+        def send():
+            link_free_at = 0.
+            while True:
+                t_received, data = chunks.get()
+                if not data:
+                    try:
+                        dst.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    #
+                    return
+                #
+                t_send = t_received + self.delay_sec
+                if self.bandwidth is not None:
+                    # The chunk leaves once the previous ones went through the link
+                    t_send = max(t_send, link_free_at)
+                    link_free_at = t_send + len(data)/self.bandwidth
+                #
+                wait_sec = t_send - time.monotonic()
+                if wait_sec>0:
+                    time.sleep(wait_sec)
+                #
+                try:
+                    dst.sendall(data)
+                except OSError:
+                    return
+                #
+            #
+        #
+
+        threading.Thread(target=receive, daemon=True).start()
+        threading.Thread(target=send, daemon=True).start()
+    #
+
+    def _count_client_bytes(self, n_bytes):
+        # True when the connections must be dropped
+        with self._conns_lock:
+            if self._drop_after is None:
+                return False
+            #
+            self._client_bytes += n_bytes
+            if self._client_bytes >= self._drop_after:
+                self._drop_after = None
+                return True
+            #
+            return False
+        #
+    #
+#
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+'''
+Benchmark of GatorDaqSync._sync_tree against a local SFTP server (see sftp_server.py), through an emulated link.
+
+Run from the repository root, e.g.:
+    python -m benchmarks.sync_bench --runs 4 --files-per-run 5 --root-mb 20 --rtt-ms 20 --bandwidth-mb-per-sec 50
+    python -m benchmarks.sync_bench --rtt-ms 20 --config '{"upload_workers": 4, "upload_request_kb": 256}'
+
+Each scenario runs one pass (or a crash plus the pass after the restart) and reports the uploaded files/s and MB/s,
+and the sftp requests ("round trips") per file, with and without the pipelined data requests.
+At the end the remote copies are compared with the local files.
+'''
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+import paramiko
+
+#The imports here below must be in the $PYTHONPATH (run from the repository root)
+from SyncDaqFiles import GatorDaqSync
+from GatorUtils import JournaledStateStore
+from benchmarks.sftp_server import LocalSftpServer, LinkEmulator
+
+
+SCENARIOS = ('initial', 'rescan', 'rescan_summary', 'incremental', 'crash_resume', 'torn_state')
+DATASET_NAME = 'bench_ds'
+
+
+class SyncBench:
+    def __init__(self, args):
+        self.args = args
+        self.work_dir = args.work_dir if args.work_dir else tempfile.mkdtemp(prefix='gator_sync_bench_')
+        self.local_dir = os.path.join(self.work_dir, 'local')
+        self.remote_dir = os.path.join(self.work_dir, 'remote')
+        self.rng = random.Random(args.seed)
+        self.n_runs = 0
+        self.n_instances = 0
+        self.results = list()
+
+        self.server = None
+        self.link = None
+        self.sync = None
+    #
+
+    def setup(self):
+        if os.path.exists(self.work_dir):
+            shutil.rmtree(self.work_dir)
+        #
+        os.makedirs(self.local_dir)
+        os.makedirs(self.remote_dir)
+
+        key_fpath = os.path.join(self.work_dir, 'bench_key')
+        paramiko.RSAKey.generate(2048).write_private_key_file(key_fpath)
+
+        self.server = LocalSftpServer().start()
+        self.link = LinkEmulator(self.server.port, rtt_ms=self.args.rtt_ms, bandwidth_mb_per_sec=self.args.bandwidth_mb_per_sec).start()
+
+        config_dict = {
+            "local_base_dir": self.local_dir,
+            "remote_host": "127.0.0.1",
+            "remote_port": self.link.port,
+            "username": "bench",
+            "ssh_key_file": key_fpath,
+            "remote_base_dir": self.remote_dir,
+            "resume_checkpoint_mb": 8, #Small enough to resume the files of the crash scenario
+            "logging": {
+                "logger_name": "GatorSyncBench",
+                "log_dir": os.path.join(self.work_dir, 'logs'),
+                "log_file_prefix": "sync_bench",
+                "log_level": self.args.log_level
+            }
+        }
+        config_dict.update(json.loads(self.args.config))
+        self.config_fpath = os.path.join(self.work_dir, 'sync_config.json')
+        with open(self.config_fpath, 'w') as f:
+            json.dump(config_dict, f, indent=2)
+        #
+
+        for _ in range(self.args.runs):
+            self.make_run()
+        #
+    #
+
+    def make_run(self, root_mb:float=None):
+        # A run directory of old (stable) files: root data files, a json configuration and a text log
+        run_name = f'run_{self.n_runs:04d}'
+        run_dir = os.path.join(self.local_dir, DATASET_NAME, run_name)
+        os.makedirs(run_dir)
+        root_bytes = int((self.args.root_mb if root_mb is None else root_mb)*1e6)
+
+        fpaths = list()
+        for i_file in range(self.args.files_per_run):
+            fpath = os.path.join(run_dir, f'{run_name}_{i_file:03d}.root')
+            with open(fpath, 'wb') as f:
+                f.write(self.rng.randbytes(root_bytes))
+            #
+            fpaths.append(fpath)
+        #
+        fpath = os.path.join(run_dir, f'{run_name}.json')
+        with open(fpath, 'w') as f:
+            json.dump({'run': self.n_runs, 'channels': [0, 1], 'comment': 'sync benchmark'}, f)
+        #
+        fpaths.append(fpath)
+        fpath = os.path.join(run_dir, f'{run_name}_log.txt')
+        with open(fpath, 'w') as f:
+            f.writelines(f'{i} acquisition message\n' for i in range(1000))
+        #
+        fpaths.append(fpath)
+
+        # Old enough to be stable and to be marked in the sync summary
+        mtime = time.time() - 2*86400 + self.n_runs
+        for fpath in fpaths:
+            os.utime(fpath, (mtime, mtime))
+        #
+        self.n_runs += 1
+        return run_dir
+    #
+
+    def new_sync(self):
+        # A new GatorDaqSync instance, as after a restart of the daemon
+        if self.sync is not None:
+            self.sync.close()
+        #
+        self.n_instances += 1
+        with open(self.config_fpath, 'r') as f:
+            config_dict = json.load(f)
+        #
+        config_dict['logging']['logger_name'] = f'GatorSyncBench{self.n_instances}'
+        with open(self.config_fpath, 'w') as f:
+            json.dump(config_dict, f, indent=2)
+        #
+        self.sync = GatorDaqSync(self.config_fpath)
+        if not self.sync._ensure_session():
+            raise RuntimeError('SyncBench.new_sync: cannot connect to the local sftp server')
+        #
+        return self.sync
+    #
+
+    def run_pass(self, scenario, n_local_files, expect_failure=False):
+        self.server.reset_counts()
+        t_start = time.perf_counter()
+        failed = False
+        try:
+            self.sync._sync_tree()
+        except Exception:
+            if not expect_failure:
+                raise
+            #
+            failed = True
+        #
+        elapsed = time.perf_counter() - t_start
+        # Let the background compactions of the sync states finish before the next pass
+        time.sleep(0.2)
+        return self.record(scenario, elapsed, n_local_files, failed=failed)
+    #
+
+    def record(self, scenario, elapsed, n_local_files, failed=False):
+        counts = self.server.counts
+        n_uploaded = counts['rename'] #One rename per completed upload
+        mb = counts['write_bytes']/1e6
+        n_files = max(n_uploaded, 1)
+        res = {
+            'scenario': scenario,
+            'failed': failed,
+            'elapsed_sec': elapsed,
+            'files_uploaded': n_uploaded,
+            'mb_uploaded': mb,
+            'files_per_sec': n_uploaded/elapsed if elapsed>0 else 0.,
+            'mb_per_sec': mb/elapsed if elapsed>0 else 0.,
+            'requests': self.server.n_requests(),
+            'round_trips_per_file': self.server.n_requests(data_requests=False)/n_files,
+            'requests_per_local_file': self.server.n_requests()/max(n_local_files, 1),
+            'counts': dict(counts)
+        }
+        self.results.append(res)
+        return res
+    #
+
+    def n_local_files(self):
+        return sum(len([fname for fname in fnames if os.path.splitext(fname)[1] in GatorDaqSync.FILES_EXT]) for _, _, fnames in os.walk(self.local_dir))
+    #
+
+    def scenario_crash_resume(self):
+        # The link drops in the middle of a large upload, the daemon restarts and resumes from the ".part" file
+        run_dir = self.make_run(root_mb=max(4*self.args.root_mb, 8))
+        self.link.drop_after(int(0.6*self.n_run_bytes(run_dir)))
+        crash = self.run_pass('crash', self.n_local_files(), expect_failure=True)
+        self.link.drop_after(None)
+        self.new_sync()
+        res = self.run_pass('crash_resume', self.n_local_files())
+        res['mb_before_crash'] = crash['mb_uploaded']
+        res['resend_fraction'] = (crash['mb_uploaded'] + res['mb_uploaded'])*1e6/self.n_run_bytes(run_dir) - 1
+        return res
+    #
+
+    def scenario_torn_state(self):
+        # A crash in the middle of a sync state write leaves a torn record: nothing must be uploaded again
+        self.new_sync()
+        for dirpath, _, fnames in os.walk(os.path.join(self.local_dir, DATASET_NAME)):
+            if GatorDaqSync.SYNC_STATE_FNAME in fnames:
+                with open(os.path.join(dirpath, GatorDaqSync.SYNC_STATE_FNAME) + JournaledStateStore.JOURNAL_SUFFIX, 'ab') as f:
+                    f.write(b'{"k": "torn_rec')
+                #
+                # Make the directory be checked again
+                os.utime(dirpath)
+            #
+        #
+        return self.run_pass('torn_state', self.n_local_files())
+    #
+
+    def n_run_bytes(self, run_dir):
+        return sum(os.path.getsize(os.path.join(run_dir, fname)) for fname in os.listdir(run_dir) if os.path.splitext(fname)[1] in GatorDaqSync.FILES_EXT)
+    #
+
+    def verify(self):
+        # Remote copies identical to the local files
+        n_bad = 0
+        for dirpath, _, fnames in os.walk(self.local_dir):
+            for fname in fnames:
+                if not os.path.splitext(fname)[1] in GatorDaqSync.FILES_EXT:
+                    continue
+                #
+                local_fpath = os.path.join(dirpath, fname)
+                remote_fpath = os.path.join(self.remote_dir, os.path.relpath(local_fpath, self.local_dir))
+                if (not os.path.exists(remote_fpath)) or (file_sha256(local_fpath) != file_sha256(remote_fpath)):
+                    print(f'SyncBench.verify: remote copy of "{local_fpath}" missing or different', file=sys.stderr)
+                    n_bad += 1
+                #
+            #
+        #
+        return n_bad
+    #
+
+    def run(self):
+        self.setup()
+        try:
+            self.new_sync()
+            for scenario in self.args.scenarios:
+                if scenario=='initial':
+                    self.run_pass('initial', self.n_local_files())
+                elif scenario in ('rescan', 'rescan_summary'):
+                    # The first rescan marks the synchronized runs in the summary, the second one skips them
+                    self.run_pass(scenario, self.n_local_files())
+                elif scenario=='incremental':
+                    self.make_run()
+                    self.run_pass('incremental', self.n_local_files())
+                elif scenario=='crash_resume':
+                    self.scenario_crash_resume()
+                elif scenario=='torn_state':
+                    self.scenario_torn_state()
+                #
+            #
+            n_bad = self.verify()
+        finally:
+            if self.sync is not None:
+                self.sync.close()
+            #
+            self.link.stop()
+            self.server.stop()
+            if not self.args.keep:
+                shutil.rmtree(self.work_dir, ignore_errors=True)
+            #
+        #
+        return n_bad
+    #
+
+    def report(self, n_bad):
+        print(f'\nGatorDaqSync benchmark: {self.args.runs} runs x {self.args.files_per_run} root files of {self.args.root_mb} MB, '
+              f'rtt {self.args.rtt_ms} ms, bandwidth {self.args.bandwidth_mb_per_sec or "unlimited"} MB/s, config {self.args.config}')
+        header = f'{"scenario":<16}{"time [s]":>10}{"files":>7}{"MB":>9}{"files/s":>9}{"MB/s":>9}{"requests":>10}{"rt/file":>9}{"req/local file":>16}'
+        print(header)
+        print('-'*len(header))
+        for res in self.results:
+            print(f'{res["scenario"]:<16}{res["elapsed_sec"]:>10.2f}{res["files_uploaded"]:>7d}{res["mb_uploaded"]:>9.1f}{res["files_per_sec"]:>9.1f}'
+                  f'{res["mb_per_sec"]:>9.1f}{res["requests"]:>10d}{res["round_trips_per_file"]:>9.1f}{res["requests_per_local_file"]:>16.2f}'
+                  + (f'   re-sent {100*res["resend_fraction"]:.1f}% of the run' if 'resend_fraction' in res else ''))
+        #
+        print(f'\nVerification: {"all the remote copies match" if n_bad==0 else f"{n_bad} files missing or different"}')
+
+        if self.args.json:
+            with open(self.args.json, 'w') as f:
+                json.dump({'settings': vars(self.args), 'results': self.results, 'n_bad_files': n_bad}, f, indent=2)
+            #
+        #
+    #
+#
+
+
+def file_sha256(fpath):
+    sha256 = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''):
+            sha256.update(block)
+        #
+    #
+    return sha256.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark GatorDaqSync._sync_tree against a local sftp server through an emulated link.')
+    parser.add_argument('--runs', type=int, default=4, help='Number of run directories of the initial dataset.')
+    parser.add_argument('--files-per-run', type=int, default=5, help='Number of root files per run.')
+    parser.add_argument('--root-mb', type=float, default=20, help='Size of the root files (MB).')
+    parser.add_argument('--rtt-ms', type=float, default=0, help='Round trip time of the emulated link (ms).')
+    parser.add_argument('--bandwidth-mb-per-sec', type=float, default=None, help='Bandwidth of the emulated link (MB/s, default: unlimited).')
+    parser.add_argument('--config', default='{}', help='JSON of GatorDaqSync settings added to the benchmark configuration.')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS, help='Scenarios to run, in order.')
+    parser.add_argument('--work-dir', default=None, help='Working directory (default: a temporary one). Its content is deleted!')
+    parser.add_argument('--keep', action='store_true', help='Keep the working directory.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic data.')
+    parser.add_argument('--log-level', default='WARNING', help='Log level of GatorDaqSync.')
+    parser.add_argument('--json', default=None, help='Also write the results to this json file.')
+    args = parser.parse_args()
+
+    bench = SyncBench(args)
+    n_bad = bench.run()
+    bench.report(n_bad)
+    return 0 if n_bad==0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
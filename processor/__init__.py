@@ -3,6 +3,10 @@ from .data_managers import (
     GatorFileProcessor,
     GatorDatasetsStorage,
     GatorDatasetsProcessor,
+    GatorProcMetrics,
+    GatorProcGraph,
+    GatorColumnBuffer,
+    GatorEventsCache,
 )
 
 from .wfs_processors import *
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+
+class GatorColumnBuffer:
+    '''
+    Columns of the features of a file, filled by the waveforms processors in place of a dataframe: a dict of numpy arrays
+    of known length, which becomes a dataframe only once, at the end (no column inserts in the pandas block manager).
+
+    The columns are stored with a compact data type: the one given at the assignment (see GatorWfsProc.COLS_DTYPES) or,
+    by default, float32 for the floating point values and int32 for the 64 bit integers.
+    '''
+    COMPACT_DTYPES = {np.dtype(np.float64): np.dtype(np.float32), np.dtype(np.int64): np.dtype(np.int32)}
+
+    def __init__(self, n_rows:int, cols:dict=None):
+        self.n_rows = int(n_rows)
+        self.cols = dict()
+        for col, arr in (cols or dict()).items():
+            self.setCol(col, arr, compact=False)
+        #
+    #
+
+    def setCol(self, col:str, values, dtype=None, compact:bool=True):
+        if isinstance(values, (pd.Series, pd.Index)):
+            values = values.to_numpy()
+        #
+        values = np.asarray(values, dtype=dtype)
+        if (dtype is None) and compact:
+            values = values.astype(GatorColumnBuffer.COMPACT_DTYPES.get(values.dtype, values.dtype), copy=False)
+        #
+        if values.ndim==0:
+            #A scalar is the same value for all the rows
+            values = np.full(self.n_rows, values, dtype=values.dtype if values.dtype.kind!='U' else object)
+        #
+        if values.shape!=(self.n_rows,):
+            raise ValueError(f'GatorColumnBuffer.setCol: the column "{col}" has shape {values.shape}, while ({self.n_rows},) is expected.')
+        #
+        self.cols[col] = values
+        return self
+    #
+
+    def __setitem__(self, col, values):
+        self.setCol(col, values)
+    #
+
+    def __getitem__(self, col):
+        return self.cols[col]
+    #
+
+    def __contains__(self, col):
+        return col in self.cols
+    #
+
+    def __iter__(self):
+        return iter(self.cols)
+    #
+
+    def __len__(self):
+        return self.n_rows
+    #
+
+    @property
+    def columns(self):
+        return list(self.cols)
+    #
+
+    def toDf(self):
+        # The only time the features are copied: pandas consolidates the arrays in one block per data type
+        return pd.DataFrame(self.cols, index=pd.RangeIndex(self.n_rows))
+    #
+#
@@ -5,6 +5,8 @@ import numpy as np
 import pandas as pd
 
 from .GatorRawFileHandler import GatorRawFileHandler
+from .GatorProcGraph import GatorProcGraph
+from .GatorEventsCache import GatorEventsCache
 from ..wfs_processors import GatorChsMap
 
 class GatorDatasetsStorage:
@@ -27,6 +29,10 @@ class GatorDatasetsStorage:
         #
 
         self.chs_lst = list(chs_map)
+
+        #Built at the first request of processed events (see procEvents), with one cache per file
+        self.proc_graph = None
+        self.events_caches = dict()
         
         self.files_handl_lst = list()
         self.dfs_lst = list()
@@ -66,6 +72,21 @@ class GatorDatasetsStorage:
         return {ch_name: wf[wfId] for ch_name, wf in _wfs_dict.items()}
     #
 
+    def procEvents(self, fileId:int, indices):
+        '''
+        The processors run on the selected events of a file, in one vectorized pass.
+        Returns {"indices", "cols", "wfs"} with the quantities of the events stacked in arrays (see GatorEventsCache),
+        cached per file for the interactive browsing.
+        '''
+        if self.proc_graph is None:
+            self.proc_graph = GatorProcGraph.fromChsMap(self.chs_map)
+        #
+        if not fileId in self.events_caches:
+            self.events_caches[fileId] = GatorEventsCache(self.proc_graph, load_wfs=self.files_handl_lst[fileId].getSelWfs)
+        #
+        return self.events_caches[fileId](indices)
+    #
+
     def getChsMap(self):
         return self.chs_lst
 #
\ No newline at end of file
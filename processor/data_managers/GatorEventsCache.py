@@ -0,0 +1,77 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class GatorEventsCache:
+    '''
+    Processed events of one file for the event displays: the columns and all the waveform products of every event, computed
+    in batches by a GatorProcGraph and kept (up to "max_events", the least recently used are dropped), so that browsing back
+    and forth through the events does not process them again.
+
+    "load_wfs" is called with the (sorted) indices of the events to process and returns their raw waveforms, as
+    {channel: array of shape (n_events, n_samps)}.
+    '''
+    def __init__(self, proc_graph, load_wfs, max_events:int=4096):
+        self.proc_graph = proc_graph
+        self.load_wfs = load_wfs
+        self.max_events = int(max_events)
+        self._events = OrderedDict()
+    #
+
+    def __call__(self, indices):
+        '''
+        Returns the events as stacked arrays, in the order of "indices":
+            {"indices": array, "cols": {column: array}, "wfs": {product: {channel: array of shape (n_events, n_samps)}}}
+        (the products with more than one array per channel, as "gaussfilter", keep their own dict).
+        '''
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+
+        missing = np.unique([idx for idx in indices.tolist() if not idx in self._events]).astype(np.int64)
+        if missing.size>0:
+            #The whole batch goes through the processors at once
+            cols, products = self.proc_graph.procEvents(self.load_wfs(missing))
+            for iEv, idx in enumerate(missing.tolist()):
+                self._events[idx] = {'cols': _take(cols, iEv), 'wfs': _take(products, iEv)}
+            #
+        #
+
+        events_lst = list()
+        for idx in indices.tolist():
+            self._events.move_to_end(idx)
+            events_lst.append(self._events[idx])
+        #
+        ret = {'indices': indices, 'cols': _stack([ev['cols'] for ev in events_lst]), 'wfs': _stack([ev['wfs'] for ev in events_lst])}
+
+        while len(self._events) > self.max_events:
+            self._events.popitem(last=False)
+        #
+        return ret
+    #
+
+    def clear(self):
+        self._events.clear()
+    #
+#
+
+def _take(obj, iEv):
+    # The entry of one event from the (nested dicts of) arrays of a batch (a copy: the batch can be released)
+    if isinstance(obj, dict):
+        return {key: _take(val, iEv) for key, val in obj.items()}
+    if obj is None:
+        return None
+    obj = np.asarray(obj)
+    if obj.ndim==1:
+        return obj[iEv]
+    return obj[iEv].copy()
+#
+
+def _stack(objs_lst):
+    if len(objs_lst)==0:
+        return dict()
+    if isinstance(objs_lst[0], dict):
+        return {key: _stack([obj[key] for obj in objs_lst]) for key in objs_lst[0]}
+    if objs_lst[0] is None:
+        return None
+    return np.stack(objs_lst)
+#
@@ -1,6 +1,11 @@
+import os
 from pathlib import Path
 
 from .GatorRawFileHandler import GatorRawFileHandler
+from .GatorProcMetrics import GatorProcMetrics
+from .GatorProcGraph import GatorProcGraph
+from .GatorColumnBuffer import GatorColumnBuffer
+from .GatorEventsCache import GatorEventsCache
 from ..wfs_processors import *
 
 import numpy as np
@@ -8,89 +13,85 @@ import pandas as pd
 
 
 class GatorFileProcessor:
-    def __init__(self, fpath:str|Path, chs_map:GatorChsMap, keepwfs:bool=True):
+    def __init__(self, fpath:str|Path, chs_map:GatorChsMap, keepwfs:bool=True, metrics:GatorProcMetrics=None, low_memory:bool=False, executor=None, proc_graph:GatorProcGraph=None):
+        #With "low_memory" only the dataframe is produced: the raw wfs are handed over by the file handler (no copy), every waveform
+        #product is released once no remaining processor needs it and this object keeps none of them.
+        self.low_memory = low_memory
+        #Optional thread pool (e.g. concurrent.futures.ThreadPoolExecutor) running the per channel work of the processors.
+        #Not used with an already built "proc_graph", whose processors have their own.
+        self.executor = executor
 
         self.chs_lst = list(chs_map)
         self.chs_map = chs_map
 
-        self.filehandler = GatorRawFileHandler(fpath=str(fpath), chs_lst=self.chs_lst)
-
-        self.filehandler() #Load the data and for the moment keep the wfs
+        #Timing and throughput of the stages of the processing (the loading of the file is the first)
+        self.metrics = metrics if (metrics is not None) else GatorProcMetrics()
 
-        self.df = self.filehandler.getDf()
+        self.filehandler = GatorRawFileHandler(fpath=str(fpath), chs_lst=self.chs_lst)
 
-        cols = list(self.df)
+        self.metrics.bytes_read = os.path.getsize(fpath)
+        with self.metrics.stage('load', bytes_read=self.metrics.bytes_read):
+            self.filehandler() #Load the data and for the moment keep the wfs
+        #
 
-        self.df['filename'] = Path(fpath).name
+        #The processors fill a buffer of typed columns, which becomes the dataframe only at the end (see getDf)
+        raw_df = self.filehandler.df
+        self.cols = GatorColumnBuffer(n_rows=len(raw_df))
+        self.cols['filename'] = Path(fpath).name
+        for col in raw_df:
+            self.cols.setCol(col, raw_df[col], compact=False)
+        #
+        self.df = None
 
-        self.df = self.df[['filename']+cols]
+        self.metrics.n_events = len(self.cols)
 
         #Now the wfs can be released
-        if(not keepwfs):
+        if(not keepwfs) and (not low_memory):
             self.filehandler.releaseWfs()
         #
 
-        #This is the only waveforms processor that is not in the callbacks list. A Wf processor without this doesn't make sense.
-        self.raw_wfs_proc = GatorRawWfsProc(chs_map=self.chs_map)
-        self.bsln_corr_proc = GatorBslnSubtraction(chs_map=self.chs_map)
+        #The processors run in the order of their declared dependencies. They are stateless: a graph can be shared by many files.
+        self.proc_graph = proc_graph if (proc_graph is not None) else GatorProcGraph.fromChsMap(self.chs_map, executor=executor)
 
-        self.callbacks = self._parseCallbacks()
+        #Processed events for the event displays (see procEvents)
+        self.events_cache = GatorEventsCache(self.proc_graph, load_wfs=self.filehandler.getSelWfs)
     #
 
-    def _parseCallbacks(self):
-        cbnames_lst = list()
-        for chname in self.chs_map:
-            if not 'processors' in self.chs_map[chname]:
-                continue
-            #
-            for cbname in self.chs_map[chname]['processors']:
-                cbnames_lst.append(cbname)
-            #
-        #
-        #Make the list with unique entries
-        cbnames_lst = set(cbnames_lst)
-        cb_lst = list()
-        for cbname in cbnames_lst:
-            cb_lst.append(get_wfs_proc_registry()[cbname](chs_map=self.chs_map))
-        #
-        return cb_lst
+    def procEvents(self, indices):
+        '''
+        All the processors on the selected events only, in one vectorized pass (the dataframe of the file is not touched).
+        Returns {"indices", "cols", "wfs"} with the quantities of the events stacked in arrays (see GatorEventsCache).
+        The results are cached: going back to events already seen does not process them again.
+        '''
+        return self.events_cache(indices)
     #
 
     def __call__(self):
+        if self.low_memory:
+            #The raw quantities and the baseline subtraction come first, then the callbacks as their inputs are available
+            self.proc_graph(raw_wfs=self.filehandler.popWfs(), df=self.cols, metrics=self.metrics)
+            self.df = None
+            return self
+        #
+
         raw_wfs = self.filehandler.getWfs()
 
         self.raw_wfs = raw_wfs.copy()
-        
-        #Compute minimal, basic quantities on raw waveforms and store them in the dataframe of each file
-        self.raw_wfs_proc(
-                wfs_bslnsubtr = None,
-                df = self.df,
-                raw_wfs = raw_wfs
-                )
-        
-        #Execute the Baseline subtraction always as the second
-        wfs_bslnsubtr = self.bsln_corr_proc(
-                wfs_bslnsubtr = None,
-                df = self.df,
-                raw_wfs = raw_wfs
-                )
-        
-        self.wfs_bslnsubtr = wfs_bslnsubtr.copy()
-        
-        #Sequential call of all the callbacks
-        wfs_bslnsubtr = {ch_name: wfs_bslnsubtr[ch_name]['bslnsubtr'] for ch_name in wfs_bslnsubtr}
-        for cb in self.callbacks:
-            cb(
-                wfs_bslnsubtr = wfs_bslnsubtr,
-                df = self.df,
-                raw_wfs = raw_wfs
-                )
-        #
 
-        #Here all the quantities are inside the dataframe
+        kept_products = self.proc_graph(raw_wfs=raw_wfs, df=self.cols, metrics=self.metrics, keep=('bslnsubtr',))
+        del raw_wfs
+
+        self.wfs_bslnsubtr = {ch_name: {'bslnsubtr': wfs} for ch_name, wfs in kept_products.get('bslnsubtr', dict()).items()}
+
+        #Here all the quantities are inside the columns buffer
+        self.df = None
         return self
     #
 
     def getDf(self):
-        return self.df.copy()
+        #Built once from the columns buffer and not copied: the caller owns it
+        if self.df is None:
+            self.df = self.cols.toDf()
+        #
+        return self.df
     #
\ No newline at end of file
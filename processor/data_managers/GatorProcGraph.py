@@ -0,0 +1,211 @@
+from .GatorColumnBuffer import GatorColumnBuffer
+from .GatorRawFileHandler import GatorRawFileHandler
+from ..wfs_processors import (GatorRawWfsProc, GatorBslnSubtraction, get_wfs_proc_registry)
+
+
+class GatorProcGraph:
+    '''
+    Schedules the waveforms processors of a file according to what they declare to read and to produce (see GatorWfsProc):
+    the waveform products (INPUTS/OUTPUTS, e.g. "raw", "bslnsubtr", "gaussfilter") and the dataframe columns (COLS_INPUTS/COLS_OUTPUTS,
+    as suffixes of the channel name, e.g. "_raw_max_val").
+
+    The processors run in dependency order (ties keep the order in which they were given), every waveform product is computed
+    once by its producer and shared by all its consumers, and it is released as soon as its last consumer has run.
+    The "raw" product (the raw waveforms of the file) is the only one given from outside.
+    The processors are stateless, so a graph can be built once (see "fromChsMap") and used for any number of files, also
+    concurrently.
+    '''
+    EXTERNAL_PRODUCTS = ('raw',)
+    EXTERNAL_COLS = ('filename',) + GatorRawFileHandler.COLS #The columns of a processed file not produced by the processors
+
+    def __init__(self, procs:list):
+        self.deps = dict() #The processors producing the inputs of each processor
+        self.procs = self._sortProcs(list(procs))
+
+        # Index (in the sorted list) of the last processor consuming each product: after it the product is released
+        self.last_consumer = dict()
+        for iProc, proc in enumerate(self.procs):
+            for product in proc.INPUTS:
+                self.last_consumer[product] = iProc
+            #
+        #
+    #
+
+    @classmethod
+    def fromChsMap(cls, chs_map, executor=None):
+        '''
+        The graph of the processors of a channels map: the raw quantities and the baseline subtraction (always), then the
+        processors found in the "processors" of the channels (in the order they first appear).
+        '''
+        procs = [GatorRawWfsProc(chs_map=chs_map, executor=executor), GatorBslnSubtraction(chs_map=chs_map, executor=executor)]
+
+        procnames_lst = list()
+        for chname in chs_map:
+            if not 'processors' in chs_map[chname]:
+                continue
+            #
+            for procname in chs_map[chname]['processors']:
+                if not procname in procnames_lst:
+                    procnames_lst.append(procname)
+                #
+            #
+        #
+        for procname in procnames_lst:
+            procs.append(get_wfs_proc_registry()[procname](chs_map=chs_map, executor=executor))
+        #
+        return cls(procs)
+    #
+
+    def subGraph(self, proc_names):
+        #The graph of the given processors and of the ones producing their inputs (the same, stateless, instances)
+        procs = set(proc for proc in self.procs if proc.PROC_NAME in proc_names)
+        pending = list(procs)
+        while len(pending)>0:
+            for dep in self.deps[pending.pop()]:
+                if not dep in procs:
+                    procs.add(dep)
+                    pending.append(dep)
+                #
+            #
+        #
+        return GatorProcGraph([proc for proc in self.procs if proc in procs])
+    #
+
+    def configHashes(self):
+        #{processor name: hash}: the hash of a processor changes with its parameters and with the ones of the processors it depends on
+        hashes = dict()
+        for proc in self.procs:
+            hashes[proc.PROC_NAME] = proc.configHash([hashes[dep.PROC_NAME] for dep in self.deps[proc]])
+        #
+        return hashes
+    #
+
+    def procCols(self, columns:list):
+        #{processor name: the columns, among the given ones, written by the processor}
+        procs_cols = {proc.PROC_NAME: set(proc.outCols()) for proc in self.procs}
+        return {proc_name: [col for col in columns if col in proc_cols] for proc_name, proc_cols in procs_cols.items()}
+    #
+
+    def outputCols(self):
+        #All the columns of a processed file: the external ones and the ones of each processor with its configuration (see GatorWfsProc.outCols)
+        cols = list(GatorProcGraph.EXTERNAL_COLS)
+        for proc in self.procs:
+            cols += proc.outCols()
+        #
+        return cols
+    #
+
+    def products(self):
+        #All the waveform products available in the graph
+        return list(GatorProcGraph.EXTERNAL_PRODUCTS) + [product for proc in self.procs for product in proc.OUTPUTS]
+    #
+
+    def __iter__(self):
+        return iter(self.procs)
+    #
+
+    def __len__(self):
+        return len(self.procs)
+    #
+
+    def _sortProcs(self, procs):
+        product_producers = {product: None for product in GatorProcGraph.EXTERNAL_PRODUCTS}
+        col_producers = dict()
+        for proc in procs:
+            for product in proc.OUTPUTS:
+                if product in product_producers:
+                    raise ValueError(f'GatorProcGraph._sortProcs: the waveform product "{product}" is produced by more than one processor ("{proc.PROC_NAME}" and "{getattr(product_producers[product], "PROC_NAME", None)}").')
+                #
+                product_producers[product] = proc
+            #
+            for col in proc.COLS_OUTPUTS:
+                if col in col_producers:
+                    raise ValueError(f'GatorProcGraph._sortProcs: the "<channel>{col}" columns are produced by more than one processor ("{proc.PROC_NAME}" and "{col_producers[col].PROC_NAME}").')
+                #
+                col_producers[col] = proc
+            #
+        #
+
+        # Processors each one has to wait for
+        deps = dict()
+        for proc in procs:
+            deps[proc] = set()
+            for product in proc.INPUTS:
+                if not product in product_producers:
+                    raise ValueError(f'GatorProcGraph._sortProcs: the processor "{proc.PROC_NAME}" needs the waveform product "{product}", which is produced by none of the processors.')
+                #
+                if product_producers[product] is not None:
+                    deps[proc].add(product_producers[product])
+                #
+            #
+            for col in proc.COLS_INPUTS:
+                if not col in col_producers:
+                    raise ValueError(f'GatorProcGraph._sortProcs: the processor "{proc.PROC_NAME}" needs the "<channel>{col}" columns, which are produced by none of the processors.')
+                #
+                deps[proc].add(col_producers[col])
+            #
+            deps[proc].discard(proc)
+        #
+        self.deps = deps
+
+        sorted_procs = list()
+        pending = list(procs)
+        while len(pending)>0:
+            ready = [proc for proc in pending if deps[proc].issubset(sorted_procs)]
+            if len(ready)==0:
+                raise ValueError(f'GatorProcGraph._sortProcs: circular dependency among the processors {[proc.PROC_NAME for proc in pending]}.')
+            #
+            sorted_procs.append(ready[0])
+            pending.remove(ready[0])
+        #
+        return sorted_procs
+    #
+
+    def __call__(self, raw_wfs:dict, df, metrics=None, keep:tuple|list=()):
+        '''
+        Runs all the processors on the raw waveforms of a file, filling the dataframe.
+        Returns the waveform products listed in "keep" (the others are released along the way).
+        '''
+        products = {'raw': raw_wfs}
+        del raw_wfs #Only the products dict holds the raw waveforms, so they are released after their last consumer
+        kept = dict()
+
+        for iProc, proc in enumerate(self.procs):
+            result = proc(
+                wfs_bslnsubtr = products.get('bslnsubtr'),
+                df = df,
+                raw_wfs = products.get('raw'),
+                metrics = metrics,
+                products = {product: products[product] for product in proc.INPUTS}
+                )
+
+            for product in proc.OUTPUTS:
+                products[product] = result.getProduct(product)
+            #
+            del result
+
+            #Release what is not needed by the next processors
+            for product in list(products):
+                if self.last_consumer.get(product, -1) > iProc:
+                    continue
+                #
+                if product in keep:
+                    kept[product] = products[product]
+                #
+                del products[product]
+            #
+        #
+        return kept
+    #
+
+    def procEvents(self, raw_wfs:dict):
+        '''
+        Runs the processors on a batch of events ({channel: raw waveforms of shape (n_events, n_samps)}) keeping all the products.
+        Returns the columns ({name: array}) and the waveform products ({product: {channel: waveforms}}, "raw" included).
+        '''
+        n_events = len(next(iter(raw_wfs.values())))
+        cols = GatorColumnBuffer(n_rows=n_events)
+        products = self(raw_wfs=raw_wfs, df=cols, keep=self.products())
+        return cols.cols, products
+    #
+#
@@ -0,0 +1,175 @@
+import sys
+import time
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+
+def _read_proc_status_mb(field:str):
+    # A memory field of /proc/self/status (e.g. "VmHWM", "VmRSS") in MB, None where it is not available
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field+':'):
+                    return int(line.split()[1])/1024. #In kB
+                #
+            #
+        #
+    except OSError:
+        pass
+    #
+    return None
+#
+
+def _reset_peak_rss():
+    # Reset the high-water mark of the resident memory (Linux only): True when it was reset
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        #
+        return True
+    except OSError:
+        return False
+    #
+#
+
+def _peak_rss_mb():
+    # High-water mark of the resident memory since the last reset (VmHWM) or, where it cannot be reset, since the start of the
+    # process (ru_maxrss, in kB on Linux and in bytes on macOS)
+    hwm = _read_proc_status_mb('VmHWM')
+    if hwm is not None:
+        return hwm
+    #
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform=='darwin':
+        return maxrss/1024.**2
+    return maxrss/1024.
+#
+
+def _rss_mb():
+    rss = _read_proc_status_mb('VmRSS')
+    return rss if (rss is not None) else _peak_rss_mb()
+#
+
+class GatorProcMetrics:
+    '''
+    Collects the timing and throughput of the processing of one file: the totals of the file and the same quantities per stage
+    (file loading, each waveforms processor, saving, ...). The stages are measured with the "stage" context manager.
+
+    For every stage: wall time, cpu time (of the process), events/s (with the events of the file, unless given for the stage)
+    the peak resident memory during the stage and the growth of the resident memory from its start to its end.
+    The peak is reset at the beginning of the file and of every stage (/proc/self/clear_refs), so it belongs to that file or
+    stage and not to the whole life of the daemon; where it cannot be reset (not Linux) it is the peak of the process.
+    With "trace_memory" the peak of the memory traced by tracemalloc during each stage is also recorded (numpy arrays included);
+    this has an overhead and is meant for the investigation of the memory usage.
+    '''
+    def __init__(self, n_events:int=None, bytes_read:int=None, trace_memory:bool=False):
+        self.n_events = n_events
+        self.bytes_read = bytes_read
+        self.trace_memory = trace_memory
+        self.stages = dict()
+
+        self._t0 = None
+        self._c0 = None
+        self.wall_sec = None
+        self.cpu_sec = None
+        self.peak_rss_mb = None #Peak of the file: the stages reset the high-water mark, so it is the maximum of the stages ones
+    #
+
+    def begin(self):
+        self._t0 = time.perf_counter()
+        self._c0 = time.process_time()
+        _reset_peak_rss()
+        self.peak_rss_mb = None
+        if self.trace_memory and (not tracemalloc.is_tracing()):
+            tracemalloc.start()
+        #
+        return self
+    #
+
+    def end(self):
+        if self._t0 is None:
+            return self
+        #
+        self.wall_sec = time.perf_counter() - self._t0
+        self.cpu_sec = time.process_time() - self._c0
+        self._update_peak(_peak_rss_mb())
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        #
+        return self
+    #
+
+    @contextmanager
+    def stage(self, name:str, n_events:int=None, bytes_read:int=None):
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        #
+        #The peak before the stage goes to the file, then it is reset for the stage
+        self._update_peak(_peak_rss_mb())
+        _reset_peak_rss()
+        rss0 = _rss_mb()
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        try:
+            yield self
+        finally:
+            wall_sec = time.perf_counter() - t0
+            stage_peak_mb = _peak_rss_mb()
+            self._update_peak(stage_peak_mb)
+            stage_dict = dict(wall_sec = wall_sec,
+                              cpu_sec = time.process_time() - c0,
+                              peak_rss_mb = stage_peak_mb,
+                              rss_growth_mb = _rss_mb() - rss0
+                              )
+            if n_events is not None:
+                stage_dict['n_events'] = int(n_events) #Otherwise the events of the file are used for the rate
+            #
+            if bytes_read is not None:
+                stage_dict['bytes_read'] = int(bytes_read)
+            #
+            if self.trace_memory and tracemalloc.is_tracing():
+                stage_dict['peak_traced_mb'] = tracemalloc.get_traced_memory()[1]/1024.**2
+            #
+
+            self.stages[name] = stage_dict
+        #
+    #
+
+    def _update_peak(self, peak_mb):
+        self.peak_rss_mb = peak_mb if (self.peak_rss_mb is None) else max(self.peak_rss_mb, peak_mb)
+    #
+
+    def toDict(self):
+        self._update_peak(_peak_rss_mb())
+        metrics_dict = dict(stages = dict(),
+                            peak_rss_mb = self.peak_rss_mb
+                            )
+        for name, stage_dict in self.stages.items():
+            stage_dict = dict(stage_dict)
+            n_events = stage_dict.pop('n_events', self.n_events)
+            if (n_events is not None) and (stage_dict['wall_sec']>0):
+                stage_dict['events_per_sec'] = n_events/stage_dict['wall_sec']
+            #
+            metrics_dict['stages'][name] = stage_dict
+        #
+        if self.n_events is not None:
+            metrics_dict['n_events'] = int(self.n_events)
+        if self.bytes_read is not None:
+            metrics_dict['bytes_read'] = int(self.bytes_read)
+        if self.wall_sec is not None:
+            metrics_dict['wall_sec'] = self.wall_sec
+            metrics_dict['cpu_sec'] = self.cpu_sec
+            if (self.n_events is not None) and (self.wall_sec>0):
+                metrics_dict['events_per_sec'] = self.n_events/self.wall_sec
+            #
+        #
+        return metrics_dict
+    #
+
+    def slowestStage(self):
+        if len(self.stages)==0:
+            return None
+        return max(self.stages, key=lambda name: self.stages[name]['wall_sec'])
+    #
+#
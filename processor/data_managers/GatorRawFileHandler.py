@@ -5,6 +5,8 @@ import uproot
 
 
 class GatorRawFileHandler:
+    COLS = ('RunTime', 'EvCounter', 'TimeTrigTag') #The columns of the raw data of the tree, other than the waveforms
+
     def __init__(self,
                  fpath:str, #The path of the datafile
                  chs_lst: list, #The branch names of the waforms to read (wf0, wf1, etc)
@@ -116,6 +118,29 @@ class GatorRawFileHandler:
         return ret_wfs
     #
 
+    def getSelWfs(self, indices):
+        #Copies of the wfs of the selected events only (the wfs are loaded from the file just for the time needed, if not in memory)
+        release_wfs = False
+        if not self.wfs_on_memory:
+            release_wfs = True
+            self.loadWfs()
+        #
+        ret_wfs = {ch_name: wfs[indices] for ch_name, wfs in self.wfs.items()}
+
+        if release_wfs:
+            self.releaseWfs()
+
+        return ret_wfs
+    #
+
+    def popWfs(self):
+        #Hands over the wfs without copying them: the handler does not keep them any more
+        self.loadWfs()
+        ret_wfs = dict(self.wfs)
+        self.releaseWfs()
+        return ret_wfs
+    #
+
     def isLoaded(self):
         return self.data_loaded
     #
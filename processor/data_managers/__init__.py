@@ -1,4 +1,8 @@
 from .GatorRawFileHandler import GatorRawFileHandler
 from .GatorFileProcessor import GatorFileProcessor
 from .GatorDatasetsStorage import GatorDatasetsStorage
-from .GatorDatasetsProcessor import GatorDatasetsProcessor
\ No newline at end of file
+from .GatorDatasetsProcessor import GatorDatasetsProcessor
+from .GatorProcMetrics import GatorProcMetrics
+from .GatorProcGraph import GatorProcGraph
+from .GatorColumnBuffer import GatorColumnBuffer
+from .GatorEventsCache import GatorEventsCache
\ No newline at end of file
@@ -3,66 +3,76 @@ import numpy as np
 from .GatorWfsProc import GatorWfsProc
 
 class GatorBslnSubtraction(GatorWfsProc):
+    PROC_NAME = 'bslnsubtr'
+    INPUTS = ('raw',)
+    OUTPUTS = ('bslnsubtr',)
+    COLS_OUTPUTS = ('_bslns_mean', '_bslns_rms', '_bslns_med', '_bslns_mad', '_samp_max', '_ampl_max')
+    COLS_DTYPES = {'_bslns_mean': np.float32, '_bslns_rms': np.float32, '_bslns_med': np.float32, '_bslns_mad': np.float32,
+                   '_samp_max': np.int32, '_ampl_max': np.float32}
+
     def _post_init(self):
-        self.wfs_bslnsubtr = dict() #This is filled by the to doProc method only
+        self.ch_names = [wf_name for wf_name in self.chs_map if 'bslnsubtr' in self.chs_map[wf_name]]
     #
     
-    def doProc(self, wfs_bslnsubtr, df, raw_wfs):
-        self.wfs_bslnsubtr = dict()
+    def configDict(self):
+        return {wf_name: self.chs_map[wf_name]['bslnsubtr'] for wf_name in self.ch_names}
+    #
 
-        #Quantities for the calculation of the wfs maxima
-        for wf_name in self.chs_map:
-            if not ('bslnsubtr' in self.chs_map[wf_name]):
-                continue
-            #
+    def doProc(self, wfs_bslnsubtr, df, raw_wfs, products=None):
+        result = self._newResult()
 
-            bslnsamps = self.chs_map[wf_name]['bslnsubtr']['bslnsamps']
+        ch_results = self._mapChannels(lambda wf_name: self._procChannel(wf_name, raw_wfs[wf_name]), self.ch_names)
+        for wf_name, (cols, wfs_corr) in zip(self.ch_names, ch_results):
+            result.addChannel(wf_name, cols=cols, wfs={'bslnsubtr':wfs_corr})
+        #
+        return result
+    #
 
-            if raw_wfs[wf_name].ndim==1:
-                raw_wfs[wf_name] = raw_wfs[wf_name][None, :]
-            #
-            wf_n_samps = raw_wfs[wf_name].shape[1]
+    def _procChannel(self, wf_name, wfs):
+        #Baselines and maxima of the waveforms of one channel: returns the columns (by suffix) and the baseline subtracted waveforms
+        cols = dict()
+        bslnsamps = self.chs_map[wf_name]['bslnsubtr']['bslnsamps']
+        if wfs.ndim==1:
+            wfs = wfs[None, :] #A view: the dict of the caller is not touched
+        #
+        wf_n_samps = wfs.shape[1]
 
-            means = np.mean(raw_wfs[wf_name][:, :bslnsamps], axis=1)
-            df[wf_name+'_bslns_mean'] = means
-            df[wf_name+'_bslns_rms'] = np.std(raw_wfs[wf_name][:, :bslnsamps], axis=1)
-            medians = np.median(raw_wfs[wf_name][:, :bslnsamps], axis=1)
-            df[wf_name+'_bslns_med'] = medians
-            df[wf_name+'_bslns_mad'] = np.median(np.abs(raw_wfs[wf_name][:, :bslnsamps] - medians[:, np.newaxis]), axis=1)
+        means = np.mean(wfs[:, :bslnsamps], axis=1)
+        cols['_bslns_mean'] = means
+        cols['_bslns_rms'] = np.std(wfs[:, :bslnsamps], axis=1)
+        medians = np.median(wfs[:, :bslnsamps], axis=1)
+        cols['_bslns_med'] = medians
+        cols['_bslns_mad'] = np.median(np.abs(wfs[:, :bslnsamps] - medians[:, np.newaxis]), axis=1)
 
-            # Make the wfs with corrected bslns
-            bslns_meth = self.chs_map[wf_name]['bslnsubtr']['bsln_meth']
-            if bslns_meth=='mean':
-                bslns = means
-            elif bslns_meth=='median':
-                bslns = medians
-            else:
-                raise ValueError('Unexpected method for the baselines calculation ({bslns_meth}). The only implemented methods are "mean" and "median".')
-            #
-            
-            wfs_corr = raw_wfs[wf_name] - bslns[:, None]
-            
-            if ('neg_pulse' in self.chs_map[wf_name]['bslnsubtr']) and (self.chs_map[wf_name]['bslnsubtr']['neg_pulse']==True):
-                wfs_corr = -1.0*wfs_corr
-            #
-            self.wfs_bslnsubtr[wf_name] = {'bslnsubtr':wfs_corr}
-            
-            # Calculate the maxima of each wf
-            samp_max_arr = np.argmax(wfs_corr, axis=1)
-            df[wf_name+'_samp_max'] = samp_max_arr
-
-            wfs_max_lst = []
-
-            for iWf, samp_max in enumerate(samp_max_arr):
-                if ((samp_max - 2) >= 0) and ((samp_max + 2) < wf_n_samps):
-                    wfs_max_lst.append(np.mean(wfs_corr[iWf, samp_max-2:samp_max+3]))
-                else:
-                    wfs_max_lst.append(wfs_corr[iWf, samp_max])
-                #
-            #
-            df[wf_name+'_ampl_max'] = wfs_max_lst
+        # Make the wfs with corrected bslns
+        bslns_meth = self.chs_map[wf_name]['bslnsubtr']['bsln_meth']
+        if bslns_meth=='mean':
+            bslns = means
+        elif bslns_meth=='median':
+            bslns = medians
+        else:
+            raise ValueError('Unexpected method for the baselines calculation ({bslns_meth}). The only implemented methods are "mean" and "median".')
         #
-        return self.wfs_bslnsubtr
+
+        wfs_corr = wfs - bslns[:, None]
+
+        if ('neg_pulse' in self.chs_map[wf_name]['bslnsubtr']) and (self.chs_map[wf_name]['bslnsubtr']['neg_pulse']==True):
+            np.negative(wfs_corr, out=wfs_corr) #In place: no second copy of the waveforms
+        #
+
+        # Calculate the maxima of each wf: mean of the 5 samples around the maximum (the maximum alone when too close to the edges)
+        samp_max_arr = np.argmax(wfs_corr, axis=1)
+        cols['_samp_max'] = samp_max_arr
+
+        wfs_max = wfs_corr[np.arange(len(wfs_corr)), samp_max_arr]
+        inner = ((samp_max_arr - 2) >= 0) & ((samp_max_arr + 2) < wf_n_samps)
+        if np.any(inner):
+            rows = np.nonzero(inner)[0]
+            wfs_max[rows] = np.mean(wfs_corr[rows[:, None], samp_max_arr[rows, None] + np.arange(-2, 3)[None, :]], axis=1)
+        #
+        cols['_ampl_max'] = wfs_max
+
+        return cols, wfs_corr
     #
 
     def procSingleEvent(self, wfs_bslnsubtr:dict, raw_wfs:dict):
@@ -5,23 +5,35 @@ from .GatorWfsProc import GatorWfsProc
 
 @register_wfs_processor('rawpur')
 class GatorRawPurProc(GatorWfsProc):
-    def _post_init(self):
-        pass
-    #
+    INPUTS = ()
+    COLS_INPUTS = ('_raw_max_val', '_raw_min_val') #From GatorRawWfsProc
+    COLS_OUTPUTS = ('_raw_pur',)
+    COLS_DTYPES = {'_raw_pur': bool}
 
-    def doProc(self, wfs_bslnsubtr, df, raw_wfs):
+    def _post_init(self):
+        self.thresholds = dict()
         for wfname in self.chs_map:
             try:
-                thr = float(self.chs_map[wfname]['processors']['rawpur']['threshold'])
+                self.thresholds[wfname] = float(self.chs_map[wfname]['processors']['rawpur']['threshold'])
             except KeyError:
                 continue
-            
-            df[wfname + '_raw_pur'] = (df[wfname+'_raw_max_val']-df[wfname+'_raw_min_val'])>thr
+            #
         #
+    #
 
-        return {}
+    def outChannels(self):
+        return list(self.thresholds)
+    #
+
+    def doProc(self, wfs_bslnsubtr, df, raw_wfs, products=None):
+        result = self._newResult()
+        for wfname, thr in self.thresholds.items():
+            result.addChannel(wfname, cols={'_raw_pur': (df[wfname+'_raw_max_val']-df[wfname+'_raw_min_val'])>thr})
+        #
+
+        return result
     #
 
     def procSingleEvent(self, wfs_bslnsubtr:dict, raw_wfs:dict):
         return {}
-    #
\ No newline at end of file
+    #
@@ -3,25 +3,43 @@ import numpy as np
 from .GatorWfsProc import GatorWfsProc
 
 class GatorRawWfsProc(GatorWfsProc):
+    PROC_NAME = 'rawwfs'
+    INPUTS = ('raw',)
+    COLS_OUTPUTS = ('_raw_max_val', '_raw_max_pos', '_raw_min_val', '_raw_min_pos')
+    COLS_DTYPES = {'_raw_max_val': np.float32, '_raw_max_pos': np.int32, '_raw_min_val': np.float32, '_raw_min_pos': np.int32}
+
     def _post_init(self):
-        self.raw_wfs = dict() #This should be filled by the to doProc method only, but it will remain empty as theis class only produces basic wfs quantities in the dataframe
+        pass #This class only produces basic wfs quantities in the dataframe, from all the channels
     #
     
-    def doProc(self, wfs_bslnsubtr, df, raw_wfs):
-        self.raw_wfs = raw_wfs
+    def configDict(self):
+        #No parameters: the columns only depend on the channels
+        return {'channels': list(self.chs_map)}
+    #
+
+    def outChannels(self):
+        return list(self.chs_map)
+    #
+
+    def doProc(self, wfs_bslnsubtr, df, raw_wfs, products=None):
+        result = self._newResult()
+
         #Quantities for the calculation of the wfs maxima
         for wf_name in self.chs_map:
-            if raw_wfs[wf_name].ndim == 1:
-                raw_wfs[wf_name] = raw_wfs[wf_name][None, :]
+            wfs = raw_wfs[wf_name]
+            if wfs.ndim == 1:
+                wfs = wfs[None, :] #A view: the dict of the caller is not touched
             #
-            df[wf_name+'_raw_max_val'] = np.max(raw_wfs[wf_name], axis=1)
-            df[wf_name+'_raw_max_pos'] = np.argmax(raw_wfs[wf_name], axis=1)
-            df[wf_name+'_raw_min_val'] = np.min(raw_wfs[wf_name], axis=1)
-            df[wf_name+'_raw_min_pos'] = np.argmin(raw_wfs[wf_name], axis=1)
+            result.addChannel(wf_name, cols={
+                '_raw_max_val': np.max(wfs, axis=1),
+                '_raw_max_pos': np.argmax(wfs, axis=1),
+                '_raw_min_val': np.min(wfs, axis=1),
+                '_raw_min_pos': np.argmin(wfs, axis=1),
+                })
         #
-        return self.raw_wfs
+        return result
     #
 
     def procSingleEvent(self, wfs_bslnsubtr:dict, raw_wfs:dict):
-        return self.raw_wfs
-    #
\ No newline at end of file
+        return {}
+    #
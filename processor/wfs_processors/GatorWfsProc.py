@@ -1,6 +1,10 @@
 import json
+import hashlib
+import logging
 from pathlib import Path
 
+import numpy as np
+
 from processor import data_managers
 
 from typing import TYPE_CHECKING
@@ -9,6 +13,8 @@ from typing import (Dict, Type)
 if TYPE_CHECKING:
     from ..data_managers import GatorDatasetsProcessor
 
+logger = logging.getLogger(__name__)
+
 _WFS_PROC_REGISTRY: Dict[str, Type] = {}
 
 def register_wfs_processor(name: str):
@@ -17,6 +23,7 @@ def register_wfs_processor(name: str):
             raise RuntimeError(f"Duplicate WFS processor name: {name}")
 
         _WFS_PROC_REGISTRY[name] = cls
+        cls.PROC_NAME = name
         return cls
     return decorator
 #
@@ -66,10 +73,91 @@ class GatorChsMap:
 #
 
 
+class GatorProcResult:
+    '''
+    Everything produced by one call of a waveforms processor: the dataframe columns (full names) and the waveform products
+    of each channel ({channel: {product: waveforms}}). The processors keep no per-call state, this object has it all.
+    It can be read as the dict of the channels products returned by the processors before (e.g. result["wf1"]["trapezoid"]).
+    '''
+    def __init__(self, proc_name:str=None):
+        self.proc_name = proc_name
+        self.cols = dict()
+        self.cols_suffix = dict() #Suffix of every column, to find its data type
+        self.wfs = dict()
+    #
+
+    def addChannel(self, wf_name:str, cols:dict=None, wfs:dict=None):
+        #"cols" are given by suffix of the channel name
+        for col, arr in (cols or dict()).items():
+            self.cols[wf_name+col] = arr
+            self.cols_suffix[wf_name+col] = col
+        #
+        if wfs is not None:
+            self.wfs[wf_name] = wfs
+        #
+        return self
+    #
+
+    def getProduct(self, product:str):
+        #The waveforms of one product, per channel
+        return {wf_name: ch_wfs[product] for wf_name, ch_wfs in self.wfs.items() if product in ch_wfs}
+    #
+
+    def fillDf(self, df, cols_dtypes:dict=None):
+        #"df" can be a dataframe or a GatorColumnBuffer, "cols_dtypes" gives the data types of the columns by suffix
+        cols_dtypes = cols_dtypes or dict()
+        for col, arr in self.cols.items():
+            dtype = cols_dtypes.get(self.cols_suffix.get(col))
+            if hasattr(df, 'setCol'):
+                df.setCol(col, arr, dtype=dtype)
+            elif dtype is not None:
+                df[col] = np.asarray(arr, dtype=dtype)
+            else:
+                df[col] = arr
+            #
+        #
+        return df
+    #
+
+    def __getitem__(self, wf_name):
+        return self.wfs[wf_name]
+    #
+
+    def __contains__(self, wf_name):
+        return wf_name in self.wfs
+    #
+
+    def __iter__(self):
+        return iter(self.wfs)
+    #
+
+    def items(self):
+        return self.wfs.items()
+    #
+#
+
+
 class GatorWfsProc:
-    #Generic base class for the data processors callbacks
-    def __init__(self, chs_map:GatorChsMap, dataprocessor=None):
+    '''
+    Generic base class for the data processors callbacks.
+    The instances are stateless after their construction (the configuration of the channels is parsed once in "_post_init"):
+    every call returns a GatorProcResult, so one instance can be shared by threads and reused for any number of files.
+    '''
+    PROC_NAME = None #Set by the register_wfs_processor decorator (name of the stage in the processing metrics)
+
+    #What the processor reads and produces, used by GatorProcGraph to schedule the processors of a file.
+    #Waveform products are per channel dicts (e.g. "raw", "bslnsubtr"), the columns are given as suffixes of the channel name.
+    INPUTS = ('bslnsubtr',)
+    OUTPUTS = ()
+    COLS_INPUTS = ()
+    COLS_OUTPUTS = ()
+    COLS_DTYPES = dict() #Compact data types of the output columns (by suffix), the others get the GatorColumnBuffer defaults
+
+    VERSION = 1 #To be increased when a change of the code changes the outputs: the processed files are then reprocessed for this processor
+
+    def __init__(self, chs_map:GatorChsMap, dataprocessor=None, executor=None):
         self.chs_map = chs_map
+        self.executor = executor #Optional thread pool (concurrent.futures.Executor) for the per channel work
         self.dataprocessor = dataprocessor
         if self.dataprocessor is not None:
             self.dataprocessor.addCallback(self)
@@ -78,7 +166,7 @@ class GatorWfsProc:
     #
 
     def _post_init(self):
-        """Subclasses must implement this method."""
+        """Subclasses must implement this method (parsing their configuration of the channels, no per-call state)."""
         if str(self.__class__.__name__)=="GatorWfsProc":
             raise NotImplementedError('The "GatorWfsProc" class is meant to provide only the interface and shall not be instanced.')
         else:
@@ -91,13 +179,67 @@ class GatorWfsProc:
         return self
     #
 
-    def __call__(self, wfs_bslnsubtr, df, raw_wfs=None):
-        print(f'{str(self.__class__.__name__)}: start processing.')
-        return self.doProc(wfs_bslnsubtr, df, raw_wfs)
+    def __call__(self, wfs_bslnsubtr, df, raw_wfs=None, metrics=None, products=None):
+        #"products" has the waveform products listed in INPUTS (the other than "raw" and "bslnsubtr" can only be found here).
+        #The dataframe is only read by "doProc": the columns of the result are added to it here (if given).
+        logger.debug(f'{str(self.__class__.__name__)}.__call__: start processing.')
+        if metrics is None:
+            result = self.doProc(wfs_bslnsubtr, df, raw_wfs, products=products)
+        else:
+            with metrics.stage(self.PROC_NAME or self.__class__.__name__):
+                result = self.doProc(wfs_bslnsubtr, df, raw_wfs, products=products)
+            #
+        #
+        if df is not None:
+            result.fillDf(df, cols_dtypes=self.COLS_DTYPES)
+        #
+        return result
+    #
+
+    def configDict(self):
+        #The parameters of this processor for all the channels: with the inputs, they define its outputs
+        conf = dict()
+        for wf_name in self.chs_map:
+            try:
+                conf[wf_name] = self.chs_map[wf_name]['processors'][self.PROC_NAME]
+            except KeyError:
+                continue
+            #
+        #
+        return conf
+    #
+
+    def outChannels(self):
+        #The channels for which the COLS_OUTPUTS columns are produced (the configured ones)
+        return list(self.configDict())
+    #
+
+    def outCols(self):
+        #The full names of the columns produced with the current configuration (all the COLS_OUTPUTS of every output channel by default)
+        return [ch+suffix for ch in self.outChannels() for suffix in self.COLS_OUTPUTS]
+    #
+
+    def configHash(self, inputs_hashes:list=()):
+        #Short hash of the parameters and of the hashes of the processors producing the inputs (see GatorProcGraph.configHashes)
+        payload = {'proc': self.PROC_NAME, 'version': self.VERSION, 'config': self.configDict(), 'inputs': sorted(inputs_hashes)}
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:10]
+    #
+
+    def _newResult(self):
+        return GatorProcResult(proc_name=self.PROC_NAME or self.__class__.__name__)
+    #
+
+    def _mapChannels(self, func, ch_names:list):
+        #Returns [func(ch_name) for ch_name in ch_names], computed on the thread pool (if any). The channels are independent and
+        #the numpy/scipy work releases the GIL, while the results are collected in the calling thread, in the channels order.
+        if (self.executor is None) or (len(ch_names)<2):
+            return [func(ch_name) for ch_name in ch_names]
+        #
+        return list(self.executor.map(func, ch_names))
     #
 
-    def doProc(self, wfs_bslnsubtr, df, raw_wfs):
-        """Subclasses must implement this method."""
+    def doProc(self, wfs_bslnsubtr, df, raw_wfs, products=None):
+        """Subclasses must implement this method, returning a GatorProcResult (see "_newResult") and without modifying any input."""
         if str(self.__class__.__name__)=="GatorWfsProc":
             raise NotImplementedError('The "GatorWfsProc" class is meant to provide only the interface and shall not be instanced.')
         else:
@@ -109,7 +251,7 @@ class GatorWfsProc:
         """
         This method does exaclty what the 'doProc' does, but it doesn't use (and modify) any dataframe.
         It only returns the waveforms of the channels that require the action of the specific processor. 
-        It is meant to be used with data visualization tools.
+        It is meant to be used with data visualization tools (for more than one event GatorFileProcessor.procEvents is much faster).
         Subclasses only must implement this method.
         """
 
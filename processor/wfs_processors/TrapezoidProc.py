@@ -6,35 +6,51 @@ from ..wfs_utils import trapezoidalFilt
 
 @register_wfs_processor('trapezoid')
 class TrapezoidProc(GatorWfsProc):
+    OUTPUTS = ('trapezoid',)
+    COLS_OUTPUTS = ('_energy_trap', '_trap_pur')
+    COLS_DTYPES = {'_energy_trap': np.float32, '_trap_pur': np.float32}
+
     def _post_init(self):
-        self.trap_filters = dict()
+        self.ch_names = [wf_name for wf_name in self.chs_map if self._isConfigured(wf_name)]
     #
 
-    def doProc(self, wfs_bslnsubtr, df, raw_wfs=None):
-        self.trap_filters = dict()
-        
-        for wf_name in self.chs_map:
-            try:
-                shape_time = self.chs_map[wf_name]['processors']['trapezoid']['shape_time']
-                tau = self.chs_map[wf_name]['processors']['trapezoid']['tau']
-                flat_top = self.chs_map[wf_name]['processors']['trapezoid']['flat_top']
-                wfs = wfs_bslnsubtr[wf_name]
-            except KeyError as err:
-                continue
-            #
-            
-            trap_filter = trapezoidalFilt(wfs, shape_time, tau, flat_top)
-            
+    def outChannels(self):
+        return list(self.ch_names)
+    #
+
+    def doProc(self, wfs_bslnsubtr, df, raw_wfs=None, products=None):
+        result = self._newResult()
 
-            #Compute the energy and put it in the dataframe
-            df[wf_name+'_energy_trap'] = np.max(trap_filter, axis=1)
+        ch_names = [wf_name for wf_name in self.ch_names if wf_name in wfs_bslnsubtr]
 
-            df[wf_name+'_trap_pur'] = np.sum(trap_filter, axis=1)/np.max(trap_filter, axis=1) #Equivalent length: trapezoidal area/trapezoidal max
+        ch_results = self._mapChannels(lambda wf_name: self._procChannel(wf_name, wfs_bslnsubtr[wf_name]), ch_names)
+        for wf_name, (cols, trap_filter) in zip(ch_names, ch_results):
+            result.addChannel(wf_name, cols=cols, wfs={'trapezoid':trap_filter})
+        #
+
+        return result
+    #
 
-            self.trap_filters[wf_name] = {'trapezoid':trap_filter}
+    def _isConfigured(self, wf_name):
+        #The channels without (complete) parameters for this processor are skipped
+        try:
+            return all(key in self.chs_map[wf_name]['processors']['trapezoid'] for key in ('shape_time', 'tau', 'flat_top'))
+        except KeyError:
+            return False
         #
-        
-        return self.trap_filters
+    #
+
+    def _procChannel(self, wf_name, wfs):
+        #Trapezoidal filter of the waveforms of one channel, with the columns (by suffix)
+        trap_conf = self.chs_map[wf_name]['processors']['trapezoid']
+        trap_filter = trapezoidalFilt(wfs, trap_conf['shape_time'], trap_conf['tau'], trap_conf['flat_top'])
+
+        cols = dict()
+        #The energy is the maximum of the trapezoid
+        cols['_energy_trap'] = np.max(trap_filter, axis=1)
+        cols['_trap_pur'] = np.sum(trap_filter, axis=1)/cols['_energy_trap'] #Equivalent length: trapezoidal area/trapezoidal max
+
+        return cols, trap_filter
     #
 
     def procSingleEvent(self, wfs_bslnsubtr:dict, raw_wfs:dict):
@@ -9,40 +9,71 @@ from ..wfs_utils import (
 
 @register_wfs_processor('gaussfilter')
 class WfsGaussianFilters(GatorWfsProc):
+    OUTPUTS = ('gaussfilter',)
+    COLS_OUTPUTS = ('_smooth_pulse_ampl', '_smooth_pulse_maxpos', '_n_peaks')
+    COLS_DTYPES = {'_smooth_pulse_ampl': np.float32, '_smooth_pulse_maxpos': np.int32, '_n_peaks': np.int32}
+
     def _post_init(self):
-        self.wfs_smooth = dict()
+        self.ch_names = [wf_name for wf_name in self.chs_map if self._isConfigured(wf_name)]
     #
 
-    def doProc(self, wfs_bslnsubtr, df, raw_wfs=None):
-        self.wfs_smooth = dict()
-        
-        for wf_name in self.chs_map:
-            
-            try:
-                sigma = self.chs_map[wf_name]['processors']['gaussfilter']['sigma']
-                kernel_half_width = self.chs_map[wf_name]['processors']['gaussfilter']['kernel_half_width']
-                wfs = wfs_bslnsubtr[wf_name]
-            except KeyError:
-                continue
+    def outChannels(self):
+        return list(self.ch_names)
+    #
+
+    def outCols(self):
+        #The number of peaks only for the channels where the pulses are searched
+        cols = list()
+        for wf_name in self.ch_names:
+            cols += [wf_name+'_smooth_pulse_ampl', wf_name+'_smooth_pulse_maxpos']
+            if self.chs_map[wf_name]['processors']['gaussfilter'].get('find_pulses')==True:
+                cols.append(wf_name+'_n_peaks')
             #
+        #
+        return cols
+    #
 
-            wfs_smooth = gaussian_filter(wfs, sigma, kernel_half_width, derivative=False)
-            self.wfs_smooth[wf_name] = {'gaussfilter':{'swf':wfs_smooth}}
+    def doProc(self, wfs_bslnsubtr, df, raw_wfs=None, products=None):
+        result = self._newResult()
 
-            df[wf_name+'_smooth_pulse_ampl'] = np.max(wfs_smooth, axis=1)
-            df[wf_name+'_smooth_pulse_maxpos'] = np.argmax(wfs_smooth, axis=1)
+        ch_names = [wf_name for wf_name in self.ch_names if wf_name in wfs_bslnsubtr]
 
-            if ('find_pulses' in self.chs_map[wf_name]['processors']['gaussfilter']) and (self.chs_map[wf_name]['processors']['gaussfilter']['find_pulses']==True):
-                ampl_min_thr = self.chs_map[wf_name]['processors']['gaussfilter']['ampl_min_thr']
-                dwfs_smooth = gaussian_filter(wfs, sigma, kernel_half_width, derivative=True)
-                _maxima_tuples = [find_rel_maxima(dwf, wf, thr=ampl_min_thr) for dwf, wf in zip(dwfs_smooth, wfs_smooth)]
-                df[wf_name+'_n_peaks'] = np.array( [ el[0] for el in _maxima_tuples ] )
-                self.wfs_smooth[wf_name]['gaussfilter']['swfd'] = dwfs_smooth
-            else:
-                self.wfs_smooth[wf_name]['gaussfilter']['swfd'] = None
-            #
+        ch_results = self._mapChannels(lambda wf_name: self._procChannel(wf_name, wfs_bslnsubtr[wf_name]), ch_names)
+        for wf_name, (cols, wfs_smooth, dwfs_smooth) in zip(ch_names, ch_results):
+            result.addChannel(wf_name, cols=cols, wfs={'gaussfilter':{'swf':wfs_smooth, 'swfd':dwfs_smooth}})
+        #
+        return result
+    #
+
+    def _isConfigured(self, wf_name):
+        #The channels without (complete) parameters for this processor are skipped
+        try:
+            return all(key in self.chs_map[wf_name]['processors']['gaussfilter'] for key in ('sigma', 'kernel_half_width'))
+        except KeyError:
+            return False
+        #
+    #
+
+    def _procChannel(self, wf_name, wfs):
+        #Smoothed waveforms (and their derivative when the pulses are searched) of one channel, with the columns (by suffix)
+        gauss_conf = self.chs_map[wf_name]['processors']['gaussfilter']
+        sigma = gauss_conf['sigma']
+        kernel_half_width = gauss_conf['kernel_half_width']
+
+        cols = dict()
+        wfs_smooth = gaussian_filter(wfs, sigma, kernel_half_width, derivative=False)
+
+        cols['_smooth_pulse_ampl'] = np.max(wfs_smooth, axis=1)
+        cols['_smooth_pulse_maxpos'] = np.argmax(wfs_smooth, axis=1)
+
+        dwfs_smooth = None
+        if ('find_pulses' in gauss_conf) and (gauss_conf['find_pulses']==True):
+            ampl_min_thr = gauss_conf['ampl_min_thr']
+            dwfs_smooth = gaussian_filter(wfs, sigma, kernel_half_width, derivative=True)
+            #Only the number of peaks is kept (not the labels of the regions of every waveform)
+            cols['_n_peaks'] = np.fromiter((find_rel_maxima(dwf, wf, thr=ampl_min_thr)[0] for dwf, wf in zip(dwfs_smooth, wfs_smooth)), dtype=np.int32, count=len(wfs_smooth))
         #
-        return self.wfs_smooth
+        return cols, wfs_smooth, dwfs_smooth
     #
 
     def procSingleEvent(self, wfs_bslnsubtr, raw_wfs):
@@ -8,6 +8,7 @@ from pathlib import Path
 from typing import Union
 from typing import Optional
 import copy
+from functools import lru_cache
 import numpy as np
 from scipy.signal import convolve
 from scipy.ndimage import label
@@ -43,8 +44,7 @@ def BslnCorr(wfs_storage, bslns_meth, flip_wf=False):
 #
 
 def trapezoidalFilt(arr: np.array, shape_time: int, tau: float, flat_top: int):
-    arr = np.copy(arr)
-    
+    #The input is only read: no copy of it is needed
     is_1d = (arr.ndim == 1)
     if is_1d:
         arr = arr[None, :]   # make (1, Nsamps) for unified code
@@ -90,6 +90,25 @@ def trapezoidalFilt(arr: np.array, shape_time: int, tau: float, flat_top: int):
     return trapezoid
 #
 
+@lru_cache(maxsize=64)
+def gaussian_kernel(sigma:float, kernel_half_width:int, derivative:bool = False):
+    #Built once for every set of parameters (read-only, as it is shared by all the callers)
+    x = np.arange(-kernel_half_width, kernel_half_width + 1)
+    
+    # Gaussian kernel
+    gaussian = np.exp(-x**2 / (2 * sigma**2))
+    
+    if not derivative:
+        kernel = gaussian/gaussian.sum()
+    else:
+        # derivative of Gaussian
+        kernel = -x * gaussian / (sigma**2)
+        kernel -= kernel.mean()  # zero mean for stability
+    #
+    kernel.setflags(write=False)
+    return kernel
+#
+
 def gaussian_filter(wfs:np.array, sigma:float, kernel_half_width:int, derivative: bool = False):
     """
     Apply Gaussian smoothing (or its derivative) to 1D or 2D waveform arrays.
@@ -108,7 +127,7 @@ def gaussian_filter(wfs:np.array, sigma:float, kernel_half_width:int, derivative
         filtered : np.ndarray
             Filtered waveform(s), same shape as input
     """
-    wfs = wfs.copy()
+    #The input is only read: no copy of it is needed
     if np.ndim(wfs)==1:
         wfs = wfs[None,:]
         is_1d = True
@@ -116,18 +135,7 @@ def gaussian_filter(wfs:np.array, sigma:float, kernel_half_width:int, derivative
         is_1d = False
     #
     
-    x = np.arange(-kernel_half_width, kernel_half_width + 1)
-    
-    # Gaussian kernel
-    gaussian = np.exp(-x**2 / (2 * sigma**2))
-    
-    if not derivative:
-        kernel = gaussian/gaussian.sum()
-    else:
-        # derivative of Gaussian
-        kernel = -x * gaussian / (sigma**2)
-        kernel -= kernel.mean()  # zero mean for stability
-    #
+    kernel = gaussian_kernel(sigma, kernel_half_width, derivative)
     
     # Convolve waveform with derivative kernel
     smooth_wfs = np.array([convolve(wf, kernel, mode='same') for wf in wfs])
@@ -1 +1 @@
-from .GatorWfsLibs import (BslnCorr, trapezoidalFilt, gaussian_filter, gauss_filters, find_rel_maxima)
\ No newline at end of file
+from .GatorWfsLibs import (BslnCorr, trapezoidalFilt, gaussian_kernel, gaussian_filter, gauss_filters, find_rel_maxima)
\ No newline at end of file
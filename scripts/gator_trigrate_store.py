@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+
+#The imports here below must be in the $PYTHONPATH
+from GatorTrigRateStore import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import argparse
+from datetime import datetime
+
+#The imports here below must be in the $PYTHONPATH
+from GatorDaqProc import GatorDaqProc
+
+def parse_time(tstr):
+    #Accept both unix timestamps and ISO dates (e.g. 2025-03-01 or 2025-03-01T12:00)
+    if tstr is None:
+        return None
+    try:
+        return int(tstr)
+    except ValueError:
+        return int(datetime.fromisoformat(tstr).timestamp())
+    #
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute the trigger rate of already processed files with the "TrigRate" settings of the given configuration, into a new versioned series.')
+    parser.add_argument('config', help='GatorDaqProc json configuration file (the "TrigRate" section defines the selection).')
+    parser.add_argument('--runs', nargs='+', default=None, help='Patterns of the "dataset/run" relative paths to select (fnmatch syntax).')
+    parser.add_argument('--tstart', default=None, help='Start of the time range (unix time or ISO date).')
+    parser.add_argument('--tstop', default=None, help='Stop of the time range (unix time or ISO date).')
+    parser.add_argument('--version', default=None, help='Version tag of the new series (default: hash of the selection settings).')
+    parser.add_argument('--output', default=None, help='Output file (default: the "TrigRateFile" name with the version tag).')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: number of cpus).')
+    parser.add_argument('--overwrite', action='store_true', help='Overwrite the output series if it already exists.')
+    args = parser.parse_args()
+
+    daq_proc_obj = GatorDaqProc(args.config)
+    daq_proc_obj.RecomputeTrigRates(runs=args.runs,
+                                    tstart=parse_time(args.tstart),
+                                    tstop=parse_time(args.tstop),
+                                    version=args.version,
+                                    out_fpath=args.output,
+                                    n_workers=args.workers,
+                                    overwrite=args.overwrite
+                                    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+import argparse
+
+#The imports here below must be in the $PYTHONPATH
+from GatorDaqProc import GatorDaqProc
+
+def main():
+    parser = argparse.ArgumentParser(description='Reprocess the already processed files only for the processors whose settings changed in the given configuration (the other columns are reused).')
+    parser.add_argument('config', help='GatorDaqProc json configuration file (the "chs_map" section defines the processors).')
+    parser.add_argument('--runs', nargs='+', default=None, help='Patterns of the "dataset/run" relative paths to select (fnmatch syntax).')
+    parser.add_argument('--dry-run', action='store_true', help='Only report the files and the processors that would run again.')
+    args = parser.parse_args()
+
+    daq_proc_obj = GatorDaqProc(args.config)
+    daq_proc_obj.ReprocessChanged(runs=args.runs, dry_run=args.dry_run)
+
+if __name__ == "__main__":
+    main()